@@ -0,0 +1,100 @@
+"""
+Benchmark: AI-suggesties voor veel ongetagde regels ('/bulk_recommend_tags').
+
+Vergelijkt een recommend()-aanroep per regel (load()-controle en predict_proba
+per regel) met één recommend_batch() over alle regels, beide zonder
+voorspellingscache, en daarna recommend_batch() met cache bij terugkerende regels.
+
+Gebruik:
+    python benchmarks/bench_bulk_recommend.py [--rows 2000] [--training-rows 3000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+from openpyxl import Workbook
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tag_recommender import TagRecommender  # noqa: E402
+
+TAGS = ["4500;Huur gebouw", "4520;Gas, Water, Electra", "4980;Bankkosten", "8000;Contributies - Volwassenen",
+        "8010;Contributies - Jeugd", "8700;Koffie"]
+WORDS = {
+    "4500;Huur gebouw": ["huur", "zaal", "verhuurder", "opslag"],
+    "4520;Gas, Water, Electra": ["energie", "gas", "water", "stroom"],
+    "4980;Bankkosten": ["kosten", "rente", "betaalrekening", "pas"],
+    "8000;Contributies - Volwassenen": ["contributie", "lid", "volwassen", "seizoen"],
+    "8010;Contributies - Jeugd": ["contributie", "jeugdlid", "jeugd", "seizoen"],
+    "8700;Koffie": ["koffie", "thee", "melk", "bonen"],
+}
+
+
+def random_transaction(rng, tag):
+    words = rng.sample(WORDS[tag], 2) + [f"ref{rng.randint(1, 5000)}"]
+    return {
+        "mededelingen": " ".join(words),
+        "naam": f"Naam {rng.randint(1, 150)}",
+        "tegenrekening": f"NL{rng.randint(0, 89):02d}RABO0123456789",
+        "bedrag": f"{rng.uniform(1, 500):.2f}",
+    }
+
+
+def create_training_workbook(path, rows, rng):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["Mededelingen", "Naam / Omschrijving", "Tegenrekening", "Bedrag (EUR)", "Tag"])
+    for _ in range(rows):
+        tag = rng.choice(TAGS)
+        t = random_transaction(rng, tag)
+        ws.append([t["mededelingen"], t["naam"], t["tegenrekening"], float(t["bedrag"]), tag])
+    wb.save(path)
+    wb.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=2000, help="Aantal ongetagde regels")
+    parser.add_argument("--training-rows", type=int, default=3000, help="Aantal regels in de trainingsset")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        training = os.path.join(tmp_dir, "training.xlsx")
+        create_training_workbook(training, args.training_rows, rng)
+        recommender = TagRecommender(training, allowed_tags=TAGS, prediction_cache_size=0)
+        recommender.load()
+        transactions = [random_transaction(rng, rng.choice(TAGS)) for _ in range(args.rows)]
+
+        start = time.perf_counter()
+        per_row = [recommender.recommend(t, top_k=1) for t in transactions]
+        per_row_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        batch = recommender.recommend_batch(transactions, top_k=1)
+        batch_time = time.perf_counter() - start
+
+        # Terugkerende regels: een tiende van de teksten, elk tien keer (andere datum)
+        recurring = [dict(t, datum=f"2026-{i % 12 + 1:02d}-01") for i, t in enumerate(transactions[:args.rows // 10] * 10)]
+        cached = TagRecommender(training, allowed_tags=TAGS)
+        cached.load()
+        start = time.perf_counter()
+        cached.recommend_batch(recurring, top_k=1)
+        cached.recommend_batch(recurring, top_k=1)
+        cached_time = (time.perf_counter() - start) / 2
+        cache_stats = cached.prediction_cache.stats()
+
+    same = sum(a[0]["tag"] == b[0]["tag"] for a, b in zip(per_row, batch) if a and b)
+    print(f"Regels:                 {args.rows}")
+    print(f"Per regel recommend():  {per_row_time * 1000:8.1f} ms")
+    print(f"recommend_batch():      {batch_time * 1000:8.1f} ms  ({batch_time / per_row_time:.1%} van per regel)")
+    print(f"Zelfde top-1 tag:       {same}/{args.rows}")
+    print(f"Terugkerend, met cache: {cached_time * 1000:8.1f} ms  (gemiddeld over 2 runs; "
+          f"{cache_stats['misses']} voorspeld, {cache_stats['hits']} uit cache)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Benchmark: featurebackend "tfidf" (vocabulaire) tegenover "hashing" (vaste dimensie).
+
+Simuleert een groeiende trainingsset (meer boekjaren, steeds nieuwe IBAN's en namen)
+en rapporteert per backend naast elkaar: nauwkeurigheid op een vaste testset, aantal
+features, grootte van het gepickelde model, trainingstijd en transform-tijd.
+
+Gebruik:
+    python benchmarks/bench_feature_backend.py [--rows 5000 20000 40000] [--tags 40] [--test-rows 2000]
+"""
+import argparse
+import os
+import pickle
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tag_recommender  # noqa: E402
+from tag_recommender import TagRecommender  # noqa: E402
+
+SHARED_WORDS = ["betaling", "factuur", "overboeking", "incasso", "termijn", "periode", "nota", "ideal"]
+
+
+def make_tags(count, rng):
+    words = [f"kw{i}" for i in range(count * 6)]
+    return {f"{4000 + i * 10};Grootboek {i}": words[i * 6:(i + 1) * 6] for i in range(count)}
+
+
+def random_transaction(rng, keywords, year):
+    # Nieuwe boekjaren brengen nieuwe tegenrekeningen en namen mee
+    return {
+        "mededelingen": " ".join(rng.sample(keywords, 2) + rng.sample(SHARED_WORDS, 2) + [f"ref{rng.randint(1, 10 ** 6)}"]),
+        "naam": f"Relatie {year}-{rng.randint(1, 400)}",
+        "tegenrekening": f"NL{rng.randint(10, 99)}BANK{year}{rng.randint(0, 999999):06d}",
+        "bedrag": f"{rng.uniform(1, 500):.2f}",
+    }
+
+
+def make_samples(rng, tags, rows, year_from):
+    samples = []
+    names = list(tags)
+    for i in range(rows):
+        tag = rng.choice(names)
+        keywords = tags[tag] if rng.random() > 0.1 else tags[rng.choice(names)]  # Wat ruis
+        text = TagRecommender._transaction_text(random_transaction(rng, keywords, year_from + i * 5 // max(rows, 1)))
+        samples.append((text, tag))
+    return samples
+
+
+def measure(backend, train, test):
+    recommender = TagRecommender(None, feature_backend=backend)
+    texts, labels = zip(*train)
+    start = time.perf_counter()
+    model = recommender._batch_pipeline()
+    model.fit(texts, labels)
+    fit_time = time.perf_counter() - start
+
+    test_texts, test_labels = zip(*test)
+    start = time.perf_counter()
+    model[:-1].transform(test_texts)
+    transform_time = time.perf_counter() - start
+    accuracy = sum(p == t for p, t in zip(model.predict(test_texts), test_labels)) / len(test)
+
+    vectorizer = model[0]
+    features = len(vectorizer.vocabulary_) if hasattr(vectorizer, "vocabulary_") else vectorizer.n_features
+    return {
+        "accuracy": accuracy,
+        "features": features,
+        "pickle_mb": len(pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL)) / 1e6,
+        "coef_mb": model[-1].coef_.nbytes / 1e6,
+        "fit_s": fit_time,
+        "transform_us": transform_time / len(test) * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[5000, 20000, 40000], help="Groottes van de trainingsset")
+    parser.add_argument("--tags", type=int, default=40, help="Aantal tags (grootboekrekeningen)")
+    parser.add_argument("--test-rows", type=int, default=2000, help="Aantal regels in de testset")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    tags = make_tags(args.tags, rng)
+    test = make_samples(rng, tags, args.test_rows, year_from=2030)
+    print(f"Hashing: n_features={tag_recommender.HASHING_PARAMS['n_features']}, "
+          f"tfidf={tag_recommender.HASHING_PARAMS['tfidf']}; {args.tags} tags, testset {args.test_rows} regels")
+    print(f"{'Regels':>7} {'Backend':>8} {'Nauwk.':>7} {'Features':>9} {'Pickle MB':>10} {'Coef MB':>8} "
+          f"{'Fit s':>6} {'Transform us/regel':>19}")
+    for rows in args.rows:
+        train = make_samples(rng, tags, rows, year_from=2020)
+        for backend in tag_recommender.FEATURE_BACKENDS:
+            r = measure(backend, train, test)
+            print(f"{rows:>7} {backend:>8} {r['accuracy']:>7.3f} {r['features']:>9} {r['pickle_mb']:>10.1f} "
+                  f"{r['coef_mb']:>8.1f} {r['fit_s']:>6.1f} {r['transform_us']:>19.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark: heuristische tag-scoring (fallback zonder ML-model).
+
+Vergelijkt de oude aanpak (per aanroep een Python-lus over alle tags en tokens met
+math.log per token) met de gecompileerde token x tag matrix, voor een oplopend
+aantal tags. De tijd per aanroep van de matrix hoort nauwelijks te groeien met
+het aantal tags.
+
+Gebruik:
+    python benchmarks/bench_heuristic_scorer.py [--calls 2000] [--tags 10 40 160]
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tag_recommender import TagRecommender, TrainedModel  # noqa: E402
+
+
+def build_state(rng, tag_count, samples_per_tag=50):
+    state = TrainedModel()
+    vocabulary = [f"woord{i}" for i in range(tag_count * 8)]
+    for tag_idx in range(tag_count):
+        own = vocabulary[tag_idx * 8:(tag_idx + 1) * 8]
+        for _ in range(samples_per_tag):
+            tokens = rng.sample(own, 3) + rng.sample(vocabulary, 2) + [f"ref{rng.randint(1, 5000)}"]
+            state.add_sample(tokens, f"{1000 + tag_idx};Tag {tag_idx}")
+    return state, vocabulary
+
+
+def loop_scores(state, text, top_k):
+    """De oorspronkelijke implementatie, ter vergelijking."""
+    tokens = TagRecommender._tokenize(text)
+    tag_scores = {}
+    for tag in state.tag_token_freq:
+        score = 0.0
+        for token in tokens:
+            if token in state.tag_token_freq[tag]:
+                tf = state.tag_token_freq[tag][token]
+                idf = math.log(state.total_docs / max(state.token_doc_freq[token], 1)) if state.total_docs > 0 else 0
+                score += tf * idf
+        if score > 0:
+            tag_scores[tag] = score
+    sorted_tags = sorted(tag_scores.items(), key=lambda p: p[1], reverse=True)
+    return [{"tag": tag, "score": round(float(score), 4)} for tag, score in sorted_tags[:top_k]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=2000, help="Aantal aanroepen per meting")
+    parser.add_argument("--tags", type=int, nargs="+", default=[10, 40, 160], help="Aantallen tags")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    recommender = TagRecommender(None)
+    print(f"{'Tags':>6} {'Lus (us/aanroep)':>18} {'Matrix (us/aanroep)':>20} {'Matrix batch (us/regel)':>24}")
+    for tag_count in args.tags:
+        state, vocabulary = build_state(rng, tag_count)
+        state.compile_heuristic()
+        texts = [" ".join(rng.sample(vocabulary, 4)) for _ in range(args.calls)]
+
+        start = time.perf_counter()
+        expected = [loop_scores(state, text, 3) for text in texts]
+        loop_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        single = [recommender._recommend_heuristic(state, [text], 3)[0] for text in texts]
+        single_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        batch = recommender._recommend_heuristic(state, texts, 3)
+        batch_time = time.perf_counter() - start
+
+        # Scores vergelijken: bij exact gelijke scores op de grens van de top-k is de gekozen tag willekeurig
+        mismatches = sum(
+            [r["score"] for r in a] != [r["score"] for r in b] for a, b in zip(expected, single)
+        ) + sum(a != b for a, b in zip(single, batch))
+        print(f"{tag_count:>6} {loop_time / args.calls * 1e6:>18.1f} {single_time / args.calls * 1e6:>20.1f} "
+              f"{batch_time / args.calls * 1e6:>24.1f}" + (f"  ({mismatches} verschillen)" if mismatches else ""))
+
+
+if __name__ == "__main__":
+    main()
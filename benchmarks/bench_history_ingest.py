@@ -0,0 +1,82 @@
+"""
+Benchmark: inlezen van historische werkboeken (één per boekjaar).
+
+Vergelijkt het inlezen van één jaar met vijf jaar na elkaar, vijf jaar parallel
+(werkprocessen, zoals TagRecommender met history_paths) en vijf jaar uit de
+voorbeeldcache per werkboek.
+
+Gebruik:
+    python benchmarks/bench_history_ingest.py [--years 5] [--rows 20000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+from openpyxl import Workbook
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tag_recommender import TagRecommender, collect_samples  # noqa: E402
+
+TAGS = ["4500;Huur gebouw", "4520;Gas, Water, Electra", "4980;Bankkosten", "8000;Contributies - Volwassenen",
+        "8010;Contributies - Jeugd", "8700;Koffie"]
+
+
+def create_year_workbook(path, rows, rng, year):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["Datum", "Naam / Omschrijving", "Tegenrekening", "Bedrag (EUR)", "Mededelingen", "Tag"])
+    for i in range(rows):
+        tag = rng.choice(TAGS)
+        ws.append([f"{year}-{i % 12 + 1:02d}-01", f"Relatie {rng.randint(1, 300)}", f"NL{rng.randint(10, 99)}BANK{year}",
+                   round(rng.uniform(1, 500), 2), f"{tag.split(';')[1]} ref{rng.randint(1, 10 ** 6)}", tag])
+    wb.save(path)
+    wb.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--years", type=int, default=5, help="Aantal historische boekjaren")
+    parser.add_argument("--rows", type=int, default=20000, help="Regels per boekjaar")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = []
+        for year in range(2020, 2020 + args.years):
+            os.makedirs(os.path.join(tmp_dir, str(year)))
+            paths.append(os.path.join(tmp_dir, str(year), "grootboek.xlsx"))
+            create_year_workbook(paths[-1], args.rows, rng, year)
+        recommender = TagRecommender(None, allowed_tags=TAGS, cache_dir=os.path.join(tmp_dir, "cache"),
+                                     history_paths=os.path.join(tmp_dir, "*", "grootboek.xlsx"))
+        history = {path: f"bench-{idx}" for idx, path in enumerate(recommender._history_files())}
+
+        start = time.perf_counter()
+        collect_samples(paths[0], TAGS)
+        one_year = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for path in paths:
+            collect_samples(path, TAGS)
+        sequential = time.perf_counter() - start
+
+        start = time.perf_counter()
+        samples = [s for per_file in recommender._history_samples(history)[0].values() for s in per_file]
+        parallel = time.perf_counter() - start
+
+        start = time.perf_counter()
+        cached = [s for per_file in recommender._history_samples(history)[0].values() for s in per_file]
+        warm = time.perf_counter() - start
+
+    print(f"Boekjaren: {args.years} x {args.rows} regels, {os.cpu_count()} CPU's, {len(samples)} voorbeelden")
+    print(f"Eén jaar:                {one_year:6.2f} s")
+    print(f"Alle jaren na elkaar:    {sequential:6.2f} s")
+    print(f"Alle jaren parallel:     {parallel:6.2f} s  ({parallel / one_year:.1f}x één jaar)")
+    print(f"Alle jaren uit cache:    {warm:6.2f} s  (zelfde voorbeelden: {cached == samples})")
+
+
+if __name__ == "__main__":
+    main()
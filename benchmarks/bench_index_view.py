@@ -0,0 +1,114 @@
+"""
+Benchmark: opbouw van het overzicht voor de hoofdpagina ('/').
+
+Vergelijkt de oude aanpak (vier losse doorlopen van het werkbestand: saldo,
+ongetagde transacties, alle transacties en statistieken) met de enkele
+doorloop van TransactionStore plus het (koud) vullen van de SQLite-index.
+
+Gebruik:
+    python benchmarks/bench_index_view.py [--rows 3000] [--repeat 3]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from openpyxl import Workbook, load_workbook
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transaction_index import TransactionIndex  # noqa: E402
+from transaction_store import TransactionStore  # noqa: E402
+
+SHEETS = ["Bankrekening", "Spaarrekening 1", "Spaarrekening 2"]
+HEADERS = ["Datum", "Naam / Omschrijving", "Rekening", "Tegenrekening", "Code", "Af Bij",
+           "Bedrag (EUR)", "Mutatiesoort", "Mededelingen", "Saldo na mutatie", "", "Tag"]
+TAGS = ["4500;Huur gebouw", "4520;Gas, Water, Electra", "4980;Bankkosten", "8000;Contributies - Volwassenen", "8700;Koffie"]
+
+
+def create_workbook(path, rows):
+    """Maak een synthetisch boekjaar met `rows` regels op de hoofdtab."""
+    rng = random.Random(42)
+    wb = Workbook()
+    start = datetime(2026, 1, 1)
+    for sheet_idx, name in enumerate(SHEETS):
+        ws = wb.active if sheet_idx == 0 else wb.create_sheet()
+        ws.title = name
+        ws.append(HEADERS)
+        count = rows if sheet_idx == 0 else max(rows // 20, 1)
+        for i in range(count):
+            tag = rng.choice(TAGS) if rng.random() < 0.8 else ''
+            ws.append([
+                start + timedelta(days=i % 365), f"Naam {i % 150}", "NL01INGB0001234567",
+                f"NL{i % 90:02d}RABO0123456789", "GT", rng.choice(["Af", "Bij"]),
+                round(rng.uniform(1, 500), 2), "Online bankieren", f"Omschrijving {i % 300}",
+                round(rng.uniform(-1000, 5000), 2), '', tag,
+            ])
+    wb.save(path)
+    wb.close()
+
+
+def legacy_index_view(path):
+    """Oude aanpak: elke helper opent en doorloopt het werkbestand opnieuw."""
+    wb = load_workbook(path)
+    total = 0
+    for af_bij, amount in wb[SHEETS[0]].iter_rows(min_row=2, min_col=6, max_col=7, values_only=True):
+        if isinstance(amount, (int, float)):
+            total += -amount if af_bij == "Af" else amount if af_bij == "Bij" else 0
+    for _ in range(3):  # ongetagd, alle transacties, statistieken
+        wb = load_workbook(path, read_only=True, data_only=True)
+        for name in SHEETS:
+            for row in wb[name].iter_rows(min_row=2, values_only=True):
+                str(row[11] or '').strip()
+        wb.close()
+
+
+def single_pass_index_view(path):
+    """Nieuwe aanpak: één doorloop (koude cache en lege index) levert alle vier de onderdelen."""
+    store = TransactionStore(SHEETS)
+    index = TransactionIndex(store)
+    db_path = index.db_path_for(path)
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    index.sync(path)
+    return (store.get(path).totals, index.untagged(SHEETS),
+            [index.transactions(name) for name in SHEETS], index.stats(SHEETS))
+
+
+def best_of(func, path, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(path)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=3000, help="Aantal regels op de hoofdtab")
+    parser.add_argument("--repeat", type=int, default=3, help="Aantal herhalingen (beste tijd telt)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "bench.xlsx")
+        create_workbook(path, args.rows)
+
+        legacy = best_of(legacy_index_view, path, args.repeat)
+        single = best_of(single_pass_index_view, path, args.repeat)
+
+        store = TransactionStore(SHEETS)
+        store.get(path)
+        warm = best_of(lambda p: store.get(p), path, args.repeat)
+
+    print(f"Regels hoofdtab:        {args.rows}")
+    print(f"Oud (4 doorlopen):      {legacy * 1000:8.1f} ms")
+    print(f"Nieuw (1 doorloop):     {single * 1000:8.1f} ms  ({single / legacy:.0%} van oud)")
+    print(f"Nieuw (warme cache):    {warm * 1000:8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Benchmark: recente transacties ('/get_transactions') bij groeiende tablengte.
+
+Vergelijkt de oude aanpak (volledige load_workbook in bewerkmodus en daarna de
+eerste regels lezen) met TransactionStore.head, dat de tab streamt en stopt
+zodra er `limit` regels gevonden zijn. De gestreamde tijd hoort vlak te blijven
+van 1k tot 100k regels.
+
+Gebruik:
+    python benchmarks/bench_recent_transactions.py [--sizes 1000 10000 100000] [--limit 10]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from openpyxl import Workbook, load_workbook
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transaction_store import TransactionStore  # noqa: E402
+
+SHEET = "Bankrekening"
+HEADERS = ["Datum", "Naam / Omschrijving", "Rekening", "Tegenrekening", "Code", "Af Bij",
+           "Bedrag (EUR)", "Mutatiesoort", "Mededelingen", "Saldo na mutatie", "", "Tag"]
+
+
+def create_workbook(path, rows):
+    """Maak een werkbestand met `rows` regels, nieuwste bovenaan (prepend)."""
+    rng = random.Random(42)
+    # Geen write_only: die modus laat het <dimension> element weg, waardoor openpyxl (net als bij
+    # sommige exports) bij het openen de hele tab doorloopt. Excel zelf schrijft het wel.
+    wb = Workbook()
+    ws = wb.active
+    ws.title = SHEET
+    ws.append(HEADERS)
+    start = datetime(2026, 12, 31)
+    for i in range(rows):
+        ws.append([
+            start - timedelta(days=i // 10), f"Naam {i % 150}", "NL01INGB0001234567",
+            f"NL{i % 90:02d}RABO0123456789", "GT", rng.choice(["Af", "Bij"]),
+            round(rng.uniform(1, 500), 2), "Online bankieren", f"Omschrijving {i % 300}",
+            round(rng.uniform(-1000, 5000), 2), '', '',
+        ])
+    wb.save(path)
+    wb.close()
+
+
+def legacy_recent(path, limit):
+    """Oude aanpak: volledig inlezen, daarna de eerste regels."""
+    wb = load_workbook(path)
+    rows = []
+    for row in wb[SHEET].iter_rows(min_row=2, max_row=limit + 1, values_only=True):
+        if row[0]:
+            rows.append(row)
+    wb.close()
+    return rows
+
+
+def streamed_recent(path, limit):
+    """Nieuwe aanpak: koude opslag, streamen met vroege stop."""
+    return TransactionStore([SHEET]).head(path, SHEET, limit)
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="Tablengtes")
+    parser.add_argument("--limit", type=int, default=10, help="Aantal recente transacties")
+    parser.add_argument("--repeat", type=int, default=3, help="Aantal herhalingen (beste tijd telt)")
+    parser.add_argument("--legacy-max-rows", type=int, default=20000,
+                        help="Oude aanpak alleen meten tot deze tablengte (duurt anders erg lang)")
+    args = parser.parse_args()
+
+    print(f"{'Regels':>8} | {'Oud (volledig)':>15} | {'Gestreamd':>10}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in args.sizes:
+            path = os.path.join(tmp_dir, f"bench_{size}.xlsx")
+            create_workbook(path, size)
+            assert len(streamed_recent(path, args.limit)) == min(args.limit, size)
+
+            streamed = best_of(lambda: streamed_recent(path, args.limit), args.repeat)
+            if size <= args.legacy_max_rows:
+                legacy = f"{best_of(lambda: legacy_recent(path, args.limit), 1) * 1000:12.1f} ms"
+            else:
+                legacy = f"{'overgeslagen':>15}"
+            print(f"{size:>8} | {legacy:>15} | {streamed * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""
+Benchmark- en nauwkeurigheidssuite voor de TagRecommender.
+
+Genereert synthetische grootboeken (standaard 1k/10k/100k regels) over de tags uit
+config.json en meet per grootte:
+- _collect_dataset: inlezen van het Excel bestand
+- load(): inlezen + trainen (zonder modelcache), met piekgeheugen (tracemalloc)
+- recommend(): latentie per losse aanroep (p50/p99), zonder voorspellingscache
+- recommend_batch(): doorvoer in regels per seconde, zonder voorspellingscache
+
+Daarnaast gekruisvalideerde top-1/top-3 nauwkeurigheid op de trainingsset
+(static/category_test_set.xlsx, of het synthetische grootboek van 10k regels als
+die ontbreekt), en de afweging nauwkeurigheid/traintijd voor verschillende limieten
+per tag (max_samples_per_tag), met en zonder recency-weging, op een synthetische
+historie van vijf boekjaren waarin relaties en bedragen per jaar verschuiven.
+Resultaten gaan naar een JSON-bestand; met --compare worden ze naast een eerder
+resultaat gezet.
+
+Gebruik:
+    python benchmarks/bench_recommender.py [--sizes 1000 10000 100000] [--output pad.json]
+                                           [--compare vorige.json] [--feature-backend tfidf|hashing]
+                                           [--caps 0 1000 250 50] [--cap-rows 20000] [--recency-decay 0.7]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+from datetime import datetime
+
+import numpy as np
+import sklearn
+from openpyxl import Workbook
+from sklearn.model_selection import StratifiedKFold
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tag_recommender import FEATURE_BACKENDS, TagRecommender  # noqa: E402
+
+SHARED_WORDS = ["betaling", "factuur", "overboeking", "incasso", "termijn", "periode", "nota", "ideal", "sepa"]
+HEADER = ["Mededelingen", "Naam / Omschrijving", "Tegenrekening", "Bedrag (EUR)", "Tag"]
+LATENCY_CALLS = 500
+BATCH_ROWS = 5000
+
+
+def make_profiles(tags, rng):
+    """Per tag vaste trefwoorden, terugkerende relaties (naam + IBAN) en een bedragbereik."""
+    profiles = {}
+    for idx, tag in enumerate(tags):
+        words = [f"{tag.split(';')[-1].split()[0].lower()}{i}" for i in range(4)] + [f"kw{idx}x{i}" for i in range(4)]
+        relations = [(f"Relatie {idx}-{i}", f"NL{rng.randint(10, 99)}BANK{rng.randint(0, 10 ** 9):010d}")
+                     for i in range(rng.randint(2, 12))]
+        low = rng.uniform(1, 200)
+        profiles[tag] = (words, relations, (low, low * rng.uniform(1.1, 5)))
+    return profiles
+
+
+def random_transaction(rng, profile):
+    words, relations, (low, high) = profile
+    naam, iban = rng.choice(relations)
+    return {
+        "mededelingen": " ".join(rng.sample(words, 2) + rng.sample(SHARED_WORDS, 2) + [f"ref{rng.randint(1, 10 ** 6)}"]),
+        "naam": naam,
+        "tegenrekening": iban,
+        "bedrag": f"{rng.uniform(low, high):.2f}",
+    }
+
+
+def make_ledger(rng, profiles, rows, noise=0.1):
+    """Lijst van (transactie, tag); bij een deel van de regels komt de tekst van een andere tag."""
+    tags = list(profiles)
+    ledger = []
+    for _ in range(rows):
+        tag = rng.choice(tags)
+        source = tag if rng.random() > noise else rng.choice(tags)
+        ledger.append((random_transaction(rng, profiles[source]), tag))
+    return ledger
+
+
+def write_ledger(path, ledger):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(HEADER)
+    for t, tag in ledger:
+        ws.append([t["mededelingen"], t["naam"], t["tegenrekening"], float(t["bedrag"]), tag])
+    wb.save(path)
+    wb.close()
+
+
+def percentile_ms(samples, q):
+    return round(float(np.percentile(samples, q)) * 1000, 3)
+
+
+def bench_size(rows, tags, profiles, seed, tmp_dir, feature_backend):
+    rng = random.Random(seed * 1_000_003 + rows)  # Zelfde grootboek per grootte, ongeacht --sizes
+    path = os.path.join(tmp_dir, f"ledger-{rows}.xlsx")
+    write_ledger(path, make_ledger(rng, profiles, rows))
+    result = {"rows": rows}
+
+    recommender = TagRecommender(path, allowed_tags=tags, prediction_cache_size=0, feature_backend=feature_backend)
+    start = time.perf_counter()
+    samples = recommender._collect_dataset(path)
+    result["collect_dataset_s"] = round(time.perf_counter() - start, 3)
+    result["samples"] = len(samples)
+
+    start = time.perf_counter()
+    recommender.load()
+    result["load_s"] = round(time.perf_counter() - start, 3)
+
+    # Piekgeheugen apart meten: tracemalloc vertraagt zelf
+    measured = TagRecommender(path, allowed_tags=tags, prediction_cache_size=0, feature_backend=feature_backend)
+    tracemalloc.start()
+    measured.load()
+    result["load_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 1e6, 1)
+    tracemalloc.stop()
+    del measured
+
+    queries = [random_transaction(rng, profiles[rng.choice(tags)]) for _ in range(max(LATENCY_CALLS, BATCH_ROWS))]
+    latencies = []
+    for transaction in queries[:LATENCY_CALLS]:
+        start = time.perf_counter()
+        recommender.recommend(transaction)
+        latencies.append(time.perf_counter() - start)
+    result["recommend_p50_ms"] = percentile_ms(latencies, 50)
+    result["recommend_p99_ms"] = percentile_ms(latencies, 99)
+
+    start = time.perf_counter()
+    recommender.recommend_batch(queries[:BATCH_ROWS])
+    result["batch_rows_per_s"] = round(BATCH_ROWS / (time.perf_counter() - start))
+    return result
+
+
+def cross_validate(recommender, samples, folds):
+    """Gestratificeerde k-fold: top-1/top-3 nauwkeurigheid van de batch-pipeline."""
+    texts = np.array([text for text, _ in samples], dtype=object)
+    labels = np.array([tag for _, tag in samples], dtype=object)
+    top1 = top3 = 0
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # Zeldzame tags met minder voorbeelden dan folds
+        splitter = StratifiedKFold(n_splits=folds, shuffle=True, random_state=0)
+        for train_idx, test_idx in splitter.split(texts, labels):
+            model = recommender._batch_pipeline()
+            model.fit(list(texts[train_idx]), list(labels[train_idx]))
+            proba = model.predict_proba(list(texts[test_idx]))
+            ranked = model.classes_[np.argsort(-proba, axis=1)[:, :3]]
+            expected = labels[test_idx]
+            top1 += int((ranked[:, 0] == expected).sum())
+            top3 += int((ranked == expected[:, None]).any(axis=1).sum())
+    return {"samples": len(samples), "folds": folds, "top1": round(top1 / len(samples), 4),
+            "top3": round(top3 / len(samples), 4)}
+
+
+def cap_tradeoff(tags, seed, caps, rows, decay, feature_backend, years=5):
+    """Traintijd en nauwkeurigheid (op het nieuwste jaar) per limiet, zonder en met recency-weging."""
+    groups = []
+    for year in range(years):
+        profiles = make_profiles(tags, random.Random(seed + year))  # Relaties en bedragen verschuiven per jaar
+        ledger = make_ledger(random.Random(seed * 31 + year), profiles, rows // years)
+        groups.append(([(TagRecommender._transaction_text(t), tag) for t, tag in ledger], years - 1 - year))
+    test = make_ledger(random.Random(seed + 999), profiles, 2000)
+    test_texts = [TagRecommender._transaction_text(t) for t, _ in test]
+    expected = np.array([tag for _, tag in test], dtype=object)
+
+    results = []
+    for cap in caps:
+        for recency_decay in dict.fromkeys((1.0, decay)):
+            recommender = TagRecommender(None, allowed_tags=tags, feature_backend=feature_backend,
+                                         max_samples_per_tag=cap or None, recency_decay=recency_decay)
+            start = time.perf_counter()
+            texts, labels, weights = recommender._bounded_training_set(groups)
+            model = recommender._batch_pipeline()
+            model.fit(texts, labels, **{f"{model.steps[-1][0]}__sample_weight": weights})
+            fit_time = time.perf_counter() - start
+            ranked = model.classes_[np.argsort(-model.predict_proba(test_texts), axis=1)[:, :3]]
+            results.append({
+                "max_samples_per_tag": cap or None,
+                "recency_decay": recency_decay,
+                "samples": len(texts),
+                "fit_s": round(fit_time, 3),
+                "top1": round(float((ranked[:, 0] == expected).mean()), 4),
+                "top3": round(float((ranked == expected[:, None]).any(axis=1).mean()), 4),
+            })
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_comparison(current, previous):
+    """Zet de metingen per grootte naast een eerder resultaat (relatieve verandering)."""
+    print(f"\nVergelijking met {previous.get('git_commit') or '?'} ({previous.get('generated_at')}):")
+    before = {entry["rows"]: entry for entry in previous.get("sizes", [])}
+    for entry in current["sizes"]:
+        old = before.get(entry["rows"])
+        if not old:
+            continue
+        changes = []
+        for metric, value in entry.items():
+            if metric in ("rows", "samples") or not old.get(metric):
+                continue
+            changes.append(f"{metric} {value / old[metric] - 1:+.0%}")
+        print(f"  {entry['rows']:>7}: " + ", ".join(changes))
+    if previous.get("accuracy") and current.get("accuracy"):
+        print(f"  nauwkeurigheid: top-1 {previous['accuracy']['top1']} -> {current['accuracy']['top1']}, "
+              f"top-3 {previous['accuracy']['top3']} -> {current['accuracy']['top3']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="Aantallen regels")
+    parser.add_argument("--config", default=os.path.join(ROOT, "config.json"), help="Config met de tags")
+    parser.add_argument("--training", default=os.path.join(ROOT, "static", "category_test_set.xlsx"),
+                        help="Trainingsset voor de kruisvalidatie")
+    parser.add_argument("--folds", type=int, default=5, help="Aantal folds voor de kruisvalidatie")
+    parser.add_argument("--feature-backend", choices=FEATURE_BACKENDS, default="tfidf")
+    parser.add_argument("--caps", type=int, nargs="*", default=[0, 1000, 250, 50],
+                        help="Limieten per tag voor de afweging (0 = geen limiet; leeg = overslaan)")
+    parser.add_argument("--cap-rows", type=int, default=20000, help="Regels in de synthetische historie")
+    parser.add_argument("--recency-decay", type=float, default=0.7, help="Gewicht per boekjaar ouder")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="JSON-bestand (standaard benchmarks/results/recommender-<tijd>.json)")
+    parser.add_argument("--compare", help="Eerder JSON-resultaat om mee te vergelijken")
+    args = parser.parse_args()
+
+    with open(args.config, "r", encoding="utf-8") as handle:
+        tags = json.load(handle)["tags"]
+    profiles = make_profiles(tags, random.Random(args.seed))
+
+    report = {
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "sklearn": sklearn.__version__,
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "tags": len(tags),
+        "feature_backend": args.feature_backend,
+        "sizes": [],
+    }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for rows in args.sizes:
+            result = bench_size(rows, tags, profiles, args.seed, tmp_dir, args.feature_backend)
+            report["sizes"].append(result)
+            print(f"{rows:>7} regels: inlezen {result['collect_dataset_s']:.2f}s, load {result['load_s']:.2f}s "
+                  f"(piek {result['load_peak_mb']} MB), recommend p50 {result['recommend_p50_ms']} ms / "
+                  f"p99 {result['recommend_p99_ms']} ms, batch {result['batch_rows_per_s']} regels/s")
+
+        source = args.training
+        if not os.path.exists(source):
+            source = os.path.join(tmp_dir, "cv-ledger.xlsx")
+            write_ledger(source, make_ledger(random.Random(args.seed), profiles, 10000))
+            print(f"Trainingsset {args.training} niet gevonden; kruisvalidatie op synthetisch grootboek (10k)")
+        recommender = TagRecommender(source, allowed_tags=tags, feature_backend=args.feature_backend)
+        accuracy = cross_validate(recommender, recommender._collect_dataset(source), args.folds)
+        accuracy["source"] = "synthetisch" if source != args.training else os.path.relpath(source, ROOT)
+        report["accuracy"] = accuracy
+        print(f"Kruisvalidatie ({accuracy['folds']} folds, {accuracy['samples']} voorbeelden): "
+              f"top-1 {accuracy['top1']:.1%}, top-3 {accuracy['top3']:.1%}")
+
+    if args.caps:
+        report["caps"] = cap_tradeoff(tags, args.seed, args.caps, args.cap_rows, args.recency_decay,
+                                      args.feature_backend)
+        print(f"\nLimiet per tag ({args.cap_rows} regels over 5 boekjaren, test op het nieuwste jaar):")
+        print(f"{'Limiet':>7} {'Decay':>6} {'Voorbeelden':>12} {'Fit s':>7} {'Top-1':>6} {'Top-3':>6}")
+        for entry in report["caps"]:
+            print(f"{entry['max_samples_per_tag'] or '-':>7} {entry['recency_decay']:>6} {entry['samples']:>12} "
+                  f"{entry['fit_s']:>7.2f} {entry['top1']:>6.3f} {entry['top3']:>6.3f}")
+
+    output = args.output or os.path.join(ROOT, "benchmarks", "results",
+                                         f"recommender-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as handle:
+        json.dump(report, handle, indent=2)
+    print(f"Resultaten opgeslagen in {output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as handle:
+            print_comparison(report, json.load(handle))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+In-process job runner voor langlopende bulkacties.
+Een job wordt in een begrensde pool van achtergrondthreads uitgevoerd; de aanvraag
+die hem start krijgt direct een job-id terug. Voortgang, (tussen)resultaten en
+annuleren lopen via dat id, zodat lange acties geen request-thread bezet houden.
+"""
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+# Mogelijke toestanden van een job; de laatste drie zijn eindtoestanden
+JOB_STATES = ("queued", "running", "done", "failed", "cancelled")
+FINISHED_STATES = ("done", "failed", "cancelled")
+
+
+class JobCancelled(Exception):
+    """Wordt door Job.report() opgegooid als de job geannuleerd is."""
+
+
+class Job:
+    """Eén achtergrondtaak met voortgang, resultaten en een annuleringsvlag."""
+
+    def __init__(self, job_id: str, kind: str):
+        self.id = job_id
+        self.kind = kind
+        self.state = "queued"
+        self.done = 0
+        self.total: Optional[int] = None
+        self.results: List[dict] = []  # Groeit tijdens het uitvoeren; te lezen vanaf een offset
+        self.summary: dict = {}
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel.is_set()
+
+    def report(self, done: int, total: Optional[int] = None, results: Optional[List[dict]] = None) -> None:
+        """Werk de voortgang bij en voeg resultaten toe; stopt de job als annuleren gevraagd is."""
+        with self._lock:
+            self.done = done
+            if total is not None:
+                self.total = total
+            if results:
+                self.results.extend(results)
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def to_dict(self, offset: int = 0) -> dict:
+        """Geef de status van de job terug, met de resultaten vanaf offset."""
+        with self._lock:
+            return {
+                "id": self.id,
+                "kind": self.kind,
+                "state": self.state,
+                "progress": {"done": self.done, "total": self.total},
+                "offset": offset,
+                "results": self.results[offset:],
+                "result_count": len(self.results),
+                **self.summary,
+                "error": self.error,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+            }
+
+
+class JobRunner:
+    """Voert jobs uit in een begrensde threadpool en onthoudt de laatste afgeronde jobs."""
+
+    def __init__(self, max_workers: int = 2, max_finished: int = 50):
+        self.max_finished = max_finished
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="job")
+
+    def submit(self, kind: str, func: Callable[[Job], Optional[dict]]) -> Job:
+        """Zet een job in de wachtrij; func(job) meldt voortgang via job.report() en geeft een samenvatting terug."""
+        with self._lock:
+            job = Job(f"{next(self._ids)}-{int(time.time() * 1000):x}", kind)
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job, func)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Vraag annuleren aan. Een job in de wachtrij start niet meer, een lopende stopt bij de volgende report()."""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        with job._lock:
+            if job.state not in FINISHED_STATES:
+                job._cancel.set()
+                if job.state == "queued":
+                    job.state = "cancelled"
+                    job.finished_at = time.time()
+        return job
+
+    def counts(self) -> Dict[str, int]:
+        """Aantal bekende jobs per toestand."""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return {state: sum(1 for job in jobs if job.state == state) for state in JOB_STATES}
+
+    def close(self) -> None:
+        """Annuleer alle openstaande jobs en wacht tot lopende jobs gestopt zijn."""
+        with self._lock:
+            job_ids = list(self._jobs)
+        for job_id in job_ids:
+            self.cancel(job_id)
+        self._executor.shutdown(wait=True)
+
+    def _run(self, job: Job, func: Callable[[Job], Optional[dict]]) -> None:
+        with job._lock:
+            if job.state != "queued":
+                return  # Geannuleerd voordat hij aan de beurt was
+            job.state = "running"
+            job.started_at = time.time()
+        try:
+            summary = func(job) or {}
+            state, error = "done", None
+        except JobCancelled:
+            summary, state, error = {}, "cancelled", None
+        except Exception as e:  # noqa: BLE001
+            logging.error("Job %s (%s) mislukt: %s", job.id, job.kind, e)
+            summary, state, error = {}, "failed", str(e)
+        with job._lock:
+            job.summary = summary
+            job.state = state
+            job.error = error
+            job.finished_at = time.time()
+        with self._lock:
+            self._prune()
+
+    def _prune(self) -> None:
+        # Alleen afgeronde jobs vergeten, oudste eerst; lopende en wachtende jobs blijven altijd bewaard
+        finished = [job_id for job_id, job in self._jobs.items() if job.state in FINISHED_STATES]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
@@ -1,36 +1,405 @@
 """
 Eenvoudige tag-recommender op basis van een trainingsset in Excel.
 Gebruikt een bag-of-words benadering met IDF-weging om per tag een score te berekenen.
+
+Het getrainde model (of de heuristische tabellen) wordt in een cachemap bewaard,
+met als sleutel een hash van de inhoud van de bronbestanden, de toegestane tags en
+de modelparameters. Bij een ongewijzigde sleutel wordt het model ingelezen in plaats
+van opnieuw getraind.
+
+In de modus "online" wordt een lineair model over een gehashte (staatloze)
+featureruimte gebruikt: tags die via de app worden toegekend, worden direct met
+partial_fit geleerd (learn), en een volledige hertraining gebeurt alleen na een
+aantal updates of na verloop van tijd.
+
+Met background_training gebeurt (her)training in een achtergrondthread: gelijktijdige
+aanleidingen leiden tot één training (single-flight), aanvragen gebruiken intussen het
+vorige model en het nieuwe model wordt na het trainen in één keer ingewisseld.
+
+Historische werkboeken (één per boekjaar, als lijst of glob in history_paths) worden
+parallel in werkprocessen ingelezen; de voorbeelden per bestand worden op inhoudshash
+in de cachemap bewaard, zodat alleen nieuwe of gewijzigde jaren opnieuw gelezen worden.
+
+De trainingsset kan begrensd worden: hooguit max_samples_per_tag voorbeelden per tag
+(reservoir sampling, deterministisch) en met recency_decay tellen oudere boekjaren minder
+zwaar mee (sample_weight), zodat de traintijd niet onbeperkt meegroeit met de historie.
+
+Het werkbestand kan als additional_rows (al ingelezen transacties uit de app) worden
+aangeleverd in plaats van als bestand; alleen de statische trainingsset wordt dan nog
+uit Excel gelezen. Uit die rijen wordt ook een regeltabel gebouwd: een combinatie van
+tegenrekening en naam die altijd dezelfde tag kreeg, krijgt die tag direct (score 1.0)
+zonder het model te raadplegen; tegenstrijdige combinaties gaan naar het model.
+
+De featurebackend van de batch-modus is instelbaar: "tfidf" (vocabulaire, groeit met de
+data) of "hashing" (vaste dimensie, geen vocabulaire, optioneel TF-IDF-herweging).
 """
+import glob
+import hashlib
+import json
 import logging
-import math
+import multiprocessing
 import os
+import pickle
+import random
 import re
-from collections import Counter, defaultdict
-from typing import Dict, List, Tuple
+import tempfile
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from typing import Callable, Dict, Iterable, List, Tuple
 
+import numpy as np
+import sklearn
+from scipy import sparse
 from openpyxl import load_workbook
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.linear_model import LogisticRegression
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer, TfidfVectorizer
+from sklearn.linear_model import LogisticRegression, SGDClassifier
 from sklearn.pipeline import make_pipeline
 
 TOKEN_RE = re.compile(r"[A-Za-z0-9]+")
 
+# Hyperparameters van de ML pipeline; onderdeel van de cachesleutel
+MODEL_PARAMS = {"ngram_range": (1, 2), "min_df": 1, "max_iter": 1000}
+# Modus "online": gehashte features + SGD met log-loss, zodat losse voorbeelden bijgeleerd kunnen worden
+RECOMMENDER_MODES = ("batch", "online")
+ONLINE_PARAMS = {"n_features": 2 ** 18, "alpha": 1e-4, "epochs": 5}
+# Featurebackend (batch-modus): "hashing" heeft een vaste dimensie, dus voorspelbaar geheugen
+FEATURE_BACKENDS = ("tfidf", "hashing")
+HASHING_PARAMS = {"n_features": 2 ** 16, "tfidf": True}
+# Ophogen als de vorm van de opgeslagen toestand wijzigt
+CACHE_FORMAT = 4
+
+
+def _file_digest(path: str) -> str:
+    """Hash van de bestandsinhoud (in blokken gelezen)."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as handle:
+        for block in iter(lambda: handle.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _rule_key(transaction: Dict[str, object]) -> Tuple[str, str] | None:
+    """Genormaliseerde (tegenrekening, naam) van een transactie; None als een van beide ontbreekt."""
+    tegen = str(transaction.get("tegenrekening") or "").strip().upper()
+    naam = " ".join(str(transaction.get("naam") or transaction.get("omschrijving") or "").lower().split())
+    if not tegen or not naam:
+        return None
+    return tegen, naam
+
+
+def _atomic_pickle(target: str, value) -> None:
+    """Schrijf een pickle via een tijdelijk bestand, zodat lezers nooit een half bestand zien."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as handle:
+            pickle.dump(value, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, target)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def collect_samples(path: str, allowed_tags: Iterable[str] = (), strict: bool = False) -> List[tuple[str, str]]:
+    """Lees een Excelbestand en verzamel (text, tag) voorbeelden. Draait ook in werkprocessen.
+
+    Leesfouten worden gelogd en geven een (deel)lijst terug; met strict=True worden ze doorgegeven,
+    zodat de aanroeper een mislukte lezing niet als volledige set voorbeelden bewaart.
+    """
+    allowed_tags = set(allowed_tags)
+    samples: List[tuple[str, str]] = []
+    wb = None
+    try:
+        wb = load_workbook(path, read_only=True, data_only=True)
+        for sheet in wb.worksheets:
+            first_row = next(sheet.iter_rows(min_row=1, max_row=1, values_only=True), ())
+            if not first_row:
+                continue
+            header = [str(val).strip() if val is not None else "" for val in first_row]
+            normalized = [str(col).strip().lower() for col in header]
+            lookup = {name: idx for idx, name in enumerate(normalized)}
+
+            # Zoek tag kolom
+            tag_col = None
+            for candidate in ("tag", "tags", "categorie", "category"):
+                if candidate in lookup:
+                    tag_col = lookup[candidate]
+                    break
+            if tag_col is None:
+                continue
+
+            # Zoek tekstkolommen
+            text_cols = []
+            for candidate in (
+                "naam / omschrijving",
+                "naam/omschrijving",
+                "mededeling",
+                "mededelingen",
+                "omschrijving",
+                "rekening",
+                "tegenrekening",
+                "mutatiesoort",
+                "memo",
+                "code",
+                "description",
+            ):
+                if candidate in lookup:
+                    text_cols.append(lookup[candidate])
+            if not text_cols:
+                text_cols = [idx for idx in range(len(header)) if idx != tag_col]
+
+            # Zoek bedrag kolom (optioneel)
+            amount_col = None
+            for candidate in ("bedrag (eur)", "bedrag", "amount"):
+                if candidate in lookup:
+                    amount_col = lookup[candidate]
+                    break
+
+            for row in sheet.iter_rows(min_row=2, values_only=True):
+                if not row or len(row) <= tag_col:
+                    continue
+                tag_val = str(row[tag_col] or "").strip()
+                if not tag_val:
+                    continue
+                if allowed_tags and tag_val not in allowed_tags:
+                    continue
+
+                parts: List[str] = []
+                for idx in text_cols:
+                    if idx < len(row) and row[idx] not in (None, ""):
+                        parts.append(str(row[idx]))
+
+                # Voeg bedrag als speciaal token toe
+                if amount_col is not None and amount_col < len(row) and row[amount_col] not in (None, ""):
+                    try:
+                        amount_val = float(str(row[amount_col]).replace(",", "."))
+                        parts.append(f"AMT_{round(amount_val)}")
+                    except (ValueError, TypeError):
+                        pass
+
+                if not parts:
+                    continue
+
+                combined = " ".join(parts)
+                samples.append((combined, tag_val))
+    except Exception as exc:  # noqa: BLE001
+        if strict:
+            raise
+        logging.error("Fout bij laden dataset uit %s: %s", path, exc)
+    finally:
+        if wb:
+            wb.close()
+    return samples
+
+
+class TrainedModel:
+    """Resultaat van één training: ML-pipeline of heuristische tabellen, plus metadata.
+
+    Wordt in zijn geheel vervangen, zodat lezers nooit een half getraind model zien.
+    """
+
+    def __init__(self):
+        self.model = None  # None = heuristische benadering
+        self.tag_token_freq: defaultdict[str, Counter[str]] = defaultdict(Counter)
+        self.token_doc_freq: Counter[str] = Counter()
+        self.tag_totals: Counter[str] = Counter()
+        self.total_docs = 0
+        self.samples = 0
+        self.trained_at: float | None = None  # time.time() van het einde van de training
+        self.training_seconds: float | None = None
+        # True als een bron niet gelezen kon worden: bruikbaar, maar niet in de cache bewaren
+        self.incomplete = False
+        # Regeltabel: (tegenrekening, naam) -> tag die altijd gegeven is, of None bij tegenstrijdige tags
+        self.rules: Dict[Tuple[str, str], str | None] = {}
+        # Gecompileerde heuristiek: (token -> kolom, token x tag gewichten tf*idf, tags per kolom)
+        self._heuristic: Tuple[Dict[str, int], sparse.csr_matrix, np.ndarray] | None = None
+
+    def add_sample(self, tokens: List[str], tag: str) -> None:
+        """Verwerk een sample voor heuristische benadering."""
+        for token in tokens:
+            self.tag_token_freq[tag][token] += 1
+            self.token_doc_freq[token] += 1
+        self.tag_totals[tag] += 1
+        self.total_docs += 1
+        self._heuristic = None  # Opnieuw compileren bij de volgende aanvraag
+
+    def add_rule(self, key: Tuple[str, str], tag: str) -> None:
+        """Neem een getagde rij op in de regeltabel; een afwijkende tag maakt de sleutel tegenstrijdig."""
+        if key not in self.rules:
+            self.rules[key] = tag
+        elif self.rules[key] != tag:
+            self.rules[key] = None
+
+    def compile_heuristic(self, allowed_tags: List[str] | None = None) -> Tuple[Dict[str, int], sparse.csr_matrix, np.ndarray]:
+        """Zet de tag-vocabulaire om in een ijle token x tag matrix met vooraf berekende idf.
+
+        De score van een tag is sum(tf * idf) over de tokens van de transactie, dus voor een
+        batch is scoren één vermenigvuldiging (transacties x tokens) @ (tokens x tags).
+        """
+        if self._heuristic is not None:
+            return self._heuristic
+        tags = [tag for tag in self.tag_token_freq if not allowed_tags or tag in allowed_tags]
+        vocabulary: Dict[str, int] = {}
+        rows: List[int] = []
+        cols: List[int] = []
+        values: List[float] = []
+        for col, tag in enumerate(tags):
+            for token, tf in self.tag_token_freq[tag].items():
+                rows.append(vocabulary.setdefault(token, len(vocabulary)))
+                cols.append(col)
+                values.append(tf)
+        idf = np.zeros(len(vocabulary))
+        if self.total_docs > 0:
+            doc_freq = np.array([max(self.token_doc_freq[token], 1) for token in vocabulary], dtype=float)
+            idf = np.log(self.total_docs / doc_freq)
+        weights = sparse.csr_matrix(
+            (np.asarray(values, dtype=float) * idf[rows], (rows, cols)),
+            shape=(len(vocabulary), len(tags)),
+        )
+        self._heuristic = (vocabulary, weights, np.asarray(tags, dtype=object))
+        return self._heuristic
+
+
+class PredictionCache:
+    """LRU-cache van voorspellingen per genormaliseerde featuretekst, gebonden aan één modelversie.
+
+    Terugkerende regels (contributie, huur, energie, bankkosten) hebben op de datum na dezelfde
+    tekst; die worden zo maar één keer voorspeld zolang het model niet verandert.
+    """
+
+    def __init__(self, capacity: int = 4096):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._version = 0
+        self._entries: OrderedDict[Tuple[str, int], List[Dict[str, float | str]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def invalidate(self) -> None:
+        """Nieuwe modelversie: alle opgeslagen voorspellingen vervallen."""
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+
+    def get(self, key: Tuple[str, int]) -> List[Dict[str, float | str]] | None:
+        with self._lock:
+            ranked = self._entries.get(key)
+            if ranked is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return ranked
+
+    def put(self, key: Tuple[str, int], ranked: List[Dict[str, float | str]], version: int) -> None:
+        """Sla een voorspelling op, tenzij die met een inmiddels vervangen model gemaakt is."""
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            if version != self._version:
+                return
+            self._entries[key] = ranked
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            }
+
 
 class TagRecommender:
     """Houdt een lichtgewicht vocabulaire per tag bij en kan suggesties genereren."""
 
-    def __init__(self, training_path: str, allowed_tags: List[str] | None = None, additional_data_path: str | None = None):
+    def __init__(self, training_path: str, allowed_tags: List[str] | None = None, additional_data_path: str | None = None,
+                 cache_dir: str | None = None, mode: str = "batch", refit_after_updates: int = 500,
+                 refit_interval_seconds: float = 24 * 3600, background_training: bool = False,
+                 prediction_cache_size: int = 4096, feature_backend: str = "tfidf",
+                 additional_rows: Callable[[], Iterable[Dict[str, object]]] | None = None,
+                 history_paths: List[str] | str | None = None, history_workers: int | None = None,
+                 max_samples_per_tag: int | None = None, recency_decay: float = 1.0):
         self.training_path = training_path
+        self.cache_dir = cache_dir  # Map voor het opgeslagen model; None = geen cache op schijf
+        self.mode = mode
+        self.feature_backend = feature_backend  # Alleen batch-modus; online is altijd gehasht
+        # Alleen "online": volledige hertraining na zoveel bijgeleerde tags of na zoveel seconden
+        self.refit_after_updates = refit_after_updates
+        self.refit_interval_seconds = refit_interval_seconds
+        self.updates_since_refit = 0
+        self.last_refit: float | None = None
         self.additional_data_path = additional_data_path  # Bijv. werkbestand met al ingevulde tags
+        # Optioneel: levert de al ingelezen transacties (dicts met tekstvelden, bedrag en tag) van het
+        # werkbestand. Dan wordt additional_data_path alleen nog gebruikt om wijzigingen (mtime) te zien.
+        self.additional_rows = additional_rows
+        # Historische werkboeken (paden en/of glob-patronen), parallel ingelezen met hooguit history_workers processen
+        self.history_paths = [history_paths] if isinstance(history_paths, str) else list(history_paths or [])
+        self.history_workers = history_workers
+        # Begrenzing van de trainingsset: None = alle voorbeelden; gewicht per boekjaar terug = recency_decay ** leeftijd
+        self.max_samples_per_tag = max_samples_per_tag
+        self.recency_decay = recency_decay
         self.allowed_tags = set(allowed_tags or [])
-        self.tag_token_freq: defaultdict[str, Counter[str]] = defaultdict(Counter)
-        self.token_doc_freq: Counter[str] = Counter()
-        self.tag_totals: Counter[str] = Counter()
-        self.total_docs = 0
+        self._state = TrainedModel()  # Huidig model; alleen als geheel vervangen
         self.last_loaded_mtime: float | None = None
         self.last_additional_mtime: float | None = None
-        self.model = None
+        self.cache_key: str | None = None  # Sleutel van het model dat nu geladen is
+        self._loaded_history: List[str] = []  # Historische werkboeken van het geladen model
+        # Training: load() is single-flight via _train_lock; refresh_async() start hooguit één achtergrondthread
+        self.background_training = background_training
+        self.last_error: str | None = None
+        self._train_lock = threading.Lock()
+        self._worker_condition = threading.Condition()
+        self._worker_active = False
+        self._rerun_requested = False
+        self._training_since: float | None = None
+        # Voorspellingen per featuretekst; vervalt bij elke modelwissel of online bijgeleerde tag
+        self.prediction_cache = PredictionCache(prediction_cache_size)
+        # Tellers van de regeltabel (zie _rule_key): opzoekingen en directe antwoorden
+        self.rule_lookups = 0
+        self.rule_hits = 0
+        self._rule_stats_lock = threading.Lock()
+        # Online: learn() past classifier en tabellen van het live model ter plekke aan (een kopie per tag
+        # is bij 2**18 features te duur). Bijleren, voorspellen en de teller lopen daarom onder één slot.
+        self._model_lock = threading.Lock()
+
+    def _model_guard(self):
+        """Slot rond gebruik van het live model; in batch-modus wordt een model na het wisselen nooit gewijzigd."""
+        return self._model_lock if self.mode == "online" else nullcontext()
+
+    @property
+    def model(self):
+        return self._state.model
+
+    @property
+    def tag_token_freq(self) -> defaultdict[str, Counter[str]]:
+        return self._state.tag_token_freq
+
+    @property
+    def token_doc_freq(self) -> Counter[str]:
+        return self._state.token_doc_freq
+
+    @property
+    def tag_totals(self) -> Counter[str]:
+        return self._state.tag_totals
+
+    @property
+    def total_docs(self) -> int:
+        return self._state.total_docs
 
     @staticmethod
     def _tokenize(text: str) -> List[str]:
@@ -49,12 +418,6 @@ class TagRecommender:
         
         return basic_tokens + extra_tokens
 
-    def _reset(self) -> None:
-        self.tag_token_freq.clear()
-        self.token_doc_freq.clear()
-        self.tag_totals.clear()
-        self.total_docs = 0
-
     def _find_columns(self, header: List[str]) -> Tuple[int | None, List[int]]:
         """Zoek de kolommen voor tag en tekstvelden."""
         normalized = [str(col).strip().lower() for col in header]
@@ -89,166 +452,489 @@ class TagRecommender:
 
         return tag_col, text_cols
 
+    def _samples_from_rows(self, rows: Iterable[Dict[str, object]]) -> List[tuple[str, str]]:
+        """Verzamel (text, tag) voorbeelden uit al ingelezen transacties; zelfde tekst als bij voorspellen."""
+        samples: List[tuple[str, str]] = []
+        for row in rows:
+            tag_val = str(row.get("tag") or "").strip()
+            if not tag_val:
+                continue
+            if self.allowed_tags and tag_val not in self.allowed_tags:
+                continue
+            text = self._transaction_text(row)
+            if text:
+                samples.append((text, tag_val))
+        return samples
+
     def _collect_dataset(self, path: str) -> List[tuple[str, str]]:
         """Lees een Excelbestand en verzamel (text, tag) voorbeelden."""
-        samples: List[tuple[str, str]] = []
-        wb = None
-        try:
-            wb = load_workbook(path, read_only=True, data_only=True)
-            for sheet in wb.worksheets:
-                first_row = next(sheet.iter_rows(min_row=1, max_row=1, values_only=True), ())
-                if not first_row:
-                    continue
-                header = [str(val).strip() if val is not None else "" for val in first_row]
-                normalized = [str(col).strip().lower() for col in header]
-                lookup = {name: idx for idx, name in enumerate(normalized)}
-
-                # Zoek tag kolom
-                tag_col = None
-                for candidate in ("tag", "tags", "categorie", "category"):
-                    if candidate in lookup:
-                        tag_col = lookup[candidate]
-                        break
-                if tag_col is None:
-                    continue
+        return collect_samples(path, self.allowed_tags)
 
-                # Zoek tekstkolommen
-                text_cols = []
-                for candidate in (
-                    "naam / omschrijving",
-                    "naam/omschrijving",
-                    "mededeling",
-                    "mededelingen",
-                    "omschrijving",
-                    "rekening",
-                    "tegenrekening",
-                    "mutatiesoort",
-                    "memo",
-                    "code",
-                    "description",
-                ):
-                    if candidate in lookup:
-                        text_cols.append(lookup[candidate])
-                if not text_cols:
-                    text_cols = [idx for idx in range(len(header)) if idx != tag_col]
-
-                # Zoek bedrag kolom (optioneel)
-                amount_col = None
-                for candidate in ("bedrag (eur)", "bedrag", "amount"):
-                    if candidate in lookup:
-                        amount_col = lookup[candidate]
-                        break
-
-                for row in sheet.iter_rows(min_row=2, values_only=True):
-                    if not row or len(row) <= tag_col:
-                        continue
-                    tag_val = str(row[tag_col] or "").strip()
-                    if not tag_val:
-                        continue
-                    if self.allowed_tags and tag_val not in self.allowed_tags:
-                        continue
-
-                    parts: List[str] = []
-                    for idx in text_cols:
-                        if idx < len(row) and row[idx] not in (None, ""):
-                            parts.append(str(row[idx]))
-
-                    # Voeg bedrag als speciaal token toe
-                    if amount_col is not None and amount_col < len(row) and row[amount_col] not in (None, ""):
-                        try:
-                            amount_val = float(str(row[amount_col]).replace(",", "."))
-                            parts.append(f"AMT_{round(amount_val)}")
-                        except (ValueError, TypeError):
-                            pass
-
-                    if not parts:
-                        continue
-
-                    combined = " ".join(parts)
-                    samples.append((combined, tag_val))
+    def _corpus_cache_path(self, digest: str) -> str:
+        tags_digest = hashlib.blake2b("\n".join(sorted(self.allowed_tags)).encode("utf-8"), digest_size=8).hexdigest()
+        return os.path.join(self.cache_dir, f"corpus-{CACHE_FORMAT}-{digest}-{tags_digest}.pkl")
+
+    def _history_samples(self, history: Dict[str, str]) -> Tuple[Dict[str, List[tuple[str, str]]], List[str]]:
+        """Voorbeelden uit de historische werkboeken: uit de cache per inhoudshash, de rest parallel inlezen.
+
+        Geeft ({pad: voorbeelden}, mislukte paden) terug. Een werkboek dat niet gelezen kon worden
+        (bijv. vergrendeld door OneDrive of half geschreven) telt deze keer niet mee en wordt niet
+        in de cache gezet, zodat een volgende training het opnieuw probeert.
+        """
+        parsed: Dict[str, List[tuple[str, str]]] = {}
+        for path, digest in history.items():
+            if not self.cache_dir:
+                break
+            try:
+                with open(self._corpus_cache_path(digest), "rb") as handle:
+                    parsed[path] = pickle.load(handle)
+            except FileNotFoundError:
+                continue
+            except Exception as exc:  # noqa: BLE001
+                logging.warning("Opgeslagen voorbeelden voor %s onbruikbaar (%s); opnieuw inlezen", path, exc)
+
+        todo = [path for path in history if path not in parsed]
+        failed: List[str] = []
+        workers = min(len(todo), self.history_workers or os.cpu_count() or 1)
+        if workers == 1:
+            for path in todo:
+                try:
+                    parsed[path] = collect_samples(path, self.allowed_tags, strict=True)
+                except Exception as exc:  # noqa: BLE001
+                    logging.error("Historisch werkboek %s kon niet gelezen worden: %s", path, exc)
+                    failed.append(path)
+        elif todo:
+            # Elk werkboek in een eigen proces: openpyxl-parsing is CPU-gebonden (GIL). "spawn" omdat
+            # dit vanuit een achtergrondthread gebeurt en fork met draaiende threads niet veilig is.
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+                tags = sorted(self.allowed_tags)
+                futures = {path: pool.submit(collect_samples, path, tags, True) for path in todo}
+                for path, future in futures.items():
+                    try:
+                        parsed[path] = future.result()
+                    except Exception as exc:  # noqa: BLE001  Leesfout of afgebroken werkproces
+                        logging.error("Historisch werkboek %s kon niet gelezen worden: %s", path, exc)
+                        failed.append(path)
+            logging.info("%d historische werkboek(en) ingelezen met %d processen", len(todo), workers)
+
+        if self.cache_dir:
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                for path in todo:
+                    if path not in failed:
+                        _atomic_pickle(self._corpus_cache_path(history[path]), parsed[path])
+            except OSError as exc:
+                logging.warning("Voorbeelden konden niet in cache worden opgeslagen: %s", exc)
+            # Voorbeelden van gewijzigde of verdwenen werkboeken opruimen
+            current = {self._corpus_cache_path(digest) for digest in history.values()}
+            for old_path in glob.glob(os.path.join(self.cache_dir, "corpus-*.pkl")):
+                if old_path not in current:
+                    try:
+                        os.remove(old_path)
+                    except OSError:
+                        pass
+        return {path: parsed[path] for path in history if path in parsed}, failed
+
+    def _compute_cache_key(self, source_digests: List[str], row_samples: List[tuple[str, str]] | None = None) -> str:
+        """Sleutel op basis van de inhoud van de bronnen, toegestane tags en modelparameters."""
+        rows_digest = None
+        if row_samples is not None:
+            digest = hashlib.blake2b(digest_size=16)
+            for text, tag in row_samples:
+                digest.update(f"{text}\t{tag}\n".encode("utf-8"))
+            rows_digest = digest.hexdigest()
+        payload = {
+            "format": CACHE_FORMAT,
+            "sklearn": sklearn.__version__,  # Een pickle is alleen bruikbaar met dezelfde versie
+            "params": {name: list(value) if isinstance(value, tuple) else value for name, value in MODEL_PARAMS.items()},
+            "mode": self.mode,
+            "online_params": ONLINE_PARAMS if self.mode == "online" else None,
+            "feature_backend": self.feature_backend if self.mode == "batch" else None,
+            "hashing_params": HASHING_PARAMS if self.mode == "batch" and self.feature_backend == "hashing" else None,
+            "max_samples_per_tag": self.max_samples_per_tag,
+            "recency_decay": self.recency_decay,
+            "allowed_tags": sorted(self.allowed_tags),
+            "sources": source_digests,
+            "rows": rows_digest,
+        }
+        return hashlib.blake2b(json.dumps(payload, sort_keys=True).encode("utf-8"), digest_size=16).hexdigest()
+
+    def _cache_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"tag_model-{key}.pkl")
+
+    def _load_cache(self, key: str) -> TrainedModel | None:
+        """Lees een opgeslagen model in. De cachemap wordt alleen door de app zelf beschreven."""
+        if not self.cache_dir:
+            return None
+        path = self._cache_path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as handle:
+                state = pickle.load(handle)
         except Exception as exc:  # noqa: BLE001
-            logging.error("Fout bij laden dataset uit %s: %s", path, exc)
-        finally:
-            if wb:
-                wb.close()
-        return samples
+            logging.warning("Opgeslagen model %s onbruikbaar (%s); opnieuw trainen", path, exc)
+            return None
+        if not isinstance(state, TrainedModel):
+            return None
+        logging.info("Model ingelezen uit cache: %s", path)
+        return state
 
-    def _process_heuristic_sample(self, text: str, tag: str) -> None:
-        """Verwerk een sample voor heuristische benadering."""
-        tokens = self._tokenize(text)
-        for token in tokens:
-            self.tag_token_freq[tag][token] += 1
-            self.token_doc_freq[token] += 1
-        self.tag_totals[tag] += 1
-        self.total_docs += 1
+    def _save_cache(self, key: str, state: TrainedModel) -> None:
+        """Sla het getrainde model atomisch op en ruim modellen met een oude sleutel op."""
+        if not self.cache_dir:
+            return
+        target = self._cache_path(key)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            _atomic_pickle(target, state)
+        except OSError as exc:
+            logging.warning("Model kon niet in cache worden opgeslagen: %s", exc)
+            return
+        for old_path in glob.glob(os.path.join(self.cache_dir, "tag_model-*.pkl")):
+            if old_path != target:
+                try:
+                    os.remove(old_path)
+                except OSError:
+                    pass
+
+    def _swap(self, state: TrainedModel, key: str, latest_mtime: float, history: List[str]) -> None:
+        """Wissel het actuele model in één toewijzing; lopende voorspellingen houden het vorige."""
+        with self._model_guard():
+            if state is not self._state:
+                self._state = state
+                self.prediction_cache.invalidate()
+            self.last_loaded_mtime = latest_mtime
+            self.cache_key = key
+            self._loaded_history = history
+            self.updates_since_refit = 0
+            self.last_refit = time.monotonic()
+
+    def _refit_due(self) -> bool:
+        """Online: is een volledige hertraining nodig na genoeg updates of genoeg tijd?"""
+        if self.last_refit is None:
+            return True
+        return (self.updates_since_refit >= self.refit_after_updates
+                or time.monotonic() - self.last_refit >= self.refit_interval_seconds)
+
+    def _history_files(self) -> List[str]:
+        """Bestaande historische werkboeken, gesorteerd en zonder dubbelen."""
+        files = set()
+        for pattern in self.history_paths:
+            files.update(path for path in glob.glob(pattern) if os.path.isfile(path))
+        return sorted(files - {self.training_path, self.additional_data_path})
+
+    def _check_sources(self) -> Tuple[bool, float, List[str]]:
+        """Geef (verouderd?, nieuwste mtime, bronbestanden) terug op basis van alleen stat()."""
+        history = self._history_files()
+        sources = [self.training_path] + history
+        static_count = len(sources)  # Trainingsset en historie; daarna eventueel het werkbestand
+        if self.additional_data_path and os.path.exists(self.additional_data_path):
+            sources.append(self.additional_data_path)
+        mtimes = [os.path.getmtime(path) for path in sources]
+        if not self.last_loaded_mtime:
+            return True, max(mtimes), sources
+        if self.mode == "online":
+            # Eigen tag-wijzigingen zijn al bijgeleerd; wijzigingen in het werkbestand komen mee bij de volgende refit
+            static_changed = max(mtimes[:static_count]) > self.last_loaded_mtime or history != self._loaded_history
+            return static_changed or self._refit_due(), max(mtimes), sources
+        # Hertrain alleen als bronbestanden gewijzigd zijn (of er een historisch jaar bij is gekomen)
+        return max(mtimes) > self.last_loaded_mtime or history != self._loaded_history, max(mtimes), sources
 
     def load(self) -> bool:
-        """Train het ML-model op trainingsdata + reeds getagde werkdata."""
+        """Train het ML-model op trainingsdata + reeds getagde werkdata (synchroon).
+
+        Gelijktijdige aanroepen trainen niet dubbel: wie later komt, wacht en ziet daarna
+        een actueel model. Het nieuwe model wordt pas na het trainen ingewisseld.
+        """
         if not self.training_path or not os.path.exists(self.training_path):
             logging.warning("Trainingsbestand niet gevonden: %s", self.training_path)
             return False
 
-        # Hertrain alleen als bronbestanden gewijzigd zijn
-        mtimes = [os.path.getmtime(self.training_path)]
-        if self.additional_data_path and os.path.exists(self.additional_data_path):
-            mtimes.append(os.path.getmtime(self.additional_data_path))
-        latest_mtime = max(mtimes)
-        if self.last_loaded_mtime and latest_mtime <= self.last_loaded_mtime:
+        with self._train_lock:
+            stale, latest_mtime, sources = self._check_sources()
+            if not stale:
+                return True
+
+            rows = row_samples = None
+            if self.additional_rows is not None:
+                # Werkdata uit het geheugen van de app in plaats van het werkbestand opnieuw te lezen
+                rows = list(self.additional_rows())
+                row_samples = self._samples_from_rows(rows)
+                sources = [path for path in sources if path != self.additional_data_path]
+            digests = {path: _file_digest(path) for path in sources}
+            key = self._compute_cache_key([digests[path] for path in sources], row_samples)
+            history = {path: digests[path] for path in sources[1:] if path != self.additional_data_path}
+            if key == self.cache_key:
+                # Inhoud ongewijzigd (bijv. alleen opnieuw opgeslagen)
+                self._swap(self._state, key, latest_mtime, list(history))
+                return True
+
+            state = self._load_cache(key)
+            if state is None:
+                state = self._train(row_samples, history, rows)
+                if state is None:
+                    return False
+                if state.incomplete:
+                    # Niet onder deze sleutel bewaren: dan zou het ontbrekende jaar nooit meer meegenomen worden
+                    logging.warning("Model getraind zonder alle historische werkboeken; niet in cache opgeslagen")
+                else:
+                    self._save_cache(key, state)
+            self._swap(state, key, latest_mtime, list(history))
             return True
 
-        self._reset()
+    def _train(self, row_samples: List[tuple[str, str]] | None = None, history: Dict[str, str] | None = None,
+               rows: List[Dict[str, object]] | None = None) -> TrainedModel | None:
+        """Verzamel de trainingsdata en train een nieuw model, zonder het actuele aan te raken.
 
-        # Verzamel training samples
-        samples = self._collect_dataset(self.training_path)
-        if self.additional_data_path and os.path.exists(self.additional_data_path):
-            samples += self._collect_dataset(self.additional_data_path)
+        history: {pad: inhoudshash} van de historische werkboeken; rows: getagde transacties
+        van de app (additional_rows) waaruit de regeltabel gebouwd wordt.
+        """
+        started = time.monotonic()
+        self._training_since = time.time()
+        try:
+            # Verzamel training samples met hun leeftijd in boekjaren: de trainingsset en het werkbestand
+            # tellen als actueel, historische werkboeken (op pad gesorteerd, oud naar nieuw) als 1, 2, ... jaar oud
+            groups = [(self._collect_dataset(self.training_path), 0)]
+            failed: List[str] = []
+            if history:
+                per_file, failed = self._history_samples(history)
+                # Leeftijd volgt de positie in de volledige (gesorteerde) historie, ook als een jaar ontbreekt
+                groups += [(per_file[path], len(history) - idx) for idx, path in enumerate(history) if path in per_file]
+            if row_samples is not None:
+                groups.append((row_samples, 0))
+            elif self.additional_data_path and os.path.exists(self.additional_data_path):
+                groups.append((self._collect_dataset(self.additional_data_path), 0))
+
+            texts, labels, weights = self._bounded_training_set(groups)
+            if not texts:
+                logging.warning("Geen trainingsdata gevonden om model te trainen")
+                return None
+
+            samples = list(zip(texts, labels))
+            state = TrainedModel()
+            state.samples = len(samples)
+            state.incomplete = bool(failed)
+            for row in rows or ():
+                tag_val = str(row.get("tag") or "").strip()
+                key = _rule_key(row)
+                if key and tag_val and (not self.allowed_tags or tag_val in self.allowed_tags):
+                    state.add_rule(key, tag_val)
 
-        if not samples:
-            logging.warning("Geen trainingsdata gevonden om model te trainen")
+            # Controleer aantal unieke klassen
+            unique_classes = set(labels)
+            if len(unique_classes) < 2:
+                logging.warning(
+                    "Onvoldoende trainingsklassen (%d) voor ML model; gebruik heuristische benadering",
+                    len(unique_classes)
+                )
+                # Bouw heuristische tag-vocabulaire
+                for text, label in samples:
+                    state.add_sample(self._tokenize(text), label)
+                state.compile_heuristic(self.allowed_tags)
+            else:
+                try:
+                    if self.mode == "online":
+                        state.model = self._fit_online(texts, labels, weights)
+                    else:
+                        model = self._batch_pipeline()
+                        model.fit(texts, labels, **{f"{model.steps[-1][0]}__sample_weight": weights})
+                        state.model = model
+                    logging.info("ML model getraind met %d voorbeelden", len(samples))
+                except ValueError as exc:
+                    logging.error("ML model training mislukt: %s; valt terug op heuristics", exc)
+                    # Fallback: bouw heuristische tag-vocabulaire
+                    for text, label in samples:
+                        state.add_sample(self._tokenize(text), label)
+                    state.compile_heuristic(self.allowed_tags)
+
+            state.trained_at = time.time()
+            state.training_seconds = round(time.monotonic() - started, 3)
+            return state
+        finally:
+            self._training_since = None
+
+    def _bounded_training_set(self, groups: List[Tuple[List[tuple[str, str]], int]]
+                              ) -> Tuple[List[str], List[str], List[float] | None]:
+        """Begrens en weeg de voorbeelden; groups: [(voorbeelden, leeftijd in boekjaren)].
+
+        Per tag worden hooguit max_samples_per_tag voorbeelden bewaard (reservoir sampling over
+        alle bronnen, met vaste seed zodat dezelfde data hetzelfde model geeft). Geeft
+        (teksten, labels, gewichten) terug; gewichten is None zonder recency-weging.
+        """
+        cap = self.max_samples_per_tag
+        items = ((text, tag, age) for samples, age in groups for text, tag in samples)
+        if cap:
+            rng = random.Random(0)
+            seen: Counter[str] = Counter()
+            reservoirs: Dict[str, List[Tuple[int, tuple]]] = defaultdict(list)
+            total = 0
+            for position, item in enumerate(items):
+                total += 1
+                tag = item[1]
+                seen[tag] += 1
+                reservoir = reservoirs[tag]
+                if len(reservoir) < cap:
+                    reservoir.append((position, item))
+                else:
+                    slot = rng.randrange(seen[tag])
+                    if slot < cap:
+                        reservoir[slot] = (position, item)
+            # Oorspronkelijke volgorde aanhouden
+            kept = [item for _, item in sorted(entry for reservoir in reservoirs.values() for entry in reservoir)]
+            logging.info("Trainingsset begrensd tot %d per tag: %d van %d voorbeelden", cap, len(kept), total)
+        else:
+            kept = list(items)
+
+        texts = [text for text, _, _ in kept]
+        labels = [tag for _, tag, _ in kept]
+        if self.recency_decay == 1.0:
+            return texts, labels, None
+        return texts, labels, [self.recency_decay ** age for _, _, age in kept]
+
+    def refresh_async(self) -> bool:
+        """Start een (her)training op de achtergrond. Loopt er al een, dan volgt hooguit één extra ronde.
+
+        Geeft True terug als er een nieuwe achtergrondthread gestart is.
+        """
+        with self._worker_condition:
+            if self._worker_active:
+                self._rerun_requested = True
+                return False
+            self._worker_active = True
+        threading.Thread(target=self._background_load, name="tag-trainer", daemon=True).start()
+        return True
+
+    def _background_load(self) -> None:
+        while True:
+            try:
+                self.load()
+                self.last_error = None
+            except Exception as exc:  # noqa: BLE001
+                self.last_error = str(exc)
+                logging.error("Fout bij trainen op de achtergrond: %s", exc)
+            with self._worker_condition:
+                if not self._rerun_requested:
+                    self._worker_active = False
+                    self._worker_condition.notify_all()
+                    return
+                self._rerun_requested = False
+
+    def wait_for_training(self, timeout: float | None = None) -> bool:
+        """Wacht tot een lopende achtergrondtraining klaar is. False bij een time-out."""
+        with self._worker_condition:
+            return self._worker_condition.wait_for(lambda: not self._worker_active, timeout)
+
+    def _ensure_model(self) -> bool:
+        """Zorg dat er een model is om mee te voorspellen.
+
+        Zonder background_training: synchroon load(). Met: bij een verouderd model op de
+        achtergrond hertrainen en intussen het huidige model gebruiken.
+        """
+        if not self.background_training:
+            return self.load()
+        if not self.training_path or not os.path.exists(self.training_path):
             return False
+        try:
+            stale = self._check_sources()[0]
+        except OSError:
+            stale = True
+        if stale:
+            self.refresh_async()
+        return self.last_loaded_mtime is not None
 
-        texts, labels = zip(*samples)
-
-        # Controleer aantal unieke klassen
-        unique_classes = set(labels)
-        if len(unique_classes) < 2:
-            logging.warning(
-                "Onvoldoende trainingsklassen (%d) voor ML model; gebruik heuristische benadering",
-                len(unique_classes)
-            )
-            # Bouw heuristische tag-vocabulaire
-            for text, label in samples:
-                self._process_heuristic_sample(text, label)
-            self.model = None  # Markeer dat heuristics gebruikt worden
-            self.last_loaded_mtime = latest_mtime
-            return True
+    def status(self) -> Dict[str, object]:
+        """Toestand van het model voor het statusendpoint: versheid en trainingsduur."""
+        state = self._state
+        try:
+            stale = self._check_sources()[0] if self.training_path and os.path.exists(self.training_path) else None
+        except OSError:
+            stale = None
+        training_since = self._training_since
+        rules = list(state.rules.values())  # Kopie: learn() kan intussen regels toevoegen
+        return {
+            "mode": self.mode,
+            "feature_backend": self.feature_backend if self.mode == "batch" else "hashing",
+            "model": "ml" if state.model is not None else ("heuristiek" if state.total_docs else None),
+            "samples": state.samples,
+            "stale": stale,
+            "trained_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(state.trained_at)) if state.trained_at else None,
+            "age_seconds": round(time.time() - state.trained_at, 1) if state.trained_at else None,
+            "last_training_seconds": state.training_seconds,
+            "training": training_since is not None,
+            "training_running_seconds": round(time.time() - training_since, 1) if training_since else None,
+            "updates_since_refit": self.updates_since_refit if self.mode == "online" else None,
+            "last_error": self.last_error,
+            "prediction_cache": self.prediction_cache.stats(),
+            "rules": {
+                "size": sum(tag is not None for tag in rules),
+                "conflicts": sum(tag is None for tag in rules),
+                "lookups": self.rule_lookups,
+                "hits": self.rule_hits,
+                "hit_rate": round(self.rule_hits / self.rule_lookups, 4) if self.rule_lookups else None,
+            },
+        }
 
-        # ML pipeline: TF-IDF (1-2 grams) + Logistic Regression
-        model = make_pipeline(
-            TfidfVectorizer(ngram_range=(1, 2), min_df=1),
-            LogisticRegression(max_iter=1000, n_jobs=1, multi_class="auto")
+    def _batch_pipeline(self):
+        """ML pipeline: features (1-2 grams) volgens feature_backend + Logistic Regression."""
+        if self.feature_backend == "hashing":
+            # Vaste dimensie en geen vocabulaire: transform is staatloos, het model blijft even groot
+            steps = [HashingVectorizer(ngram_range=MODEL_PARAMS["ngram_range"], n_features=HASHING_PARAMS["n_features"],
+                                       alternate_sign=False, norm=None if HASHING_PARAMS["tfidf"] else "l2")]
+            if HASHING_PARAMS["tfidf"]:
+                steps.append(TfidfTransformer())
+        else:
+            steps = [TfidfVectorizer(ngram_range=MODEL_PARAMS["ngram_range"], min_df=MODEL_PARAMS["min_df"])]
+        return make_pipeline(
+            *steps,
+            LogisticRegression(max_iter=MODEL_PARAMS["max_iter"], n_jobs=1, multi_class="auto")
         )
 
-        try:
-            model.fit(texts, labels)
-            self.model = model
-            self.last_loaded_mtime = latest_mtime
-            logging.info("ML model getraind met %d voorbeelden", len(samples))
-            return True
-        except ValueError as exc:
-            logging.error("ML model training mislukt: %s; valt terug op heuristics", exc)
-            # Fallback: bouw heuristische tag-vocabulaire
-            for text, label in samples:
-                self._process_heuristic_sample(text, label)
-            self.model = None
-            self.last_loaded_mtime = latest_mtime
-            return True
+    def _fit_online(self, texts, labels, weights=None):
+        """Train het online model; alle toegestane tags zijn vanaf het begin bekende klassen."""
+        vectorizer = HashingVectorizer(ngram_range=MODEL_PARAMS["ngram_range"], n_features=ONLINE_PARAMS["n_features"],
+                                       alternate_sign=False)
+        classifier = SGDClassifier(loss="log_loss", alpha=ONLINE_PARAMS["alpha"], random_state=0)
+        classes = sorted(self.allowed_tags | set(labels))
+        features = vectorizer.transform(texts)
+        for _ in range(ONLINE_PARAMS["epochs"]):
+            classifier.partial_fit(features, labels, classes=classes, sample_weight=weights)
+        return make_pipeline(vectorizer, classifier)
 
-    def recommend(self, transaction: Dict[str, str], top_k: int = 3) -> List[Dict[str, float | str]]:
-        """Geef een lijst met tags en scores terug op basis van het ML-model of heuristics."""
-        if not self.load():
-            return []
+    def learn(self, transaction: Dict[str, str], tag: str) -> bool:
+        """Online: leer één door de gebruiker toegekende tag direct bij (constante tijd).
+
+        Geeft False terug als er niets bijgeleerd is (batch-modus, onbekende tag of geen model).
+        """
+        if self.mode != "online" or self.last_refit is None:
+            return False
+        if self.allowed_tags and tag not in self.allowed_tags:
+            return False
+        text = self._transaction_text(transaction)
+        if not text:
+            return False
+
+        with self._model_lock:
+            state = self._state
+            if state.model is not None:
+                classifier = state.model[-1]
+                if tag not in classifier.classes_:
+                    # Nieuwe klasse kan niet met partial_fit: bij de volgende aanvraag volledig hertrainen
+                    self.updates_since_refit = self.refit_after_updates
+                    return False
+                classifier.partial_fit(state.model[0].transform([text]), [tag])
+            else:
+                state.add_sample(self._tokenize(text), tag)
+            key = _rule_key(transaction)
+            if key:
+                state.add_rule(key, tag)
+            self.prediction_cache.invalidate()
+            self.updates_since_refit += 1
+        return True
 
+    @staticmethod
+    def _transaction_text(transaction: Dict[str, str]) -> str:
+        """Combineer de tekstvelden (en het bedrag als token) van een transactie tot één tekst."""
         parts: List[str] = []
         for key in (
             "mededelingen",
@@ -273,48 +959,131 @@ class TagRecommender:
         if bedrag is not None:
             parts.append(f"AMT_{round(bedrag)}")
 
-        if not parts:
-            return []
+        return " ".join(parts)
 
-        text = " ".join(parts)
+    def recommend(self, transaction: Dict[str, str], top_k: int = 3) -> List[Dict[str, float | str]]:
+        """Geef een lijst met tags en scores terug op basis van het ML-model of heuristics."""
+        return self.recommend_batch([transaction], top_k=top_k)[0]
 
-        # Probeer ML-model te gebruiken
-        if hasattr(self, "model") and self.model is not None:
-            try:
-                proba = self.model.predict_proba([text])[0]
-                classes = self.model.classes_
-                paired = sorted(zip(classes, proba), key=lambda p: p[1], reverse=True)
-                return [
-                    {"tag": tag, "score": round(float(score), 4)}
-                    for tag, score in paired[:top_k]
-                ]
-            except Exception as exc:  # noqa: BLE001
-                logging.error("Fout bij ML aanbeveling: %s", exc)
-
-        # Fallback: heuristische benadering
-        tokens = self._tokenize(text)
-        tag_scores: Dict[str, float] = {}
-
-        for tag in self.tag_token_freq:
-            score = 0.0
-            for token in tokens:
-                if token in self.tag_token_freq[tag]:
-                    # TF-IDF-achtige scoring
-                    tf = self.tag_token_freq[tag][token]
-                    idf = math.log(self.total_docs / max(self.token_doc_freq[token], 1)) if self.total_docs > 0 else 0
-                    score += tf * idf
-            if score > 0:
-                tag_scores[tag] = score
-
-        # Filter op allowed_tags
-        if self.allowed_tags:
-            tag_scores = {tag: score for tag, score in tag_scores.items() if tag in self.allowed_tags}
-
-        if not tag_scores:
-            return []
-
-        sorted_tags = sorted(tag_scores.items(), key=lambda p: p[1], reverse=True)
+    def recommend_batch(self, transactions: List[Dict[str, str]], top_k: int = 3) -> List[List[Dict[str, float | str]]]:
+        """Zoals recommend(), maar voor veel transacties tegelijk.
+
+        Eén load(), één vectorisatie en één predict_proba over de hele matrix; de top-k
+        per rij wordt met argpartition geselecteerd. Identieke featureteksten worden één
+        keer voorspeld en eerder voorspelde teksten komen uit de voorspellingscache.
+        Transacties met een eenduidige regel in de regeltabel krijgen alleen die tag (score 1.0).
+        """
+        results: List[List[Dict[str, float | str]]] = [[] for _ in transactions]
+        if not transactions or not self._ensure_model():
+            return results
+        # Eerst de versie, dan het model: een wissel daartussen maakt de opgeslagen voorspellingen ongeldig
+        version = self.prediction_cache.version
+        state = self._state  # Eén model voor de hele batch, ook als er intussen gewisseld wordt
+
+        # Groepeer regels op genormaliseerde featuretekst (datum zit er niet in, bedrag als AMT_n);
+        # een eenduidige regel (tegenrekening + naam) beantwoordt de transactie zonder model
+        groups: Dict[str, List[int]] = {}
+        lookups = hits = 0
+        for idx, transaction in enumerate(transactions):
+            text = " ".join(self._transaction_text(transaction).lower().split())
+            if not text:
+                continue
+            key = _rule_key(transaction)
+            if key is not None:
+                lookups += 1
+                tag = state.rules.get(key)
+                if tag is not None:
+                    hits += 1
+                    results[idx] = [{"tag": tag, "score": 1.0}]
+                    continue
+            groups.setdefault(text, []).append(idx)
+        if lookups:
+            with self._rule_stats_lock:
+                self.rule_lookups += lookups
+                self.rule_hits += hits
+        if not groups:
+            return results
+
+        ranked_by_text: Dict[str, List[Dict[str, float | str]]] = {}
+        missing: List[str] = []
+        for text in groups:
+            cached = self.prediction_cache.get((text, top_k))
+            if cached is None:
+                missing.append(text)
+            else:
+                ranked_by_text[text] = cached
+
+        if missing:
+            for text, ranked in zip(missing, self._predict(state, missing, top_k)):
+                ranked_by_text[text] = ranked
+                self.prediction_cache.put((text, top_k), ranked, version)
+
+        for text, indices in groups.items():
+            for idx in indices:
+                # Kopieën, zodat aanroepers de cache niet kunnen wijzigen
+                results[idx] = [dict(item) for item in ranked_by_text[text]]
+        return results
+
+    def _predict(self, state: TrainedModel, texts: List[str], top_k: int) -> List[List[Dict[str, float | str]]]:
+        """Voorspel de top_k tags voor een lijst featureteksten met het ML-model of de heuristiek."""
+        with self._model_guard():
+            # Probeer ML-model te gebruiken
+            if state.model is not None:
+                try:
+                    proba = state.model.predict_proba(texts)
+                    return self._top_k(proba, state.model.classes_, top_k)
+                except Exception as exc:  # noqa: BLE001
+                    logging.error("Fout bij ML aanbeveling: %s", exc)
+
+            # Fallback: heuristische benadering
+            return self._recommend_heuristic(state, texts, top_k)
+
+    @staticmethod
+    def _top_k(proba: np.ndarray, classes: np.ndarray, top_k: int) -> List[List[Dict[str, float | str]]]:
+        """Selecteer per rij de top_k klassen (aflopende score) zonder de hele rij te sorteren."""
+        k = min(top_k, proba.shape[1])
+        if k <= 0:
+            return [[] for _ in range(proba.shape[0])]
+        if k < proba.shape[1]:
+            candidates = np.sort(np.argpartition(-proba, k - 1, axis=1)[:, :k], axis=1)
+        else:
+            candidates = np.tile(np.arange(proba.shape[1]), (proba.shape[0], 1))
+        order = np.argsort(-np.take_along_axis(proba, candidates, axis=1), axis=1, kind="stable")
+        best = np.take_along_axis(candidates, order, axis=1)
+        scores = np.round(np.take_along_axis(proba, best, axis=1), 4)
+        return [
+            [{"tag": str(classes[class_idx]), "score": float(score)} for class_idx, score in zip(row_classes, row_scores)]
+            for row_classes, row_scores in zip(best, scores)
+        ]
+
+    def _recommend_heuristic(self, state: TrainedModel, texts: List[str], top_k: int) -> List[List[Dict[str, float | str]]]:
+        """Scoor tags met de heuristische tag-vocabulaire (TF-IDF-achtig) via de gecompileerde matrix."""
+        vocabulary, weights, tags = state.compile_heuristic(self.allowed_tags)
+        if not tags.size:
+            return [[] for _ in texts]
+
+        # Ijl product (transacties x tokens) @ (tokens x tags) direct op de CSR-arrays: per token
+        # van een transactie de niet-nul gewichten ophalen en per (transactie, tag) optellen
+        token_ids: List[int] = []
+        row_ids: List[int] = []
+        for row, text in enumerate(texts):
+            for token in self._tokenize(text):
+                col = vocabulary.get(token)
+                if col is not None:
+                    token_ids.append(col)
+                    row_ids.append(row)
+        token_arr = np.asarray(token_ids, dtype=np.int64)
+        starts = weights.indptr[token_arr]
+        lengths = weights.indptr[token_arr + 1] - starts
+        offsets = np.cumsum(lengths) - lengths
+        positions = np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+        cells = np.repeat(np.asarray(row_ids, dtype=np.int64), lengths) * tags.size + weights.indices[positions]
+        scores = np.bincount(cells, weights=weights.data[positions], minlength=len(texts) * tags.size)
+        scores = scores.reshape(len(texts), tags.size)
+
+        # Alleen tags met een positieve score komen in aanmerking
+        positive = (scores > 0).sum(axis=1)
         return [
-            {"tag": tag, "score": round(float(score), 4)}
-            for tag, score in sorted_tags[:top_k]
+            ranked[:count]
+            for ranked, count in zip(self._top_k(scores, tags, top_k), positive)
         ]
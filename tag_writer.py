@@ -0,0 +1,152 @@
+"""
+Write-behind wachtrij voor tag-wijzigingen in het werkbestand.
+Een enkele achtergrondthread verzamelt tag-updates en schrijft ze gebundeld weg:
+één load/save van het Excel bestand voor alle openstaande wijzigingen, na een
+korte debounce of zodra een drempel bereikt is.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Tuple
+
+from openpyxl import load_workbook
+
+# Tag staat in kolom 12 (L) van elke tab
+TAG_COLUMN = 12
+
+UpdateKey = Tuple[str, str, int]  # (pad, tab, rij)
+
+
+class TagWriteQueue:
+    """Verzamelt tag-updates en schrijft ze gebundeld weg vanuit één achtergrondthread."""
+
+    def __init__(self, store=None, debounce_seconds: float = 2.0, max_batch: int = 50):
+        self.store = store  # TransactionStore die na het wegschrijven bijgewerkt wordt
+        self.debounce_seconds = debounce_seconds
+        self.max_batch = max_batch
+        self._pending: Dict[UpdateKey, str] = {}
+        self._in_flight: Dict[UpdateKey, str] = {}
+        self._last_submit = 0.0
+        self._closed = False
+        self._condition = threading.Condition()
+        # Herbruikbaar: wie via exclusive() het bestand vasthoudt mag zelf nog flush() aanroepen
+        self._flush_lock = threading.RLock()
+        self._thread = threading.Thread(target=self._run, name="tag-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, path: str, sheet_name: str, row_index: int, tag: str) -> None:
+        """Zet een tag-update in de wachtrij; een latere update voor dezelfde rij wint."""
+        self.submit_many(path, [(sheet_name, row_index, tag)])
+
+    def submit_many(self, path: str, updates: List[Tuple[str, int, str]]) -> None:
+        """Zet meerdere tag-updates tegelijk in de wachtrij."""
+        with self._condition:
+            for sheet_name, row_index, tag in updates:
+                self._pending[(path, sheet_name, row_index)] = tag
+            self._last_submit = time.monotonic()
+            self._condition.notify()
+        if self.store is not None:
+            self.store.apply_tags(path, {(sheet_name, row_index): tag for sheet_name, row_index, tag in updates})
+        if self._closed:
+            # Na afsluiten draait de achtergrondthread niet meer: direct wegschrijven
+            self.flush()
+
+    @contextmanager
+    def exclusive(self):
+        """Houd de achtergrondschrijver tegen zolang de aanroeper het werkbestand zelf laadt en opslaat.
+
+        Tags die intussen binnenkomen blijven in de wachtrij met hun oude rijnummers; verschuift de
+        aanroeper rijen, dan meldt hij dat nog binnen dit blok met remap_rows().
+        """
+        with self._flush_lock:
+            yield
+
+    def remap_rows(self, path: str, sheet_name: str, mapping: Callable[[int], int]) -> None:
+        """Nummer openstaande tags van een tab om nadat de app rijen verschoven heeft (invoegen, omkeren)."""
+        with self._condition:
+            self._pending = {
+                (p, sheet, mapping(row) if p == path and sheet == sheet_name else row): tag
+                for (p, sheet, row), tag in self._pending.items()
+            }
+
+    def pending_for(self, path: str) -> Dict[Tuple[str, int], str]:
+        """Geef alle nog niet opgeslagen tags voor een bestand terug als {(tab, rij): tag}."""
+        with self._condition:
+            merged = {**self._in_flight, **self._pending}
+        return {(sheet, row): tag for (p, sheet, row), tag in merged.items() if p == path}
+
+    def pending_count(self) -> int:
+        with self._condition:
+            return len(self._pending)
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                # Debounce: wacht tot het even stil is of de drempel bereikt is
+                while not self._closed and len(self._pending) < self.max_batch:
+                    remaining = self._last_submit + self.debounce_seconds - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                if self._closed:
+                    return
+            self.flush()
+
+    def flush(self) -> bool:
+        """Schrijf alle openstaande updates direct weg. Geeft False terug als opslaan mislukte."""
+        with self._flush_lock:
+            with self._condition:
+                if not self._pending:
+                    return True
+                batch = self._pending
+                self._pending = {}
+                self._in_flight = dict(batch)
+
+            per_path: Dict[str, Dict[Tuple[str, int], str]] = {}
+            for (path, sheet_name, row_index), tag in batch.items():
+                per_path.setdefault(path, {})[(sheet_name, row_index)] = tag
+
+            success = True
+            for path, updates in per_path.items():
+                try:
+                    self._write(path, updates)
+                except Exception as exc:  # noqa: BLE001
+                    success = False
+                    logging.error("Fout bij wegschrijven van %d tag(s) naar %s: %s", len(updates), path, exc)
+                    # Zet mislukte updates terug, tenzij er inmiddels een nieuwere waarde is
+                    with self._condition:
+                        for (sheet_name, row_index), tag in updates.items():
+                            self._pending.setdefault((path, sheet_name, row_index), tag)
+                        self._last_submit = time.monotonic()  # Opnieuw proberen na de volgende debounce
+
+            with self._condition:
+                self._in_flight = {}
+            return success
+
+    def _write(self, path: str, updates: Dict[Tuple[str, int], str]) -> None:
+        signature_before = self.store.signature(path) if self.store is not None else None
+        wb = load_workbook(path)
+        try:
+            for (sheet_name, row_index), tag in updates.items():
+                if sheet_name not in wb.sheetnames:
+                    logging.warning("Sheet %s niet gevonden; tag voor rij %d niet opgeslagen", sheet_name, row_index)
+                    continue
+                wb[sheet_name].cell(row=row_index, column=TAG_COLUMN, value=tag)
+            wb.save(path)
+        finally:
+            wb.close()
+        if self.store is not None:
+            self.store.mark_written(path, signature_before)
+        logging.info("TAGS OPGESLAGEN | Bestand: %s | Aantal: %d", path, len(updates))
+
+    def close(self) -> None:
+        """Schrijf openstaande updates weg en stop de achtergrondthread."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self.flush()
@@ -0,0 +1,78 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from job_runner import JobRunner
+
+
+def wait_finished(runner, job_id, timeout=5.0):
+    job = runner.get(job_id)
+    deadline = time.monotonic() + timeout
+    while job.finished_at is None:
+        assert time.monotonic() < deadline, "job niet op tijd klaar"
+        time.sleep(0.01)
+    return job
+
+
+def test_job_reports_progress_and_results():
+    runner = JobRunner(max_workers=1)
+    try:
+        def work(job):
+            job.report(0, total=4)
+            for i in range(0, 4, 2):
+                job.report(i + 2, results=[{'row': i}, {'row': i + 1}])
+            return {'count': 4}
+
+        job = wait_finished(runner, runner.submit('test', work).id)
+        status = job.to_dict(offset=3)
+        assert status['state'] == 'done'
+        assert status['progress'] == {'done': 4, 'total': 4}
+        assert status['results'] == [{'row': 3}]
+        assert status['result_count'] == 4 and status['count'] == 4
+    finally:
+        runner.close()
+
+
+def test_cancel_stops_running_job_and_skips_queued_job():
+    runner = JobRunner(max_workers=1)
+    started, release = threading.Event(), threading.Event()
+    try:
+        def blocking(job):
+            job.report(0, total=2, results=[{'row': 0}])
+            started.set()
+            release.wait(5)
+            job.report(1, results=[{'row': 1}])  # Hier wordt de annulering opgemerkt
+            return {'count': 2}
+
+        running = runner.submit('test', blocking)
+        queued = runner.submit('test', lambda job: {'count': 0})
+        assert started.wait(5)
+        assert runner.cancel(queued.id).state == 'cancelled'
+        runner.cancel(running.id)
+        release.set()
+
+        job = wait_finished(runner, running.id)
+        assert job.state == 'cancelled'
+        assert job.to_dict()['results'] == [{'row': 0}, {'row': 1}]
+        assert queued.started_at is None
+        assert runner.cancel('onbekend') is None
+    finally:
+        runner.close()
+
+
+def test_failed_job_and_bounded_history():
+    runner = JobRunner(max_workers=1, max_finished=2)
+    try:
+        def failing(job):
+            raise ValueError("kapot")
+
+        failed = wait_finished(runner, runner.submit('test', failing).id)
+        assert failed.state == 'failed' and failed.error == 'kapot'
+        ids = [wait_finished(runner, runner.submit('test', lambda job: None).id).id for _ in range(2)]
+        assert runner.get(failed.id) is None
+        assert all(runner.get(job_id) for job_id in ids)
+    finally:
+        runner.close()
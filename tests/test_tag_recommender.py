@@ -0,0 +1,481 @@
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+import openpyxl
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tag_recommender
+from tag_recommender import TagRecommender
+
+TAGS = ["4500;Huur gebouw", "8700;Koffie", "4980;Bankkosten"]
+SAMPLES = [
+    ("Huur zaal december", "Verhuurder BV", 450.0, "4500;Huur gebouw"),
+    ("Huur zaal januari", "Verhuurder BV", 450.0, "4500;Huur gebouw"),
+    ("Huur opslag", "Verhuurder BV", 120.0, "4500;Huur gebouw"),
+    ("Koffie en thee", "Groothandel", 35.5, "8700;Koffie"),
+    ("Koffiebonen", "Groothandel", 22.0, "8700;Koffie"),
+    ("Melk voor koffie", "Supermarkt", 6.0, "8700;Koffie"),
+    ("Kosten betaalrekening", "ING", 12.5, "4980;Bankkosten"),
+    ("Rente en kosten", "ING", 3.0, "4980;Bankkosten"),
+]
+
+
+def create_training_workbook(path, samples=SAMPLES):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(["Mededelingen", "Naam / Omschrijving", "Bedrag (EUR)", "Tag"])
+    for row in samples:
+        ws.append(list(row))
+    wb.save(path)
+    wb.close()
+
+
+def count_dataset_reads(monkeypatch):
+    reads = []
+    original = TagRecommender._collect_dataset
+
+    def counting(self, path):
+        reads.append(path)
+        return original(self, path)
+
+    monkeypatch.setattr(TagRecommender, "_collect_dataset", counting)
+    return reads
+
+
+def test_model_is_loaded_from_cache_on_restart(tmp_path, monkeypatch):
+    training = str(tmp_path / "training.xlsx")
+    create_training_workbook(training)
+    cache_dir = str(tmp_path / "cache")
+    reads = count_dataset_reads(monkeypatch)
+
+    first = TagRecommender(training, allowed_tags=TAGS, cache_dir=cache_dir)
+    assert first.load()
+    assert len(reads) == 1
+    assert len(os.listdir(cache_dir)) == 1
+
+    # Nieuwe instantie (herstart): geen inlezen of trainen, zelfde voorspelling
+    second = TagRecommender(training, allowed_tags=TAGS, cache_dir=cache_dir)
+    assert second.load()
+    assert len(reads) == 1
+    transaction = {"mededelingen": "Huur zaal februari", "naam": "Verhuurder BV", "bedrag": "450"}
+    assert second.recommend(transaction) == first.recommend(transaction)
+    assert second.recommend(transaction)[0]["tag"] == "4500;Huur gebouw"
+
+
+def test_cache_key_changes_with_tags_params_and_content(tmp_path, monkeypatch):
+    training = str(tmp_path / "training.xlsx")
+    create_training_workbook(training)
+    cache_dir = str(tmp_path / "cache")
+    reads = count_dataset_reads(monkeypatch)
+
+    TagRecommender(training, allowed_tags=TAGS, cache_dir=cache_dir).load()
+    TagRecommender(training, allowed_tags=TAGS[:2], cache_dir=cache_dir).load()
+    assert len(reads) == 2
+
+    monkeypatch.setitem(tag_recommender.MODEL_PARAMS, "max_iter", 500)
+    TagRecommender(training, allowed_tags=TAGS[:2], cache_dir=cache_dir).load()
+    assert len(reads) == 3
+
+    create_training_workbook(training, SAMPLES + [("Koffiefilters", "Groothandel", 4.0, "8700;Koffie")])
+    TagRecommender(training, allowed_tags=TAGS[:2], cache_dir=cache_dir).load()
+    assert len(reads) == 4
+    # Alleen het model met de actuele sleutel blijft bewaard
+    assert len(os.listdir(cache_dir)) == 1
+
+
+def test_heuristic_tables_are_cached(tmp_path, monkeypatch):
+    training = str(tmp_path / "training.xlsx")
+    create_training_workbook(training, [row for row in SAMPLES if row[3] == "8700;Koffie"])
+    cache_dir = str(tmp_path / "cache")
+
+    TagRecommender(training, allowed_tags=TAGS, cache_dir=cache_dir).load()
+    reads = count_dataset_reads(monkeypatch)
+    cached = TagRecommender(training, allowed_tags=TAGS, cache_dir=cache_dir)
+    assert cached.load()
+    assert reads == []
+    assert cached.model is None
+    assert cached.recommend({"mededelingen": "koffie"})[0]["tag"] == "8700;Koffie"
+
+
+def test_online_mode_learns_without_retraining(tmp_path, monkeypatch):
+    training = str(tmp_path / "training.xlsx")
+    create_training_workbook(training)
+    workbook = str(tmp_path / "werk.xlsx")
+    create_training_workbook(workbook, SAMPLES[:2])
+    reads = count_dataset_reads(monkeypatch)
+
+    recommender = TagRecommender(training, allowed_tags=TAGS, additional_data_path=workbook,
+                                 mode="online", refit_after_updates=3)
+    assert recommender.load()
+    assert len(reads) == 2
+
+    transaction = {"mededelingen": "Contributie penningmeester", "naam": "Lid", "bedrag": "12.50"}
+    before = {s["tag"]: s["score"] for s in recommender.recommend(transaction)}
+    assert recommender.learn(transaction, "4980;Bankkosten")
+    assert recommender.learn(transaction, "4980;Bankkosten")
+    after = {s["tag"]: s["score"] for s in recommender.recommend(transaction)}
+    assert after["4980;Bankkosten"] > before.get("4980;Bankkosten", 0)
+    assert not recommender.learn(transaction, "Onbekende tag")
+
+    # Een opgeslagen werkbestand leidt niet tot hertrainen zolang de refit niet nodig is
+    create_training_workbook(workbook, SAMPLES[:3])
+    stat = os.stat(workbook)
+    os.utime(workbook, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    recommender.recommend(transaction)
+    assert len(reads) == 2
+
+    # Na refit_after_updates bijgeleerde tags volgt een volledige hertraining
+    recommender.learn(transaction, "8700;Koffie")
+    recommender.recommend(transaction)
+    assert len(reads) == 4
+    assert recommender.updates_since_refit == 0
+
+
+
+def test_online_learning_is_serialised_with_predictions(tmp_path, monkeypatch):
+    training = str(tmp_path / "training.xlsx")
+    create_training_workbook(training)
+    recommender = TagRecommender(training, allowed_tags=TAGS, mode="online", refit_after_updates=10 ** 6,
+                                 prediction_cache_size=0)
+    assert recommender.load()
+
+    # Meet hoeveel aanpassingen/voorspellingen tegelijk op het live model lopen
+    active, overlap, guard = [0], [0], threading.Lock()
+
+    def exclusive(method):
+        def wrapper(*args, **kwargs):
+            with guard:
+                active[0] += 1
+                overlap[0] = max(overlap[0], active[0])
+            try:
+                time.sleep(0.001)
+                return method(*args, **kwargs)
+            finally:
+                with guard:
+                    active[0] -= 1
+        return wrapper
+
+    classifier = recommender.model[-1]
+    monkeypatch.setattr(classifier, "partial_fit", exclusive(classifier.partial_fit))
+    monkeypatch.setattr(recommender.model, "predict_proba", exclusive(recommender.model.predict_proba))
+
+    def work(idx):
+        for i in range(20):
+            recommender.learn({"mededelingen": f"Koffie {idx}-{i}", "naam": "Kantine"}, "8700;Koffie")
+            recommender.recommend_batch([{"mededelingen": f"Huur {idx}-{i}"}])
+
+    threads = [threading.Thread(target=work, args=(idx,)) for idx in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+
+    assert overlap[0] == 1
+    assert recommender.updates_since_refit == 80
+
+def test_batch_mode_does_not_learn_incrementally(tmp_path):
+    training = str(tmp_path / "training.xlsx")
+    create_training_workbook(training)
+    recommender = TagRecommender(training, allowed_tags=TAGS)
+    recommender.load()
+    assert not recommender.learn({"mededelingen": "Koffie"}, "8700;Koffie")
+
+
+def test_recommend_batch_matches_single_recommendations(tmp_path, monkeypatch):
+    training = str(tmp_path / "training.xlsx")
+    create_training_workbook(training)
+    recommender = TagRecommender(training, allowed_tags=TAGS, prediction_cache_size=0)
+    recommender.load()
+
+    transactions = [
+        {"mededelingen": "Huur zaal maart", "naam": "Verhuurder BV", "bedrag": "450"},
+        {},
+        {"mededelingen": "Koffie", "bedrag": "12,50"},
+        {"mededelingen": "Kosten", "naam": "ING"},
+    ]
+    expected = [recommender.recommend(t, top_k=2) for t in transactions]
+
+    calls = []
+    original = recommender.model.predict_proba
+    monkeypatch.setattr(recommender.model, "predict_proba", lambda texts: (calls.append(len(texts)), original(texts))[1])
+    batch = recommender.recommend_batch(transactions, top_k=2)
+
+    assert batch == expected
+    assert calls == [3]
+    assert batch[1] == []
+    assert [len(r) for r in recommender.recommend_batch(transactions, top_k=10)] == [3, 0, 3, 3]
+    assert batch[0][0]["score"] >= batch[0][1]["score"]
+
+
+def test_background_training_is_single_flight_and_swaps_atomically(tmp_path, monkeypatch):
+    training = str(tmp_path / "training.xlsx")
+    create_training_workbook(training)
+    recommender = TagRecommender(training, allowed_tags=TAGS, background_training=True)
+    assert recommender.load()
+    old_model = recommender.model
+    transaction = {"mededelingen": "Huur zaal februari", "naam": "Verhuurder BV", "bedrag": "450"}
+    expected = recommender.recommend(transaction)
+
+    # Houd de volgende training vast zodat aanvragen tijdens het trainen getest kunnen worden
+    started, release = threading.Event(), threading.Event()
+    reads = []
+    original = TagRecommender._collect_dataset
+
+    def blocking(self, path):
+        reads.append(path)
+        started.set()
+        release.wait(5)
+        return original(self, path)
+
+    monkeypatch.setattr(TagRecommender, "_collect_dataset", blocking)
+    create_training_workbook(training, SAMPLES + [("Koffiefilters", "Groothandel", 4.0, "8700;Koffie")])
+    stat = os.stat(training)
+    os.utime(training, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    assert recommender.recommend(transaction) == expected
+    assert started.wait(5)
+    for _ in range(5):
+        recommender.refresh_async()
+        assert recommender.recommend(transaction) == expected
+    assert recommender.model is old_model
+    assert recommender.status()["training"] is True
+
+    release.set()
+    assert recommender.wait_for_training(5)
+    # Eén training voor alle aanleidingen; de extra ronde ziet een actueel model en traint niet opnieuw
+    assert len(reads) == 1
+    assert recommender.model is not old_model
+    status = recommender.status()
+    assert status["training"] is False
+    assert status["stale"] is False
+    assert status["samples"] == len(SAMPLES) + 1
+    assert status["last_training_seconds"] >= 0
+
+
+def test_compiled_heuristic_matches_reference_scores(tmp_path):
+    training = str(tmp_path / "training.xlsx")
+    create_training_workbook(training)
+    recommender = TagRecommender(training, allowed_tags=TAGS[:2])
+    state = tag_recommender.TrainedModel()
+    for mededelingen, naam, _, tag in SAMPLES:
+        state.add_sample(TagRecommender._tokenize(f"{mededelingen} {naam}"), tag)
+    recommender._state = state
+    recommender.last_loaded_mtime = os.path.getmtime(training)
+
+    def reference(text):
+        scores = {}
+        for tag in TAGS[:2]:
+            score = sum(
+                state.tag_token_freq[tag][token] * math.log(state.total_docs / state.token_doc_freq[token])
+                for token in TagRecommender._tokenize(text) if token in state.tag_token_freq[tag]
+            )
+            if score > 0:
+                scores[tag] = round(score, 4)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+    texts = ["Huur zaal maart Verhuurder BV", "Koffie Groothandel", "Kosten ING", "onbekend"]
+    results = recommender.recommend_batch([{"mededelingen": text} for text in texts], top_k=3)
+    for text, ranked in zip(texts, results):
+        assert [(item["tag"], item["score"]) for item in ranked] == reference(text)
+
+    # Bijleren maakt de gecompileerde matrix ongeldig
+    state.add_sample(TagRecommender._tokenize("bankkosten"), "8700;Koffie")
+    assert recommender.recommend({"mededelingen": "bankkosten"})[0]["tag"] == "8700;Koffie"
+
+
+def test_recurring_lines_are_predicted_once_and_cached(tmp_path, monkeypatch):
+    training = str(tmp_path / "training.xlsx")
+    create_training_workbook(training)
+    recommender = TagRecommender(training, allowed_tags=TAGS, mode="online")
+    recommender.load()
+
+    calls = []
+    original = recommender.model.predict_proba
+    monkeypatch.setattr(recommender.model, "predict_proba", lambda texts: (calls.append(len(texts)), original(texts))[1])
+
+    # Zelfde regel in verschillende maanden: alleen de datum verschilt
+    rent = [{"datum": f"2026-{month:02d}-01", "mededelingen": "Huur zaal", "naam": "Verhuurder BV", "bedrag": "450"}
+            for month in range(1, 7)]
+    coffee = {"mededelingen": "Koffie  en THEE", "naam": "Groothandel"}
+    first = recommender.recommend_batch(rent + [coffee])
+    assert calls == [2]
+    assert all(ranked == first[0] for ranked in first[:6])
+
+    assert recommender.recommend({"mededelingen": "koffie en thee", "naam": "groothandel"}) == first[6]
+    assert calls == [2]
+    assert recommender.status()["prediction_cache"]["hits"] == 1
+
+    # Bijleren geeft een nieuwe modelversie: de cache vervalt
+    first[0][0]["tag"] = "gewijzigd"
+    assert recommender.learn(rent[0], "4500;Huur gebouw")
+    assert recommender.recommend(rent[0])[0]["tag"] == "4500;Huur gebouw"
+    assert calls == [2, 1]
+
+
+def test_hashing_backend_has_no_vocabulary_and_own_cache_key(tmp_path, monkeypatch):
+    training = str(tmp_path / "training.xlsx")
+    create_training_workbook(training)
+    cache_dir = str(tmp_path / "cache")
+    reads = count_dataset_reads(monkeypatch)
+
+    tfidf = TagRecommender(training, allowed_tags=TAGS, cache_dir=cache_dir)
+    hashed = TagRecommender(training, allowed_tags=TAGS, cache_dir=cache_dir, feature_backend="hashing")
+    assert tfidf.load() and hashed.load()
+    assert len(reads) == 2
+    assert tfidf.cache_key != hashed.cache_key
+
+    assert not hasattr(hashed.model[0], "vocabulary_")
+    assert hashed.model[-1].coef_.shape[1] == tag_recommender.HASHING_PARAMS["n_features"]
+    assert hashed.status()["feature_backend"] == "hashing"
+    transaction = {"mededelingen": "Huur zaal februari", "naam": "Verhuurder BV", "bedrag": "450"}
+    assert hashed.recommend(transaction)[0]["tag"] == "4500;Huur gebouw"
+
+
+def test_working_rows_are_used_instead_of_rereading_the_workbook(tmp_path, monkeypatch):
+    training = str(tmp_path / "training.xlsx")
+    create_training_workbook(training)
+    working = tmp_path / "werkbestand.xlsx"
+    working.write_bytes(b"geen geldig xlsx: mag niet gelezen worden")
+    rows = [{"mededelingen": "Sporthal zaalhuur", "naam": "Gemeente", "bedrag": 300.0, "tag": "4500;Huur gebouw"},
+            {"mededelingen": "Sporthal kantine", "naam": "Gemeente", "bedrag": 8.0, "tag": "8700;Koffie"},
+            {"mededelingen": "Nog niet getagd", "tag": None}]
+    reads = count_dataset_reads(monkeypatch)
+    recommender = TagRecommender(training, allowed_tags=TAGS, additional_data_path=str(working),
+                                 additional_rows=lambda: list(rows))
+
+    assert recommender.load()
+    assert reads == [training]
+    assert recommender.status()["samples"] == len(SAMPLES) + 2
+
+    # Tag-wijziging in de app: na de mtime-wijziging van het werkbestand hertrainen zonder het te lezen
+    rows[2]["tag"] = "4980;Bankkosten"
+    stat = os.stat(working)
+    os.utime(working, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert recommender.load()
+    assert reads == [training, training]
+    assert recommender.status()["samples"] == len(SAMPLES) + 3
+
+
+def test_history_workbooks_are_parsed_in_parallel_and_cached(tmp_path, monkeypatch):
+    training = str(tmp_path / "training.xlsx")
+    create_training_workbook(training, SAMPLES[:4])
+    for year, rows in (("2023", SAMPLES[4:6]), ("2024", SAMPLES[6:]), ("2025", SAMPLES[:2])):
+        (tmp_path / year).mkdir()
+        create_training_workbook(str(tmp_path / year / "grootboek.xlsx"), rows)
+    cache_dir = str(tmp_path / "cache")
+    history = str(tmp_path / "*" / "grootboek.xlsx")
+
+    first = TagRecommender(training, allowed_tags=TAGS, cache_dir=cache_dir, history_paths=history, history_workers=2)
+    assert first.load()
+    assert first.status()["samples"] == len(SAMPLES) + 2
+    assert len([name for name in os.listdir(cache_dir) if name.startswith("corpus-")]) == 3
+
+    # Nieuwe trainingsset: historie komt uit de cache per werkboek, alleen de trainingsset wordt gelezen
+    reads = count_dataset_reads(monkeypatch)
+    monkeypatch.setattr(tag_recommender, "ProcessPoolExecutor", None)  # Geen werkprocessen nodig
+    create_training_workbook(training, SAMPLES[:3])
+    second = TagRecommender(training, allowed_tags=TAGS, cache_dir=cache_dir, history_paths=[history])
+    assert second.load()
+    assert reads == [training]
+    assert second.status()["samples"] == len(SAMPLES) + 1
+
+
+
+def test_unreadable_history_workbook_is_not_cached_and_retried(tmp_path, monkeypatch):
+    training = str(tmp_path / "training.xlsx")
+    create_training_workbook(training, SAMPLES[:4])
+    for year, rows in (("2023", SAMPLES[4:6]), ("2024", SAMPLES[6:])):
+        (tmp_path / year).mkdir()
+        create_training_workbook(str(tmp_path / year / "grootboek.xlsx"), rows)
+    locked = str(tmp_path / "2024" / "grootboek.xlsx")
+    cache_dir = str(tmp_path / "cache")
+    history = str(tmp_path / "*" / "grootboek.xlsx")
+
+    # Vergrendeld werkboek (bijv. OneDrive): deze training zonder dat jaar, maar niets daarvan bewaren
+    original = tag_recommender.load_workbook
+
+    def locking(path, *args, **kwargs):
+        if path == locked:
+            raise PermissionError("bestand in gebruik")
+        return original(path, *args, **kwargs)
+
+    monkeypatch.setattr(tag_recommender, "load_workbook", locking)
+    first = TagRecommender(training, allowed_tags=TAGS, cache_dir=cache_dir, history_paths=history, history_workers=1)
+    assert first.load()
+    assert first.status()["samples"] == 6
+    assert len([name for name in os.listdir(cache_dir) if name.startswith("corpus-")]) == 1
+    assert not [name for name in os.listdir(cache_dir) if name.startswith("tag_model-")]
+
+    # Na een herstart wordt het jaar alsnog ingelezen
+    monkeypatch.setattr(tag_recommender, "load_workbook", original)
+    second = TagRecommender(training, allowed_tags=TAGS, cache_dir=cache_dir, history_paths=history, history_workers=1)
+    assert second.load()
+    assert second.status()["samples"] == len(SAMPLES)
+    assert len([name for name in os.listdir(cache_dir) if name.startswith("corpus-")]) == 2
+
+    # Kapot werkboek in een werkproces: fout komt terug uit de pool en wordt evenmin bewaard;
+    # de voorbeelden van de vorige inhoud worden opgeruimd
+    with open(locked, "wb") as handle:
+        handle.write(b"geen xlsx")
+    third = TagRecommender(training, allowed_tags=TAGS, cache_dir=cache_dir, history_paths=history, history_workers=2)
+    assert third.load()
+    assert third.status()["samples"] == 6
+    kept = os.path.basename(third._corpus_cache_path(tag_recommender._file_digest(str(tmp_path / "2023" / "grootboek.xlsx"))))
+    assert [name for name in os.listdir(cache_dir) if name.startswith("corpus-")] == [kept]
+
+def test_training_set_is_capped_per_tag_and_weighted_by_recency(tmp_path):
+    training = str(tmp_path / "training.xlsx")
+    create_training_workbook(training)
+    old_year = [(f"huur oud {i}", "4500;Huur gebouw") for i in range(50)] + [("koffie oud", "8700;Koffie")]
+    this_year = [(f"huur nieuw {i}", "4500;Huur gebouw") for i in range(50)]
+    groups = [(old_year, 1), (this_year, 0)]
+
+    capped = TagRecommender(training, allowed_tags=TAGS, max_samples_per_tag=10, recency_decay=0.5)
+    texts, labels, weights = capped._bounded_training_set(groups)
+    assert Counter(labels) == {"4500;Huur gebouw": 10, "8700;Koffie": 1}
+    assert [w for text, w in zip(texts, weights) if "oud" in text] == [0.5] * sum("oud" in t for t in texts)
+    assert [w for text, w in zip(texts, weights) if "nieuw" in text] == [1.0] * sum("nieuw" in t for t in texts)
+    # Deterministisch: dezelfde data geeft dezelfde selectie
+    assert capped._bounded_training_set(groups)[0] == texts
+
+    unbounded = TagRecommender(training, allowed_tags=TAGS)
+    assert unbounded._bounded_training_set(groups) == ([t for t, _ in old_year + this_year],
+                                                       [tag for _, tag in old_year + this_year], None)
+
+    assert capped.load()
+    assert capped.status()["samples"] == len(SAMPLES)  # Onder de limiet: alles gebruikt
+    assert capped._compute_cache_key([], None) != unbounded._compute_cache_key([], None)
+
+
+def test_rule_table_answers_exact_repeats_before_the_model(tmp_path, monkeypatch):
+    training = str(tmp_path / "training.xlsx")
+    create_training_workbook(training)
+    rows = [
+        {"tegenrekening": "nl01bank0001", "naam": "Verhuurder  BV", "mededelingen": "Huur maart", "tag": "4500;Huur gebouw"},
+        {"tegenrekening": "NL01BANK0001", "naam": "verhuurder bv", "mededelingen": "Huur april", "tag": "4500;Huur gebouw"},
+        {"tegenrekening": "NL02BANK0002", "naam": "Groothandel", "mededelingen": "Koffie", "tag": "8700;Koffie"},
+        {"tegenrekening": "NL02BANK0002", "naam": "Groothandel", "mededelingen": "Huur opslag", "tag": "4500;Huur gebouw"},
+    ]
+    recommender = TagRecommender(training, allowed_tags=TAGS, additional_rows=lambda: rows)
+    assert recommender.load()
+
+    calls = []
+    original = recommender.model.predict_proba
+    monkeypatch.setattr(recommender.model, "predict_proba", lambda texts: (calls.append(len(texts)), original(texts))[1])
+    results = recommender.recommend_batch([
+        {"tegenrekening": " NL01BANK0001", "naam": "Verhuurder BV", "mededelingen": "Huur mei", "bedrag": "450"},
+        {"tegenrekening": "NL02BANK0002", "naam": "Groothandel", "mededelingen": "Koffie"},  # Tegenstrijdig
+        {"naam": "Verhuurder BV", "mededelingen": "Huur juni"},  # Geen tegenrekening: geen regel
+    ])
+
+    assert results[0] == [{"tag": "4500;Huur gebouw", "score": 1.0}]
+    assert len(results[1]) == 3 and len(results[2]) == 3
+    assert calls == [2]
+    rules = recommender.status()["rules"]
+    assert (rules["size"], rules["conflicts"], rules["lookups"], rules["hits"]) == (1, 1, 2, 1)
+    assert rules["hit_rate"] == 0.5
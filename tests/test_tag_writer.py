@@ -0,0 +1,105 @@
+import os
+import sys
+import time
+
+import openpyxl
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tag_writer
+from tag_writer import TagWriteQueue
+from transaction_store import TransactionStore
+from test_transaction_store import SHEETS, create_workbook
+
+
+def count_saves(monkeypatch):
+    loads = []
+    original = tag_writer.load_workbook
+
+    def counting_load(*args, **kwargs):
+        loads.append(args[0])
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(tag_writer, "load_workbook", counting_load)
+    return loads
+
+
+def read_tag(xlsx_path, sheet_name, row_index):
+    wb = openpyxl.load_workbook(xlsx_path, read_only=True)
+    try:
+        return wb[sheet_name].cell(row=row_index, column=12).value
+    finally:
+        wb.close()
+
+
+def test_updates_are_coalesced_into_one_save(tmp_path, monkeypatch):
+    xlsx_path = str(tmp_path / "test.xlsx")
+    create_workbook(xlsx_path)
+    loads = count_saves(monkeypatch)
+
+    queue = TagWriteQueue(debounce_seconds=60, max_batch=1000)
+    queue.submit(xlsx_path, "Bankrekening", 2, "4500;Huur gebouw")
+    queue.submit(xlsx_path, "Bankrekening", 2, "8700;Koffie")
+    queue.submit(xlsx_path, "Spaarrekening 1", 2, "4980;Bankkosten")
+    assert queue.pending_count() == 2
+
+    queue.close()
+
+    assert len(loads) == 1
+    assert read_tag(xlsx_path, "Bankrekening", 2) == "8700;Koffie"
+    assert read_tag(xlsx_path, "Spaarrekening 1", 2) == "4980;Bankkosten"
+
+
+def test_background_flush_after_debounce(tmp_path):
+    xlsx_path = str(tmp_path / "test.xlsx")
+    create_workbook(xlsx_path)
+
+    queue = TagWriteQueue(debounce_seconds=0.05)
+    queue.submit(xlsx_path, "Spaarrekening 2", 2, "8700;Koffie")
+
+    deadline = time.monotonic() + 5
+    while queue.pending_count() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    queue.close()
+
+    assert read_tag(xlsx_path, "Spaarrekening 2", 2) == "8700;Koffie"
+
+
+def test_store_reflects_pending_tags_without_reparse(tmp_path, monkeypatch):
+    xlsx_path = str(tmp_path / "test.xlsx")
+    create_workbook(xlsx_path)
+
+    store = TransactionStore(SHEETS)
+    queue = TagWriteQueue(store, debounce_seconds=60)
+    store.pending_tags = queue.pending_for
+    store.get(xlsx_path)
+
+    queue.submit(xlsx_path, "Bankrekening", 2, "8700;Koffie")
+    snapshot = store.get(xlsx_path)
+    assert snapshot.get_row("Bankrekening", 2)[11] == "8700;Koffie"
+
+    # Een verse inlees (bijv. na externe wijziging) behoudt de nog niet opgeslagen tag
+    store.invalidate()
+    snapshot = store.get(xlsx_path)
+    assert snapshot.get_row("Bankrekening", 2)[11] == "8700;Koffie"
+
+    # Na het eigen wegschrijven wordt de momentopname hergebruikt in plaats van opnieuw ingelezen
+    queue.close()
+    assert store.get(xlsx_path) is snapshot
+    assert read_tag(xlsx_path, "Bankrekening", 2) == "8700;Koffie"
+
+
+def test_exclusive_holds_background_writer_until_released(tmp_path):
+    xlsx_path = str(tmp_path / "test.xlsx")
+    create_workbook(xlsx_path)
+
+    queue = TagWriteQueue(debounce_seconds=0.01)
+    with queue.exclusive():
+        queue.submit(xlsx_path, "Bankrekening", 2, "8700;Koffie")
+        time.sleep(0.2)
+        # De achtergrondthread wacht; de houder van het slot mag zelf wel flushen
+        assert queue.pending_count() == 1
+        assert read_tag(xlsx_path, "Bankrekening", 2) != "8700;Koffie"
+        assert queue.flush() is True
+    queue.close()
+    assert read_tag(xlsx_path, "Bankrekening", 2) == "8700;Koffie"
@@ -0,0 +1,130 @@
+import os
+import sys
+from datetime import datetime
+
+import openpyxl
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transaction_index import TransactionIndex, decode_cursor, encode_cursor
+from transaction_store import TransactionStore
+from test_transaction_store import SHEETS, create_workbook
+
+
+def make_index(tmp_path, storage_mode="prepend"):
+    xlsx_path = str(tmp_path / "test.xlsx")
+    create_workbook(xlsx_path)
+    store = TransactionStore(SHEETS, storage_mode=storage_mode)
+    index = TransactionIndex(store)
+    assert index.sync(xlsx_path)
+    return xlsx_path, store, index
+
+
+def test_index_mirrors_workbook(tmp_path):
+    xlsx_path, _, index = make_index(tmp_path)
+
+    assert os.path.exists(index.db_path_for(xlsx_path))
+    assert index.stats(SHEETS)["Bankrekening"] == {"total": 2, "untagged": 1}
+    assert [(t["sheet_name"], t["row_index"]) for t in index.untagged(SHEETS)] == [
+        ("Bankrekening", 2), ("Spaarrekening 1", 2), ("Spaarrekening 2", 2)]
+    first = index.transactions("Bankrekening")[0]
+    assert first["datum"] == "2026-01-01"
+    assert first["mededelingen"] == "Memo A"
+    assert first["bedrag"] == "10.00"
+    assert first["saldo"] == "€ 100.00"
+    assert index.transactions("Bankrekening", limit=1) == [first]
+
+
+def test_append_mode_orders_newest_first(tmp_path):
+    _, _, index = make_index(tmp_path, storage_mode="append")
+
+    assert [t["row_index"] for t in index.transactions("Bankrekening")] == [3, 2]
+
+
+def test_sync_only_rewrites_changed_rows(tmp_path):
+    xlsx_path, store, index = make_index(tmp_path)
+
+    store.apply_tags(xlsx_path, {("Bankrekening", 2): "8700;Koffie"})
+    executed = []
+    index._conn.set_trace_callback(executed.append)
+    assert index.sync(xlsx_path)
+    index._conn.set_trace_callback(None)
+
+    assert index.stats(SHEETS)["Bankrekening"] == {"total": 2, "untagged": 0}
+    upserts = [sql for sql in executed if sql.startswith("INSERT OR REPLACE INTO transactions")]
+    assert len(upserts) == 1
+
+    # Zelfde versie en signatuur: geen enkele query nodig
+    executed.clear()
+    index._conn.set_trace_callback(executed.append)
+    assert index.sync(xlsx_path)
+    index._conn.set_trace_callback(None)
+    assert executed == []
+
+
+def test_index_picks_up_external_changes(tmp_path):
+    xlsx_path, _, index = make_index(tmp_path)
+
+    wb = openpyxl.load_workbook(xlsx_path)
+    wb["Spaarrekening 2"].append(["", "Extra", "", "NL00", "", "Bij", 2.0, "", "", "", "", "8700;Koffie"])
+    wb.save(xlsx_path)
+    stat = os.stat(xlsx_path)
+    os.utime(xlsx_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+    assert index.sync(xlsx_path)
+    assert index.stats(SHEETS)["Spaarrekening 2"] == {"total": 2, "untagged": 1}
+
+
+def test_query_pages_with_cursor_and_filters(tmp_path):
+    xlsx_path = str(tmp_path / "test.xlsx")
+    create_workbook(xlsx_path)
+    wb = openpyxl.load_workbook(xlsx_path)
+    for day in range(1, 21):
+        wb["Spaarrekening 1"].append([datetime(2026, 3, day), f"Extra {day}", "", "NL00", "", "Af" if day % 2 else "Bij",
+                                      float(day), "", f"Extra {day}", "", "", "8700;Koffie" if day % 3 else ""])
+    wb.save(xlsx_path)
+    store = TransactionStore(SHEETS)
+    index = TransactionIndex(store)
+    index.sync(xlsx_path)
+
+    seen, cursor = [], None
+    while True:
+        page, cursor = index.query(SHEETS, limit=7, cursor=cursor)
+        seen.extend(page)
+        if cursor is None:
+            break
+    assert len(seen) == 24
+    assert len({(t["sheet_name"], t["row_index"]) for t in seen}) == 24
+    assert [t["datum"] for t in seen] == sorted((t["datum"] for t in seen), reverse=True)
+
+    page, _ = index.query(["Spaarrekening 1"], date_from="2026-03-05", date_to="2026-03-10",
+                          af_bij="Bij", sort="bedrag", descending=False)
+    assert [t["bedrag"] for t in page] == ["6.00", "8.00", "10.00"]
+
+    page, _ = index.query(SHEETS, untagged_only=True, amount_min=10, amount_max=20)
+    assert sorted(float(t["bedrag"]) for t in page) == [10.0, 12.0, 15.0, 18.0]
+
+    page, _ = index.query(SHEETS, tag="500;Vermogen Debutade")
+    assert [t["mededelingen"] for t in page] == ["Memo B"]
+
+
+def test_query_uses_sorted_index(tmp_path):
+    xlsx_path, _, index = make_index(tmp_path)
+
+    page, cursor = index.query(SHEETS, limit=1)
+    plan = " ".join(r[3] for r in index._conn.execute(
+        "EXPLAIN QUERY PLAN SELECT * FROM transactions WHERE +sheet IN (?, ?, ?) AND has_datum = 1 "
+        "AND (datum_sort, sheet, recency) < (?, ?, ?) ORDER BY datum_sort DESC, sheet DESC, recency DESC LIMIT 2",
+        (*SHEETS, "2026-02-01 00:00:00", "Spaarrekening 2", -2)))
+    assert "idx_transactions_datum" in plan
+    assert "TEMP B-TREE" not in plan
+    assert cursor is not None and len(page) == 1
+
+
+def test_decode_cursor_rejects_non_scalar_values():
+    assert decode_cursor(encode_cursor(("2026-01-01 00:00:00", "Bankrekening", -3))) == ("2026-01-01 00:00:00", "Bankrekening", -3)
+    assert decode_cursor(encode_cursor((12.5, "Spaarrekening 1", 0))) == (12.5, "Spaarrekening 1", 0)
+    for values in ([{"x": 1}, "a", 1], [None, "a", 1], ["x", 1, 1], ["x", "a", "1"], ["x", "a", 1.5], [True, "a", 1]):
+        with pytest.raises(ValueError):
+            decode_cursor(encode_cursor(values))
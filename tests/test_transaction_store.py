@@ -0,0 +1,214 @@
+import os
+import sys
+import threading
+from datetime import datetime
+
+import openpyxl
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import transaction_store
+from transaction_store import TransactionStore
+
+SHEETS = ["Bankrekening", "Spaarrekening 1", "Spaarrekening 2"]
+HEADERS = ["Datum", "Naam / Omschrijving", "Rekening", "Tegenrekening", "Code", "Af Bij",
+           "Bedrag (EUR)", "Mutatiesoort", "Mededelingen", "Saldo na mutatie", "", "Tag"]
+
+
+def create_workbook(xlsx_path):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = SHEETS[0]
+    ws.append(HEADERS)
+    ws.append([datetime(2026, 1, 1), 'Omschrijving A', 'ING', 'NL00', 'CODE', 'Af', 10.0, 'Type', 'Memo A', 100.0, '', ''])
+    ws.append([datetime(2026, 1, 2), 'Omschrijving B', 'ING', 'NL00', 'CODE', 'Bij', 20.5, 'Type', 'Memo B', 120.5, '', '500;Vermogen Debutade'])
+    for name in SHEETS[1:]:
+        s = wb.create_sheet(title=name)
+        s.append(HEADERS)
+        s.append([datetime(2026, 2, 1), 'Spaar A', 'ING Spaar', 'NL00', 'CODE', 'Bij', 1.0, 'Type', 'Memo S', 1000.0, '', ''])
+    wb.save(xlsx_path)
+    wb.close()
+
+
+def count_loads(monkeypatch):
+    calls = []
+    original = transaction_store.load_workbook
+
+    def counting_load(*args, **kwargs):
+        calls.append(args[0])
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(transaction_store, "load_workbook", counting_load)
+    return calls
+
+
+def test_snapshot_is_parsed_once(tmp_path, monkeypatch):
+    xlsx_path = str(tmp_path / "test.xlsx")
+    create_workbook(xlsx_path)
+    calls = count_loads(monkeypatch)
+
+    store = TransactionStore(SHEETS)
+    first = store.get(xlsx_path)
+    second = store.get(xlsx_path)
+
+    assert first is second
+    assert len(calls) == 1
+    assert [idx for idx, _ in first.iter_rows("Bankrekening")] == [2, 3]
+    assert first.get_row("Spaarrekening 1", 2)[1] == "Spaar A"
+    assert first.get_row("Bankrekening", 10) is None
+
+
+def test_snapshot_reloads_after_change_or_invalidate(tmp_path, monkeypatch):
+    xlsx_path = str(tmp_path / "test.xlsx")
+    create_workbook(xlsx_path)
+    calls = count_loads(monkeypatch)
+
+    store = TransactionStore(SHEETS)
+    store.get(xlsx_path)
+
+    store.invalidate()
+    store.get(xlsx_path)
+    assert len(calls) == 2
+
+    wb = openpyxl.load_workbook(xlsx_path)
+    wb["Bankrekening"].cell(row=2, column=12, value="8700;Koffie")
+    wb.save(xlsx_path)
+    stat = os.stat(xlsx_path)
+    os.utime(xlsx_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+    snapshot = store.get(xlsx_path)
+    assert len(calls) == 3
+    assert snapshot.get_row("Bankrekening", 2)[11] == "8700;Koffie"
+
+
+def test_missing_file_returns_none(tmp_path):
+    store = TransactionStore(SHEETS)
+    assert store.get(str(tmp_path / "missing.xlsx")) is None
+    assert store.get("") is None
+
+
+def test_snapshot_computes_totals_in_one_pass(tmp_path):
+    xlsx_path = str(tmp_path / "test.xlsx")
+    create_workbook(xlsx_path)
+
+    snapshot = TransactionStore(SHEETS).get(xlsx_path)
+
+    assert snapshot.totals == {"Bankrekening": 10.5, "Spaarrekening 1": 1.0, "Spaarrekening 2": 1.0}
+    assert len(snapshot.rows["Bankrekening"]) == 2
+
+
+def test_apply_insert_updates_totals_without_reparse(tmp_path, monkeypatch):
+    xlsx_path = str(tmp_path / "test.xlsx")
+    create_workbook(xlsx_path)
+    calls = count_loads(monkeypatch)
+
+    store = TransactionStore(SHEETS)
+    snapshot = store.get(xlsx_path)
+    version = snapshot.version
+
+    new_row = (datetime(2026, 1, 3), 'Nieuw', '', '', '', 'Af', 2.25, 'Kas', 'Nieuw', '', '', '')
+    signature_before = store.signature(xlsx_path)
+    wb = openpyxl.load_workbook(xlsx_path)
+    wb["Bankrekening"].insert_rows(2)
+    for col, value in enumerate(new_row, start=1):
+        wb["Bankrekening"].cell(row=2, column=col, value=value)
+    wb.save(xlsx_path)
+    store.apply_insert(xlsx_path, "Bankrekening", 2, new_row, signature_before)
+
+    snapshot = store.get(xlsx_path)
+    assert len(calls) == 1
+    assert snapshot.version > version
+    assert snapshot.totals["Bankrekening"] == 8.25
+    assert snapshot.get_row("Bankrekening", 2)[1] == "Nieuw"
+    assert snapshot.get_row("Bankrekening", 3)[8] == "Memo A"
+
+    # Zonder actuele momentopname vóór het schrijven: volledig opnieuw inlezen
+    store.apply_insert(xlsx_path, "Bankrekening", 2, new_row, (0, 0))
+    assert store.get(xlsx_path).totals["Bankrekening"] == 8.25
+    assert len(calls) == 2
+
+
+def test_head_streams_first_rows_without_filling_cache(tmp_path):
+    xlsx_path = str(tmp_path / "test.xlsx")
+    create_workbook(xlsx_path)
+
+    store = TransactionStore(SHEETS, pending_tags=lambda path: {("Bankrekening", 2): "8700;Koffie"})
+    rows = store.head(xlsx_path, "Bankrekening", 1)
+
+    assert [(idx, row[8], row[11]) for idx, row in rows] == [(2, "Memo A", "8700;Koffie")]
+    assert store._snapshot is None
+
+    # Met een actuele momentopname komen de rijen uit de cache
+    store.get(xlsx_path)
+    assert [idx for idx, _ in store.head(xlsx_path, "Bankrekening", 5)] == [2, 3]
+    assert store.head(str(tmp_path / "ontbreekt.xlsx"), "Bankrekening", 5) is None
+
+
+def test_tag_counts_per_tegenrekening_follow_own_changes(tmp_path, monkeypatch):
+    xlsx_path = str(tmp_path / "test.xlsx")
+    create_workbook(xlsx_path)
+    calls = count_loads(monkeypatch)
+
+    store = TransactionStore(SHEETS)
+    assert store.most_common_tag(xlsx_path, " nl00 ") == "500;Vermogen Debutade"
+    assert store.most_common_tag(xlsx_path, "NL99") is None
+
+    store.apply_tags(xlsx_path, {("Bankrekening", 2): "8700;Koffie", ("Spaarrekening 1", 2): "8700;Koffie"})
+    assert store.most_common_tag(xlsx_path, "NL00") == "8700;Koffie"
+    assert store.get(xlsx_path).tag_counts["NL00"] == {"8700;Koffie": 2, "500;Vermogen Debutade": 1}
+
+    store.apply_tags(xlsx_path, {("Bankrekening", 2): "", ("Spaarrekening 1", 2): ""})
+    assert store.most_common_tag(xlsx_path, "NL00") == "500;Vermogen Debutade"
+
+    new_row = (datetime(2026, 1, 3), 'Nieuw', '', 'NL99', '', 'Af', 1.0, 'Kas', 'Nieuw', '', '', '4500;Huur gebouw')
+    signature_before = store.signature(xlsx_path)
+    wb = openpyxl.load_workbook(xlsx_path)
+    wb["Bankrekening"].insert_rows(2)
+    for col, value in enumerate(new_row, start=1):
+        wb["Bankrekening"].cell(row=2, column=col, value=value)
+    wb.save(xlsx_path)
+    store.apply_insert(xlsx_path, "Bankrekening", 2, new_row, signature_before)
+    assert store.most_common_tag(xlsx_path, "nl99") == "4500;Huur gebouw"
+    assert len(calls) == 1
+
+
+def test_tagged_transactions_include_own_changes(tmp_path):
+    xlsx_path = str(tmp_path / "test.xlsx")
+    create_workbook(xlsx_path)
+    store = TransactionStore(SHEETS)
+
+    tagged = store.tagged_transactions(xlsx_path)
+    assert [(t['naam'], t['mededelingen'], t['bedrag'], t['tag']) for t in tagged] == [
+        ('Omschrijving B', 'Memo B', 20.5, '500;Vermogen Debutade')]
+
+    store.apply_tags(xlsx_path, {("Spaarrekening 1", 2): "8700;Koffie"})
+    assert sorted(t['tag'] for t in store.tagged_transactions(xlsx_path)) == ['500;Vermogen Debutade', '8700;Koffie']
+
+
+def test_data_version_does_not_wait_for_reparse(tmp_path, monkeypatch):
+    xlsx_path = str(tmp_path / "test.xlsx")
+    create_workbook(xlsx_path)
+    store = TransactionStore(SHEETS)
+    version = store.data_version(xlsx_path)
+
+    started, release = threading.Event(), threading.Event()
+    original = store._load
+
+    def slow_load(path, signature):
+        started.set()
+        release.wait(5)
+        return original(path, signature)
+
+    monkeypatch.setattr(store, "_load", slow_load)
+    reader = threading.Thread(target=store.get, args=(xlsx_path,))
+    reader.start()
+    try:
+        assert started.wait(5)
+        # Inlezen loopt nog (onder _lock); de dataversie is toch direct beschikbaar
+        stat = os.stat(xlsx_path)
+        os.utime(xlsx_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+        assert store.data_version(xlsx_path) == version + 1
+        assert reader.is_alive()
+    finally:
+        release.set()
+        reader.join(5)
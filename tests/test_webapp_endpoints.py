@@ -0,0 +1,366 @@
+import base64
+import importlib.util as util
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+import openpyxl
+import pytest
+
+from test_app import create_temp_config, create_temp_workbook
+from test_job_runner import wait_finished
+from test_tag_recommender import SAMPLES, TAGS as TRAINING_TAGS, create_training_workbook
+from test_transaction_store import HEADERS, SHEETS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TAGS = ["500;Vermogen Debutade", "4500;Huur gebouw", "8700;Koffie"]
+
+
+@pytest.fixture
+def webapp(tmp_path, monkeypatch):
+    xlsx_path = str(tmp_path / "test.xlsx")
+    create_temp_workbook(xlsx_path, SHEETS, HEADERS)
+    config_path = str(tmp_path / "config.json")
+    create_temp_config(config_path, xlsx_path, SHEETS, TAGS)
+    monkeypatch.setenv("BANKREKENING_CONFIG", config_path)
+
+    module = load_webapp()
+    yield module
+    module.job_runner.close()
+    module.tag_write_queue.close()
+
+
+def load_webapp():
+    """Importeer webapp.py opnieuw, zoals bij een (her)start van de app."""
+    spec = util.spec_from_file_location("webapp", os.path.join(ROOT, "webapp.py"))
+    module = util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def read_tag(xlsx_path, sheet_name, row_index):
+    wb = openpyxl.load_workbook(xlsx_path, read_only=True)
+    try:
+        return wb[sheet_name].cell(row=row_index, column=12).value
+    finally:
+        wb.close()
+
+
+def test_update_tags_applies_valid_items_in_one_save(webapp, monkeypatch):
+    saves = []
+    original = webapp.tag_write_queue._write
+    monkeypatch.setattr(webapp.tag_write_queue, "_write",
+                        lambda path, updates: (saves.append(len(updates)), original(path, updates)))
+
+    resp = webapp.app.test_client().post('/update_tags', json={'items': [
+        {'sheet_name': 'Bankrekening', 'row_index': 2, 'tag': '4500;Huur gebouw'},
+        {'sheet_name': 'Spaarrekening 1', 'row_index': 2, 'tag': '8700;Koffie'},
+        {'sheet_name': 'Bankrekening', 'row_index': 3, 'tag': 'Onbekend'},
+        {'sheet_name': 'Onbekend', 'row_index': 2, 'tag': '8700;Koffie'},
+    ]})
+
+    assert resp.status_code == 200
+    assert resp.json['count'] == 2
+    assert [r['success'] for r in resp.json['results']] == [True, True, False, False]
+    assert resp.json['results'][2]['message'] == 'Tag is niet toegestaan'
+    assert saves == [2]
+    assert read_tag(webapp.EXCEL_FILE_PATH, 'Bankrekening', 2) == '4500;Huur gebouw'
+    assert read_tag(webapp.EXCEL_FILE_PATH, 'Spaarrekening 1', 2) == '8700;Koffie'
+
+
+def test_update_tags_requires_items(webapp):
+    resp = webapp.app.test_client().post('/update_tags', json={'items': []})
+    assert resp.status_code == 400
+
+
+def history_mededelingen(client, sheet_name='Bankrekening'):
+    """Mededelingen zoals de history-pagina ze via /api/all_transactions (SQLite-index) krijgt."""
+    resp = client.get(f'/api/all_transactions?sheet={sheet_name}&limit=200')
+    assert resp.status_code == 200
+    return [t['mededelingen'] for t in resp.json['transactions']]
+
+
+def test_storage_mode_migration_and_append(webapp):
+    client = webapp.app.test_client()
+    before = history_mededelingen(client)
+    assert len(before) == 3
+
+    resp = client.post('/settings/storage-mode', json={'storage_mode': 'append', 'migrate': True})
+    assert resp.status_code == 200
+    assert resp.json['migrated'] is True
+
+    # Fysieke volgorde is omgekeerd, de leeskant toont nog steeds nieuwste eerst
+    assert read_tag(webapp.EXCEL_FILE_PATH, 'Bankrekening', 2) == '500;Vermogen Debutade'
+    assert history_mededelingen(client) == sorted(before, reverse=True)
+
+    resp = client.post('/add_transaction', data={
+        'datum': '2026-01-10', 'mededelingen': 'Nieuwste', 'bedrag': '1,50', 'af_bij': 'Bij'})
+    assert resp.status_code == 200
+
+    wb = openpyxl.load_workbook(webapp.EXCEL_FILE_PATH, read_only=True)
+    last_row = list(wb['Bankrekening'].iter_rows(min_row=2, values_only=True))[-1]
+    wb.close()
+    assert last_row[1] == 'Nieuwste'
+    assert webapp.get_recent_transactions(limit=1)[0]['mededelingen'] == 'Nieuwste'
+
+
+def test_add_transaction_returns_running_totals(webapp, monkeypatch):
+    client = webapp.app.test_client()
+    assert client.get('/get_total').json['total'] == webapp.calculate_total_amount()
+    before = client.get('/get_total').json['totals']
+
+    loads = []
+    original = webapp.transaction_store._load
+    monkeypatch.setattr(webapp.transaction_store, "_load",
+                        lambda path, signature: (loads.append(path), original(path, signature))[1])
+
+    resp = client.post('/add_transaction', data={
+        'datum': '2026-01-10', 'mededelingen': 'Koffie', 'bedrag': '2,50', 'af_bij': 'Af'})
+
+    assert resp.status_code == 200
+    assert resp.json['new_total'] == round(before['Bankrekening'] - 2.5, 2)
+    assert resp.json['totals']['Spaarrekening 1'] == before['Spaarrekening 1']
+    assert loads == []
+    assert webapp.get_recent_transactions(limit=1)[0]['mededelingen'] == 'Koffie'
+
+
+
+def test_add_transaction_aborts_when_pending_tags_cannot_be_saved(webapp, monkeypatch):
+    client = webapp.app.test_client()
+    original = webapp.tag_write_queue._write
+
+    def locked(path, updates):
+        raise PermissionError("bestand in gebruik")
+
+    monkeypatch.setattr(webapp.tag_write_queue, "_write", locked)
+    assert client.post('/update_tag', json={'sheet_name': 'Bankrekening', 'row_index': 2, 'tag': '8700;Koffie'}).status_code == 200
+    resp = client.post('/add_transaction', data={
+        'datum': '2026-01-10', 'mededelingen': 'Nieuw', 'bedrag': '1,00', 'af_bij': 'Af'})
+    assert resp.status_code == 500
+
+    # Geen rij ingevoegd, dus de tag hoort nog steeds bij de oorspronkelijke transactie
+    monkeypatch.setattr(webapp.tag_write_queue, "_write", original)
+    assert webapp.tag_write_queue.flush() is True
+    wb = openpyxl.load_workbook(webapp.EXCEL_FILE_PATH, read_only=True)
+    try:
+        row = next(wb['Bankrekening'].iter_rows(min_row=2, max_row=2, values_only=True))
+    finally:
+        wb.close()
+    assert (row[1], row[11]) == ('Omschrijving A', '8700;Koffie')
+
+
+def read_row(xlsx_path, sheet_name, row_index):
+    wb = openpyxl.load_workbook(xlsx_path, read_only=True)
+    try:
+        return next(wb[sheet_name].iter_rows(min_row=row_index, max_row=row_index, values_only=True))
+    finally:
+        wb.close()
+
+
+def test_tag_submitted_during_insert_follows_its_row(webapp, monkeypatch):
+    client = webapp.app.test_client()
+    original = webapp.load_workbook
+
+    def load_with_concurrent_tag(*args, **kwargs):
+        # Een /update_tag die binnenkomt na het flushen maar vóór het opslaan van de nieuwe rij
+        webapp.tag_write_queue.submit(webapp.EXCEL_FILE_PATH, 'Bankrekening', 2, '8700;Koffie')
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(webapp, "load_workbook", load_with_concurrent_tag)
+    resp = client.post('/add_transaction', data={
+        'datum': '2026-01-10', 'mededelingen': 'Nieuw', 'bedrag': '1,00', 'af_bij': 'Af'})
+    assert resp.status_code == 200
+    monkeypatch.setattr(webapp, "load_workbook", original)
+    assert webapp.tag_write_queue.flush() is True
+
+    assert read_row(webapp.EXCEL_FILE_PATH, 'Bankrekening', 2)[1] == 'Nieuw'
+    assert read_row(webapp.EXCEL_FILE_PATH, 'Bankrekening', 2)[11] in (None, '')
+    assert read_row(webapp.EXCEL_FILE_PATH, 'Bankrekening', 3)[1::10] == ('Omschrijving A', '8700;Koffie')
+
+    # Zelfde bij het omkeren van de rijen voor een andere opslagvolgorde: rij 2 wordt de laatste rij
+    monkeypatch.setattr(webapp, "load_workbook", load_with_concurrent_tag)
+    resp = client.post('/settings/storage-mode', json={'storage_mode': 'append', 'migrate': True})
+    assert resp.status_code == 200
+    monkeypatch.setattr(webapp, "load_workbook", original)
+    assert webapp.tag_write_queue.flush() is True
+    assert read_row(webapp.EXCEL_FILE_PATH, 'Bankrekening', 5)[1::10] == ('Nieuw', '8700;Koffie')
+
+def test_api_all_transactions_paginates_and_validates(webapp):
+    client = webapp.app.test_client()
+
+    first = client.get('/api/all_transactions?limit=1').json
+    assert len(first['transactions']) == 1
+    second = client.get(f"/api/all_transactions?limit=1&cursor={first['next_cursor']}").json
+    assert second['transactions'] != first['transactions']
+
+    resp = client.get('/api/all_transactions?sheet=Bankrekening&untagged=1&sort=bedrag&order=asc')
+    assert resp.status_code == 200
+    assert all(t['sheet_name'] == 'Bankrekening' and not t['tag'] for t in resp.json['transactions'])
+
+    assert client.get('/api/all_transactions?sheet=Onbekend').status_code == 400
+    assert client.get('/api/all_transactions?date_from=01-01-2026').status_code == 400
+    assert client.get('/api/all_transactions?cursor=kapot').status_code == 400
+    bad_cursor = base64.urlsafe_b64encode(json.dumps([{"x": 1}, "a", 1]).encode()).decode()
+    assert client.get(f'/api/all_transactions?cursor={bad_cursor}').status_code == 400
+    assert client.get('/api/all_transactions?limit=0').status_code == 400
+
+
+def test_read_endpoints_return_304_for_matching_etag(webapp, monkeypatch):
+    client = webapp.app.test_client()
+    first = client.get('/get_transactions')
+    etag = first.headers['ETag']
+    assert first.status_code == 200
+
+    opened = []
+    monkeypatch.setattr(webapp.transaction_store, "get", lambda path: opened.append(path))
+    monkeypatch.setattr(webapp.transaction_store, "head", lambda *args: opened.append(args))
+    for url in ('/get_transactions', '/get_total', '/api/all_transactions?limit=5'):
+        resp = client.get(url, headers={'If-None-Match': etag})
+        assert resp.status_code == 304, url
+    assert opened == []
+    monkeypatch.undo()
+
+    # Eigen wijziging (nog niet opgeslagen tag) en externe wijziging geven elk een nieuwe versie
+    webapp.tag_write_queue.submit(webapp.EXCEL_FILE_PATH, 'Bankrekening', 2, '8700;Koffie')
+    resp = client.get('/get_transactions', headers={'If-None-Match': etag})
+    assert resp.status_code == 200
+    etag = resp.headers['ETag']
+
+    webapp.tag_write_queue.flush()
+    assert client.get('/get_transactions', headers={'If-None-Match': etag}).status_code == 304
+
+    wb = openpyxl.load_workbook(webapp.EXCEL_FILE_PATH)
+    wb['Spaarrekening 1'].cell(row=2, column=12, value='4500;Huur gebouw')
+    wb.save(webapp.EXCEL_FILE_PATH)
+    stat = os.stat(webapp.EXCEL_FILE_PATH)
+    os.utime(webapp.EXCEL_FILE_PATH, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert client.get('/get_total', headers={'If-None-Match': etag}).status_code == 200
+
+
+
+def test_etag_from_previous_process_is_not_reused_after_restart(webapp):
+    first = webapp.app.test_client().get('/get_total')
+    assert first.headers['ETag'].endswith('-1"')
+
+    # Werkbestand gewijzigd terwijl de app niet draaide; na de herstart begint de teller weer bij 1
+    wb = openpyxl.load_workbook(webapp.EXCEL_FILE_PATH)
+    wb['Bankrekening'].cell(row=2, column=7, value=-999.0)
+    wb.save(webapp.EXCEL_FILE_PATH)
+    restarted = load_webapp()
+    try:
+        resp = restarted.app.test_client().get('/get_total', headers={'If-None-Match': first.headers['ETag']})
+        assert resp.status_code == 200
+        assert resp.json['total'] != first.json['total']
+        assert resp.headers['ETag'].endswith('-1"') and resp.headers['ETag'] != first.headers['ETag']
+    finally:
+        restarted.job_runner.close()
+        restarted.tag_write_queue.close()
+
+def test_recommender_status_reports_model_state(webapp):
+    resp = webapp.app.test_client().get('/recommender/status')
+    assert resp.status_code == 200
+    assert resp.json['success'] is True
+    assert resp.json['mode'] == 'batch'
+    # Zonder trainingsbestand is er geen model en ook geen training bezig
+    assert resp.json['model'] is None
+    assert resp.json['training'] is False
+
+
+def test_bulk_recommend_streams_same_results_per_chunk(webapp, monkeypatch):
+    client = webapp.app.test_client()
+    monkeypatch.setattr(webapp, 'suggest_tag_by_tegenrekening', lambda tegenrekening: '8700;Koffie')
+    monkeypatch.setattr(webapp, 'BULK_RECOMMEND_CHUNK_SIZE', 1)
+    expected = client.post('/bulk_recommend_tags').json
+
+    resp = client.post('/bulk_recommend_tags?stream=ndjson')
+    assert resp.status_code == 200
+    assert resp.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+    assert lines[:-1] == expected['results']
+    assert lines[-1] == {'done': True, 'success': True, 'count': expected['count']}
+    assert expected['count'] == 4
+
+    resp = client.post('/bulk_recommend_tags?stream=sse')
+    assert resp.mimetype == 'text/event-stream'
+    events = [json.loads(e[len('data: '):]) for e in resp.get_data(as_text=True).split('\n\n') if e]
+    assert events == lines
+
+    assert client.post('/bulk_recommend_tags?stream=xml').status_code == 400
+
+
+def test_bulk_recommend_job_runs_in_background(webapp, monkeypatch):
+    client = webapp.app.test_client()
+    monkeypatch.setattr(webapp, 'suggest_tag_by_tegenrekening', lambda tegenrekening: '8700;Koffie')
+    monkeypatch.setattr(webapp, 'BULK_RECOMMEND_CHUNK_SIZE', 1)
+    expected = client.post('/bulk_recommend_tags').json
+
+    resp = client.post('/jobs/bulk_recommend')
+    assert resp.status_code == 202
+    job_id = resp.json['job_id']
+    wait_finished(webapp.job_runner, job_id)
+
+    status = client.get(resp.json['status_url']).json
+    assert status['state'] == 'done'
+    assert status['progress'] == {'done': 4, 'total': 4}
+    assert status['results'] == expected['results'] and status['count'] == expected['count']
+    assert client.get(f'/jobs/{job_id}?offset=3').json['results'] == expected['results'][3:]
+
+    assert client.post(f'/jobs/{job_id}/cancel').json['state'] == 'done'
+    assert client.get('/jobs/onbekend').status_code == 404
+    assert client.post('/jobs/onbekend/cancel').status_code == 404
+
+
+# Start webapp.py als __main__ (zoals de launcher doet), maar wacht in plaats van app.run() op de eerste training
+LAUNCHER = """
+import runpy
+import sys
+
+import flask
+
+
+def run(app, *args, **kwargs):
+    recommender = sys.modules["__main__"].tag_recommender
+    assert recommender.wait_for_training(120)
+    print("SAMPLES", recommender.status()["samples"], flush=True)
+
+
+flask.Flask.run = run
+runpy.run_path(sys.argv[1], run_name="__main__")
+"""
+
+
+def test_history_pool_workers_do_not_repeat_webapp_startup(tmp_path):
+    app_dir = tmp_path / "app"
+    (app_dir / "static").mkdir(parents=True)
+    shutil.copy(os.path.join(ROOT, "webapp.py"), app_dir)
+    create_training_workbook(str(app_dir / "static" / "category_test_set.xlsx"), SAMPLES[:4])
+    for year, rows in (("2023", SAMPLES[4:6]), ("2024", SAMPLES[6:])):
+        (tmp_path / year).mkdir()
+        create_training_workbook(str(tmp_path / year / "grootboek.xlsx"), rows)
+
+    xlsx_path = str(tmp_path / "test.xlsx")
+    create_temp_workbook(xlsx_path, SHEETS, HEADERS)
+    config_path = str(tmp_path / "config.json")
+    config = create_temp_config(config_path, xlsx_path, SHEETS, TRAINING_TAGS)
+    config.update({
+        "training_history": [str(tmp_path / "*" / "grootboek.xlsx")],
+        "recommender_history_workers": 2,
+        "model_cache_directory": str(tmp_path / "cache"),
+        "storage_mode": "onbekend",  # Elke uitvoering van webapp.py meldt dit eenmaal op stdout
+    })
+    with open(config_path, "w", encoding="utf-8") as handle:
+        json.dump(config, handle)
+    (tmp_path / "launcher.py").write_text(LAUNCHER, encoding="utf-8")
+
+    env = {**os.environ, "BANKREKENING_CONFIG": config_path,
+           "PYTHONPATH": os.pathsep.join([ROOT, os.environ.get("PYTHONPATH", "")])}
+    proc = subprocess.run([sys.executable, str(tmp_path / "launcher.py"), str(app_dir / "webapp.py")],
+                          env=env, capture_output=True, text=True, timeout=300)
+
+    assert proc.returncode == 0, proc.stderr
+    assert "Traceback" not in proc.stderr
+    assert f"SAMPLES {len(SAMPLES)}" in proc.stdout
+    # Hoofdproces plus hooguit één import per werkproces; die starten zelf geen training (en pool) meer
+    assert 2 <= proc.stdout.count("Onbekende storage_mode") <= 3
@@ -0,0 +1,331 @@
+"""
+SQLite-index naast het werkbestand.
+Het Excel bestand blijft de bron; deze database spiegelt elke rij van de vereiste
+tabs (sleutel: tab + rijnummer) met indexen op datum, tegenrekening, tag en bedrag,
+zodat gefilterde leesacties geen volledige openpyxl-parse meer nodig hebben.
+
+Synchronisatie is incrementeel: alleen als de bestandssignatuur (mtime/grootte) of
+de inhoudsversie van de TransactionStore veranderd is, en dan alleen voor tabs
+waarvan de hash afwijkt (en binnen die tabs alleen gewijzigde rijen).
+
+query() pagineert met een cursor (keyset): elke pagina is een bereikscan over een
+gesorteerde index vanaf de laatste rij van de vorige pagina, dus O(log n + pagina)
+in plaats van een volledige doorloop of OFFSET.
+"""
+import base64
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+from transaction_store import (
+    COL_BEDRAG,
+    COL_DATUM,
+    COL_TAG,
+    COL_TEGENREKENING,
+    _row_flags,
+    decode_row,
+)
+
+ROW_WIDTH = 12  # Aantal kolommen uit REQUIRED_HEADERS dat gespiegeld wordt
+
+SCHEMA_VERSION = 2  # Ophogen bij schemawijzigingen; de index wordt dan opnieuw opgebouwd
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transactions (
+    sheet TEXT NOT NULL,
+    row_index INTEGER NOT NULL,
+    datum, naam, rekening, tegenrekening, code, af_bij,
+    bedrag, mutatiesoort, mededelingen, saldo, extra, tag,
+    datum_is_datetime INTEGER NOT NULL DEFAULT 0,
+    datum_sort TEXT NOT NULL DEFAULT '',
+    bedrag_num REAL NOT NULL DEFAULT 0,
+    recency INTEGER NOT NULL DEFAULT 0,
+    tegen_norm TEXT NOT NULL DEFAULT '',
+    tag_norm TEXT NOT NULL DEFAULT '',
+    has_datum INTEGER NOT NULL DEFAULT 0,
+    filled INTEGER NOT NULL DEFAULT 0,
+    untagged INTEGER NOT NULL DEFAULT 1,
+    row_hash TEXT NOT NULL,
+    PRIMARY KEY (sheet, row_index)
+);
+CREATE INDEX IF NOT EXISTS idx_transactions_datum ON transactions (datum_sort, sheet, recency);
+CREATE INDEX IF NOT EXISTS idx_transactions_sheet_datum ON transactions (sheet, datum_sort, recency);
+CREATE INDEX IF NOT EXISTS idx_transactions_bedrag ON transactions (bedrag_num, sheet, recency);
+CREATE INDEX IF NOT EXISTS idx_transactions_tag ON transactions (tag_norm, sheet, recency);
+CREATE INDEX IF NOT EXISTS idx_transactions_tegenrekening ON transactions (tegen_norm);
+CREATE TABLE IF NOT EXISTS sync_state (
+    sheet TEXT PRIMARY KEY,
+    sheet_hash TEXT NOT NULL
+);
+"""
+
+# Sorteersleutels voor query(): naam -> kolom; binnen gelijke waarden op tab en recentheid
+SORT_KEYS = {"datum": "datum_sort", "bedrag": "bedrag_num", "tag": "tag_norm"}
+
+VALUE_COLUMNS = ("datum", "naam", "rekening", "tegenrekening", "code", "af_bij",
+                 "bedrag", "mutatiesoort", "mededelingen", "saldo", "extra", "tag")
+
+
+def _row_hash(values: tuple) -> str:
+    return hashlib.blake2b(repr(values).encode("utf-8"), digest_size=8).hexdigest()
+
+
+def encode_cursor(values: tuple) -> str:
+    """Maak een ondoorzichtige cursor van de sorteerwaarden van de laatste rij op een pagina."""
+    return base64.urlsafe_b64encode(json.dumps(list(values)).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """Lees een cursor van encode_cursor terug. ValueError bij een ongeldige cursor."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, UnicodeError) as exc:
+        raise ValueError("Ongeldige cursor") from exc
+    if not isinstance(values, list) or len(values) != 3:
+        raise ValueError("Ongeldige cursor")
+    sort_value, sheet, recency = values
+    # Alleen waarden die encode_cursor kan maken (sorteerwaarde, tab, recentheid) mogen naar SQLite
+    if (isinstance(sort_value, bool) or not isinstance(sort_value, (str, int, float))
+            or not isinstance(sheet, str) or isinstance(recency, bool) or not isinstance(recency, int)):
+        raise ValueError("Ongeldige cursor")
+    return tuple(values)
+
+
+def _to_db_value(value):
+    if value is None or isinstance(value, (int, float, str)):
+        return value
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ")
+    return str(value)
+
+
+class TransactionIndex:
+    """Spiegelt de rijen uit een TransactionStore naar een lokale SQLite database."""
+
+    def __init__(self, store, db_directory: str | None = None):
+        self.store = store
+        self.db_directory = db_directory  # Standaard: naast het werkbestand
+        self._conn: sqlite3.Connection | None = None
+        self._db_path: str | None = None
+        self._synced: Tuple[str, int, Tuple[int, int] | None] | None = None  # (pad, versie, signatuur)
+        self._lock = threading.RLock()
+
+    def db_path_for(self, path: str) -> str:
+        directory = self.db_directory or os.path.dirname(os.path.abspath(path))
+        return os.path.join(directory, f".{os.path.basename(path)}.index.sqlite")
+
+    @staticmethod
+    def _init_schema(conn: sqlite3.Connection) -> None:
+        if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            # Verouderd schema: de index is afgeleid van het werkbestand en wordt gewoon opnieuw opgebouwd
+            conn.executescript("DROP TABLE IF EXISTS transactions; DROP TABLE IF EXISTS sync_state;")
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.executescript(SCHEMA)
+
+    def _connect(self, path: str) -> sqlite3.Connection:
+        db_path = self.db_path_for(path)
+        if self._conn is not None and self._db_path == db_path:
+            return self._conn
+        if self._conn is not None:
+            self._conn.close()
+        try:
+            conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._init_schema(conn)
+        except sqlite3.Error as exc:
+            # Bijv. alleen-lezen map: werk dan met een tijdelijke database in het geheugen
+            logging.warning("SQLite-index niet beschikbaar op %s (%s); gebruik in-memory index", db_path, exc)
+            conn = sqlite3.connect(":memory:", check_same_thread=False)
+            self._init_schema(conn)
+        conn.row_factory = sqlite3.Row
+        self._conn = conn
+        self._db_path = db_path
+        self._synced = None
+        return conn
+
+    def sync(self, path: str) -> bool:
+        """Breng de index in lijn met het werkbestand. Geeft False terug als het bestand ontbreekt."""
+        snapshot = self.store.get(path)
+        if snapshot is None:
+            return False
+        # Versie vóór de rijen uitlezen: een gelijktijdige wijziging leidt dan tot een extra sync, nooit tot een gemiste
+        state = (path, snapshot.version, snapshot.signature)
+        with self._lock:
+            conn = self._connect(path)
+            if self._synced == state:
+                return True
+            self._sync_snapshot(conn, snapshot)
+            self._synced = state
+        return True
+
+    def _sync_snapshot(self, conn: sqlite3.Connection, snapshot) -> None:
+        known_hashes = {r["sheet"]: r["sheet_hash"] for r in conn.execute("SELECT sheet, sheet_hash FROM sync_state")}
+        # Recentheid binnen een datum: bij "prepend" staat de nieuwste rij bovenaan, bij "append" onderaan
+        direction = 1 if self.store.storage_mode == "append" else -1
+        changed_rows = 0
+        with conn:
+            for sheet_name in self.store.sheet_names:
+                rows = snapshot.rows.get(sheet_name)
+                if rows is None:
+                    conn.execute("DELETE FROM transactions WHERE sheet = ?", (sheet_name,))
+                    conn.execute("DELETE FROM sync_state WHERE sheet = ?", (sheet_name,))
+                    continue
+
+                values_per_row = [tuple(row[:ROW_WIDTH]) + (None,) * max(0, ROW_WIDTH - len(row)) for row in rows]
+                # De opslagvolgorde telt mee in de hash: na omzetten wordt de recentheid herberekend
+                row_hashes = [_row_hash(values + (direction,)) for values in values_per_row]
+                sheet_hash = hashlib.blake2b("".join(row_hashes).encode("ascii"), digest_size=16).hexdigest()
+                if known_hashes.get(sheet_name) == sheet_hash:
+                    continue
+
+                existing = {r["row_index"]: r["row_hash"] for r in conn.execute(
+                    "SELECT row_index, row_hash FROM transactions WHERE sheet = ?", (sheet_name,))}
+                upserts = []
+                for row_index, (values, row_hash) in enumerate(zip(values_per_row, row_hashes), start=2):
+                    if existing.get(row_index) != row_hash:
+                        upserts.append(self._db_record(sheet_name, row_index, values, row_hash, direction))
+                conn.executemany(
+                    f"INSERT OR REPLACE INTO transactions (sheet, row_index, {', '.join(VALUE_COLUMNS)}, "
+                    "datum_is_datetime, datum_sort, bedrag_num, recency, tegen_norm, tag_norm, "
+                    "has_datum, filled, untagged, row_hash) "
+                    f"VALUES ({', '.join('?' * (len(VALUE_COLUMNS) + 12))})",
+                    upserts,
+                )
+                conn.execute("DELETE FROM transactions WHERE sheet = ? AND row_index > ?",
+                             (sheet_name, len(rows) + 1))
+                conn.execute("INSERT OR REPLACE INTO sync_state (sheet, sheet_hash) VALUES (?, ?)",
+                             (sheet_name, sheet_hash))
+                changed_rows += len(upserts)
+        logging.debug("SQLite-index gesynchroniseerd: %d rij(en) bijgewerkt", changed_rows)
+
+    @staticmethod
+    def _db_record(sheet_name: str, row_index: int, values: tuple, row_hash: str, direction: int) -> tuple:
+        datum = values[COL_DATUM]
+        is_datetime = isinstance(datum, datetime)
+        bedrag = values[COL_BEDRAG]
+        filled, untagged = _row_flags(values)
+        return (
+            sheet_name, row_index, *(_to_db_value(v) for v in values),
+            int(is_datetime),
+            datum.isoformat(sep=" ") if is_datetime else "",
+            float(bedrag) if isinstance(bedrag, (int, float)) else 0.0,
+            row_index * direction,
+            str(values[COL_TEGENREKENING] or "").strip().upper(),
+            str(values[COL_TAG] or "").strip(),
+            int(bool(datum)), int(filled), int(untagged),
+            row_hash,
+        )
+
+    @staticmethod
+    def _to_row(record: sqlite3.Row) -> tuple:
+        values = [record[col] for col in VALUE_COLUMNS]
+        if record["datum_is_datetime"]:
+            values[COL_DATUM] = datetime.fromisoformat(values[COL_DATUM])
+        return tuple(values)
+
+    def _order_clause(self) -> str:
+        if self.store.storage_mode == "append":
+            return "ORDER BY datum_sort DESC, row_index DESC"
+        return "ORDER BY row_index ASC"
+
+    def _query(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _decoded(self, records: List[sqlite3.Row]) -> List[dict]:
+        return [decode_row(r["sheet"], r["row_index"], self._to_row(r)) for r in records]
+
+    def transactions(self, sheet_name: str, limit: int | None = None) -> List[dict]:
+        """Rijen met een datum uit één tab, nieuwste eerst."""
+        sql = f"SELECT * FROM transactions WHERE sheet = ? AND has_datum = 1 {self._order_clause()}"
+        params: tuple = (sheet_name,)
+        if limit is not None:
+            sql += " LIMIT ?"
+            params += (limit,)
+        return self._decoded(self._query(sql, params))
+
+    def untagged(self, sheet_names: List[str]) -> List[dict]:
+        """Rijen zonder tag over de opgegeven tabs, in tabvolgorde en per tab nieuwste eerst."""
+        result: List[dict] = []
+        for sheet_name in sheet_names:
+            result.extend(self._decoded(self._query(
+                f"SELECT * FROM transactions WHERE sheet = ? AND untagged = 1 {self._order_clause()}",
+                (sheet_name,))))
+        return result
+
+    def stats(self, sheet_names: List[str]) -> Dict[str, Dict[str, int]]:
+        """Aantal gevulde en ongetagde rijen per tab."""
+        counts = {
+            r["sheet"]: {"total": r["total"] or 0, "untagged": r["untagged"] or 0}
+            for r in self._query(
+                "SELECT sheet, SUM(filled) AS total, SUM(filled * untagged) AS untagged "
+                "FROM transactions GROUP BY sheet")
+        }
+        return {name: counts.get(name, {"total": 0, "untagged": 0}) for name in sheet_names}
+
+    def query(self, sheet_names: List[str], *, date_from: str | None = None, date_to: str | None = None,
+              tag: str | None = None, untagged_only: bool = False, af_bij: str | None = None,
+              amount_min: float | None = None, amount_max: float | None = None,
+              sort: str = "datum", descending: bool = True, limit: int = 50,
+              cursor: str | None = None) -> Tuple[List[dict], str | None]:
+        """Eén pagina gefilterde transacties plus de cursor voor de volgende pagina (None = laatste).
+
+        Datums zijn YYYY-MM-DD (beide grenzen inclusief); bedragen gelden voor de kolom Bedrag.
+        Gelijke sorteerwaarden worden op tab en daarna op recentheid geordend.
+        """
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Onbekende sorteersleutel: {sort}")
+        if not sheet_names:
+            return [], None
+        key = SORT_KEYS[sort]
+        direction = "DESC" if descending else "ASC"
+
+        if len(sheet_names) == 1:
+            where = ["sheet = ?", "has_datum = 1"]
+        else:
+            # Unaire +: sheet alleen als filter gebruiken, zodat SQLite de gesorteerde index doorloopt
+            # in plaats van per tab te zoeken en daarna alsnog te sorteren
+            where = [f"+sheet IN ({', '.join('?' * len(sheet_names))})", "has_datum = 1"]
+        params: list = list(sheet_names)
+        if date_from:
+            where.append("datum_sort >= ?")
+            params.append(datetime.strptime(date_from, "%Y-%m-%d").isoformat(sep=" "))
+        if date_to:
+            where.append("datum_sort < ?")
+            params.append((datetime.strptime(date_to, "%Y-%m-%d") + timedelta(days=1)).isoformat(sep=" "))
+        if date_from or date_to:
+            where.append("datum_is_datetime = 1")
+        if untagged_only:
+            where.append("untagged = 1")
+        elif tag:
+            where.append("tag_norm = ?")
+            params.append(tag.strip())
+        if af_bij:
+            where.append("af_bij = ?")
+            params.append(af_bij)
+        if amount_min is not None:
+            where.append("bedrag_num >= ?")
+            params.append(amount_min)
+        if amount_max is not None:
+            where.append("bedrag_num <= ?")
+            params.append(amount_max)
+        if cursor:
+            # Keyset: verder na de laatste rij van de vorige pagina, in dezelfde volgorde
+            where.append(f"({key}, sheet, recency) {'<' if descending else '>'} (?, ?, ?)")
+            params.extend(decode_cursor(cursor))
+
+        sql = (f"SELECT *, {key} AS sort_value FROM transactions WHERE {' AND '.join(where)} "
+               f"ORDER BY {key} {direction}, sheet {direction}, recency {direction} LIMIT ?")
+        params.append(limit + 1)  # Eén extra rij om te weten of er nog een pagina is
+        records = self._query(sql, tuple(params))
+
+        next_cursor = None
+        if len(records) > limit:
+            records = records[:limit]
+            last = records[-1]
+            next_cursor = encode_cursor((last["sort_value"], last["sheet"], last["recency"]))
+        return self._decoded(records), next_cursor
@@ -0,0 +1,395 @@
+"""
+Gedeelde in-memory opslag van transacties uit het werkbestand.
+Het Excel bestand wordt één keer ingelezen (alle vereiste tabs) en pas opnieuw
+geparsed als de mtime of bestandsgrootte wijzigt, of als de app zelf schrijft.
+Tijdens dezelfde doorloop worden ook het saldo per tab en de tag-frequenties per
+tegenrekening (voor de fallback-suggestie) bepaald; daarna wordt dat
+bij eigen wijzigingen bijgewerkt (apply_tags, apply_insert) en alleen na een externe
+wijziging opnieuw berekend. Overzichten en filters worden uit de SQLite-index
+(transaction_index.py) gelezen.
+
+Opslagvolgorde ("storage_mode"):
+- "prepend": nieuwste rij staat bovenaan (rij 2); de fysieke volgorde is al nieuwste-eerst.
+- "append": nieuwe rijen worden onderaan toegevoegd; de nieuwste-eerst volgorde
+  wordt aan de leeskant bepaald (datum, daarna rijnummer, aflopend).
+"""
+import itertools
+import logging
+import os
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+
+from openpyxl import load_workbook
+
+STORAGE_MODES = ("prepend", "append")
+
+# Kolomindexen (0-based) binnen een rij, conform REQUIRED_HEADERS in webapp.py
+COL_DATUM = 0
+COL_NAAM = 1
+COL_REKENING = 2
+COL_TEGENREKENING = 3
+COL_CODE = 4
+COL_AF_BIJ = 5
+COL_BEDRAG = 6
+COL_MUTATIESOORT = 7
+COL_MEDEDELINGEN = 8
+COL_SALDO = 9
+COL_TAG = 11
+
+
+def _cell(row: tuple, idx: int):
+    return row[idx] if len(row) > idx else None
+
+
+def _row_flags(row: tuple) -> Tuple[bool, bool]:
+    """Geef (gevuld, ongetagd) terug zoals geteld in de statistieken per tab."""
+    filled = bool(row) and any(cell is not None and str(cell).strip() != '' for cell in row)
+    untagged = str(_cell(row, COL_TAG) or '').strip() == ''
+    return filled, untagged
+
+
+def decode_row(sheet_name: str, row_index: int, row: tuple) -> Dict[str, object]:
+    """Zet een ruwe Excel rij om naar het transactie-dict dat de webinterface gebruikt."""
+    datum = _cell(row, COL_DATUM)
+    bedrag = _cell(row, COL_BEDRAG)
+    saldo = _cell(row, COL_SALDO)
+    return {
+        'sheet_name': sheet_name,
+        'row_index': row_index,
+        'datum': datum.strftime('%Y-%m-%d') if isinstance(datum, datetime) else str(datum or ''),
+        'mededelingen': _cell(row, COL_MEDEDELINGEN) or _cell(row, COL_NAAM) or '',
+        'af_bij': _cell(row, COL_AF_BIJ) or '',
+        'bedrag': f"{bedrag:.2f}" if isinstance(bedrag, (int, float)) else '0.00',
+        'rekening': _cell(row, COL_REKENING) or '',
+        'tag': _cell(row, COL_TAG) or '',
+        'saldo': f"€ {saldo:.2f}" if isinstance(saldo, (int, float)) else '€ 0.00',
+    }
+
+
+def decode_training_row(row: tuple) -> Dict[str, object]:
+    """Zet een ruwe rij om naar de velden die de TagRecommender als tekst en label gebruikt."""
+    return {
+        'naam': _cell(row, COL_NAAM),
+        'mededelingen': _cell(row, COL_MEDEDELINGEN),
+        'rekening': _cell(row, COL_REKENING),
+        'tegenrekening': _cell(row, COL_TEGENREKENING),
+        'mutatiesoort': _cell(row, COL_MUTATIESOORT),
+        'code': _cell(row, COL_CODE),
+        'bedrag': _cell(row, COL_BEDRAG),
+        'tag': _cell(row, COL_TAG),
+    }
+
+
+def _with_tag(row: tuple, tag: str) -> tuple:
+    """Geef de rij terug met een andere tag (aangevuld tot en met de tagkolom)."""
+    padded = tuple(row) + (None,) * max(0, COL_TAG + 1 - len(row))
+    return padded[:COL_TAG] + (tag,) + padded[COL_TAG + 1:]
+
+
+def _tegen_key(row: tuple) -> str:
+    """Genormaliseerde tegenrekening van een rij (hoofdletters, zonder witruimte rondom)."""
+    return str(_cell(row, COL_TEGENREKENING) or '').strip().upper()
+
+
+def _amount_delta(row: tuple) -> float:
+    """Bijdrage van een rij aan het saldo: +bedrag bij "Bij", -bedrag bij "Af"."""
+    amount = _cell(row, COL_BEDRAG)
+    if not isinstance(amount, (int, float)):
+        return 0
+    af_bij = _cell(row, COL_AF_BIJ)
+    if af_bij == "Af":
+        return -amount
+    if af_bij == "Bij":
+        return amount
+    return 0
+
+
+class WorkbookSnapshot:
+    """Momentopname van de rijen en het saldo per tab.
+
+    Wordt alleen nog bijgewerkt voor wijzigingen die de app zelf doet (zie set_tag en insert_row).
+    """
+
+    def __init__(self, path: str, signature: Tuple[int, int], sheetnames: List[str]):
+        self.path = path
+        self.signature = signature
+        self.version = 0  # Oplopend versienummer van de inhoud, gezet door TransactionStore
+        self.sheetnames = sheetnames  # Alle tabs in het bestand (ook niet-vereiste)
+        self.rows: Dict[str, List[tuple]] = {}  # Per vereiste tab: rijwaarden vanaf rij 2 (lijstindex 0 == Excel rij 2)
+        self.totals: Dict[str, float] = {}  # Per tab: saldo op basis van Af/Bij en bedrag
+        self.tag_counts: Dict[str, Counter] = {}  # Genormaliseerde tegenrekening -> aantal keer per tag
+        self._best_tag: Dict[str, str | None] = {}  # argmax-cache van tag_counts per tegenrekening
+
+    def add_sheet(self, sheet_name: str, source_rows) -> None:
+        """Verwerk alle rijen van een tab in één doorloop."""
+        rows: List[tuple] = []
+        total = 0
+
+        for row in source_rows:
+            rows.append(row)
+            total += _amount_delta(row)
+            self._count_tag(row, 1)
+
+        self.rows[sheet_name] = rows
+        self.totals[sheet_name] = round(total, 2)
+
+    def insert_row(self, sheet_name: str, row_index: int, row: tuple) -> bool:
+        """Verwerk een door de app toegevoegde rij en werk het saldo bij. False als de tab onbekend is."""
+        sheet_rows = self.rows.get(sheet_name)
+        if sheet_rows is None or row_index < 2 or row_index - 2 > len(sheet_rows):
+            return False
+        # Nieuwe lijst in plaats van insert(): lezers die de oude lijst doorlopen zien geen verschuiving
+        self.rows[sheet_name] = sheet_rows[:row_index - 2] + [tuple(row)] + sheet_rows[row_index - 2:]
+        self.totals[sheet_name] = round(self.totals.get(sheet_name, 0) + _amount_delta(row), 2)
+        self._count_tag(row, 1)
+        return True
+
+    def _count_tag(self, row: tuple, delta: int) -> None:
+        """Werk de tag-frequentie van de tegenrekening van deze rij bij (+1 of -1)."""
+        key = _tegen_key(row)
+        tag = str(_cell(row, COL_TAG) or '').strip()
+        if not key or not tag:
+            return
+        counts = self.tag_counts.setdefault(key, Counter())
+        counts[tag] += delta
+        if counts[tag] <= 0:
+            del counts[tag]
+        self._best_tag.pop(key, None)
+
+    def most_common_tag(self, tegenrekening: str) -> str | None:
+        """Meest gebruikte tag voor een tegenrekening; O(1) na de eerste opvraging per rekening."""
+        key = str(tegenrekening or '').strip().upper()
+        if not key:
+            return None
+        if key not in self._best_tag:
+            counts = self.tag_counts.get(key)
+            self._best_tag[key] = counts.most_common(1)[0][0] if counts else None
+        return self._best_tag[key]
+
+    def set_tag(self, sheet_name: str, row_index: int, tag: str) -> bool:
+        """Verwerk een tag-wijziging in de rijwaarden. False als de rij onbekend is."""
+        row = self.get_row(sheet_name, row_index)
+        if row is None:
+            return False
+
+        updated = _with_tag(row, tag)
+        self._count_tag(row, -1)
+        self._count_tag(updated, 1)
+        self.rows[sheet_name][row_index - 2] = updated
+        return True
+
+    def iter_rows(self, sheet_name: str):
+        """Geef (row_index, row) paren terug voor een tab, vanaf Excel rij 2."""
+        return enumerate(self.rows.get(sheet_name, []), start=2)
+
+    def get_row(self, sheet_name: str, row_index: int) -> tuple | None:
+        """Geef de waarden van een enkele Excel rij terug, of None als die niet bestaat."""
+        sheet_rows = self.rows.get(sheet_name)
+        if sheet_rows is None or row_index < 2 or row_index - 2 >= len(sheet_rows):
+            return None
+        return sheet_rows[row_index - 2]
+
+
+class TransactionStore:
+    """Procesbrede cache van het werkbestand, ongeldig gemaakt op basis van mtime/grootte."""
+
+    def __init__(self, sheet_names: List[str],
+                 pending_tags: Callable[[str], Dict[Tuple[str, int], str]] | None = None,
+                 storage_mode: str = "prepend"):
+        self.sheet_names = list(sheet_names)
+        self.storage_mode = storage_mode  # Gebruikt door de leeskant voor de nieuwste-eerst volgorde
+        # Levert nog niet opgeslagen tags (zie TagWriteQueue.pending_for) die over een verse inlees gelegd worden
+        self.pending_tags = pending_tags
+        self._snapshot: WorkbookSnapshot | None = None
+        self._versions = itertools.count(1)
+        # Dataversie voor HTTP-caching (ETag): zonder inlezen op te vragen via data_version()
+        self._data_version = 0
+        self._seen_signature: Tuple[str, Tuple[int, int]] | None = None
+        self._lock = threading.Lock()
+        # Eigen, kort slot voor de dataversie: een 304 hoeft niet te wachten op een lopende inlees onder _lock.
+        # Volgorde: eerst _lock, dan _version_lock (nooit andersom).
+        self._version_lock = threading.Lock()
+
+    @staticmethod
+    def _signature(path: str) -> Tuple[int, int]:
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def signature(self, path: str) -> Tuple[int, int] | None:
+        """Geef (mtime_ns, grootte) van het bestand terug, of None als het niet bestaat."""
+        try:
+            return self._signature(path)
+        except OSError:
+            return None
+
+    def data_version(self, path: str) -> int | None:
+        """Geef een oplopend versienummer van de gegevens terug, of None als het bestand ontbreekt.
+
+        Kost alleen een stat(): het nummer wordt opgehoogd bij eigen wijzigingen en zodra
+        een andere bestandssignatuur (externe wijziging) wordt gezien.
+        """
+        signature = self.signature(path) if path else None
+        if signature is None:
+            return None
+        with self._version_lock:
+            if self._seen_signature != (path, signature):
+                self._seen_signature = (path, signature)
+                self._data_version += 1
+            return self._data_version
+
+    def _bump_data_version(self) -> None:
+        with self._version_lock:
+            self._data_version += 1
+
+    def _adopt_seen_signature(self, path: str, signature_before: Tuple[int, int] | None) -> None:
+        """Neem na een eigen opslag de nieuwe signatuur over.
+
+        Alleen als de signatuur van vóór het schrijven al gezien was; zo telt het eigen
+        wegschrijven niet als externe wijziging, maar blijft een tussentijdse wel zichtbaar.
+        """
+        signature = self.signature(path)
+        with self._version_lock:
+            if signature_before is not None and self._seen_signature == (path, signature_before):
+                self._seen_signature = (path, signature) if signature is not None else None
+
+    def _load(self, path: str, signature: Tuple[int, int]) -> WorkbookSnapshot:
+        wb = load_workbook(path, read_only=True, data_only=True)
+        try:
+            snapshot = WorkbookSnapshot(path, signature, list(wb.sheetnames))
+            for sheet_name in self.sheet_names:
+                if sheet_name not in wb.sheetnames:
+                    continue
+                snapshot.add_sheet(sheet_name, wb[sheet_name].iter_rows(min_row=2, values_only=True))
+            if self.pending_tags is not None:
+                for (sheet_name, row_index), tag in self.pending_tags(path).items():
+                    snapshot.set_tag(sheet_name, row_index, tag)
+            logging.debug("Werkbestand ingelezen in transactie-opslag: %s", path)
+            return snapshot
+        finally:
+            wb.close()
+
+    def get(self, path: str) -> WorkbookSnapshot | None:
+        """Geef een actuele momentopname terug; herlaad alleen als het bestand gewijzigd is."""
+        if not path or not os.path.exists(path):
+            return None
+        signature = self._signature(path)
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None and snapshot.path == path and snapshot.signature == signature:
+                return snapshot
+            snapshot = self._load(path, signature)
+            snapshot.version = next(self._versions)
+            self._snapshot = snapshot
+            return snapshot
+
+    def head(self, path: str, sheet_name: str, limit: int) -> List[Tuple[int, tuple]] | None:
+        """Geef de eerste `limit` rijen met een datum terug als (row_index, row) paren.
+
+        Met een actuele momentopname komen ze daaruit; anders wordt de tab gestreamd
+        en stopt het lezen zodra er genoeg rijen zijn (de cache wordt dan niet gevuld).
+        Bestanden zonder <dimension> element (sommige exports) worden door openpyxl bij
+        het openen nog wel volledig doorlopen; Excel zelf schrijft dat element altijd.
+        """
+        if not path or not os.path.exists(path):
+            return None
+        signature = self._signature(path)
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.path == path and snapshot.signature == signature:
+            dated = ((idx, row) for idx, row in snapshot.iter_rows(sheet_name) if _cell(row, COL_DATUM))
+            return list(itertools.islice(dated, limit))
+
+        pending = self.pending_tags(path) if self.pending_tags is not None else {}
+        result: List[Tuple[int, tuple]] = []
+        if limit <= 0:
+            return result
+        wb = load_workbook(path, read_only=True, data_only=True)
+        try:
+            if sheet_name not in wb.sheetnames:
+                return result
+            for row_index, row in enumerate(wb[sheet_name].iter_rows(min_row=2, values_only=True), start=2):
+                if not _cell(row, COL_DATUM):
+                    continue
+                tag = pending.get((sheet_name, row_index))
+                result.append((row_index, row if tag is None else _with_tag(row, tag)))
+                if len(result) >= limit:
+                    break
+            return result
+        finally:
+            wb.close()
+
+    def most_common_tag(self, path: str, tegenrekening: str) -> str | None:
+        """Meest gebruikte tag voor een tegenrekening volgens de (actuele) momentopname."""
+        snapshot = self.get(path)
+        if snapshot is None:
+            return None
+        with self._lock:
+            # Onder de lock: apply_tags kan de tellingen gelijktijdig bijwerken
+            return snapshot.most_common_tag(tegenrekening)
+
+    def tagged_transactions(self, path: str) -> List[Dict[str, object]]:
+        """Alle getagde rijen van de vereiste tabs als trainingsvoorbeelden (zie decode_training_row)."""
+        snapshot = self.get(path)
+        if snapshot is None:
+            return []
+        with self._lock:
+            # Onder de lock: apply_tags en apply_insert kunnen de rijen gelijktijdig bijwerken
+            rows = [row for sheet_rows in snapshot.rows.values() for row in sheet_rows if _cell(row, COL_TAG)]
+        return [decode_training_row(row) for row in rows]
+
+    def invalidate(self) -> None:
+        """Markeer de cache als verouderd, bijv. nadat de app zelf het bestand heeft opgeslagen."""
+        with self._lock:
+            self._snapshot = None
+            self._bump_data_version()
+
+    def apply_tags(self, path: str, updates: Dict[Tuple[str, int], str]) -> None:
+        """Verwerk tag-wijzigingen van de app zelf direct in de huidige momentopname."""
+        with self._lock:
+            # Ook zonder momentopname: de nog niet opgeslagen tags zijn al zichtbaar via pending_tags
+            self._bump_data_version()
+            snapshot = self._snapshot
+            if snapshot is None or snapshot.path != path:
+                return
+            for (sheet_name, row_index), tag in updates.items():
+                if not snapshot.set_tag(sheet_name, row_index, tag):
+                    # Onbekende rij: laat de volgende aanvraag opnieuw inlezen
+                    self._snapshot = None
+                    return
+            # Pas na het bijwerken ophogen, zodat afgeleide indexen nooit een halve wijziging als actueel zien
+            snapshot.version = next(self._versions)
+
+    def apply_insert(self, path: str, sheet_name: str, row_index: int, row: tuple,
+                     signature_before: Tuple[int, int] | None) -> None:
+        """Verwerk een door de app opgeslagen nieuwe rij zonder het bestand opnieuw in te lezen.
+
+        Net als bij mark_written alleen als de momentopname vóór het schrijven actueel
+        was; bij een externe wijziging tussendoor wordt alles opnieuw ingelezen.
+        """
+        with self._lock:
+            self._bump_data_version()
+            self._adopt_seen_signature(path, signature_before)
+            snapshot = self._snapshot
+            if (snapshot is None or snapshot.path != path or snapshot.signature != signature_before
+                    or not snapshot.insert_row(sheet_name, row_index, row)):
+                self._snapshot = None
+                return
+            snapshot.signature = self.signature(path)
+            snapshot.version = next(self._versions)
+
+    def mark_written(self, path: str, signature_before: Tuple[int, int] | None) -> None:
+        """Registreer dat de app het bestand zelf heeft opgeslagen.
+
+        Als de momentopname vóór het schrijven actueel was, bevat die al de eigen
+        wijzigingen en wordt alleen de nieuwe bestandssignatuur overgenomen; anders
+        (externe wijziging tussendoor) wordt opnieuw ingelezen.
+        """
+        with self._lock:
+            # De tags zelf telden al mee bij apply_tags; alleen de nieuwe signatuur overnemen
+            self._adopt_seen_signature(path, signature_before)
+            snapshot = self._snapshot
+            if snapshot is not None and snapshot.path == path and snapshot.signature == signature_before:
+                snapshot.signature = self.signature(path)
+            else:
+                self._snapshot = None
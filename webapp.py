@@ -18,7 +18,7 @@ Datum: 2026-01-03
 Auteur: Eric G.
 """
 
-from flask import Flask, render_template, request, jsonify, redirect, url_for, send_from_directory
+from flask import Flask, render_template, request, jsonify, redirect, url_for, send_from_directory, make_response, Response
 from werkzeug.utils import secure_filename
 from openpyxl import Workbook, load_workbook
 from datetime import datetime
@@ -26,17 +26,32 @@ import os
 import json
 import logging
 import shutil
+import copy
+import functools
+import itertools
+import hashlib
 import locale
 import getpass
 import sys
+import uuid
+import atexit
+import signal
 
 try:
-    from tag_recommender import TagRecommender
+    from tag_recommender import TagRecommender, RECOMMENDER_MODES, FEATURE_BACKENDS
+    from transaction_store import TransactionStore, STORAGE_MODES, decode_row
+    from tag_writer import TagWriteQueue
+    from transaction_index import TransactionIndex, SORT_KEYS as TRANSACTION_SORT_KEYS
+    from job_runner import JobRunner
 except ModuleNotFoundError:
     import sys as _sys
     import os as _os
     _sys.path.append(_os.path.dirname(_os.path.abspath(__file__)))
-    from tag_recommender import TagRecommender
+    from tag_recommender import TagRecommender, RECOMMENDER_MODES, FEATURE_BACKENDS
+    from transaction_store import TransactionStore, STORAGE_MODES, decode_row
+    from tag_writer import TagWriteQueue
+    from transaction_index import TransactionIndex, SORT_KEYS as TRANSACTION_SORT_KEYS
+    from job_runner import JobRunner
 
 # Fix encoding voor Windows console
 if sys.platform == 'win32':
@@ -198,41 +213,89 @@ TAGS = config["tags"]
 LOG_LEVEL = config["log_level"]
 REQUIRED_SHEETS = config.get("required_sheets", REQUIRED_SHEETS)
 TRAINING_FILE_PATH = os.path.join(SCRIPT_DIR, "static", "category_test_set.xlsx")
+# "prepend": nieuwe transactie bovenaan (rij 2), "append": onderaan toevoegen (constante kosten per invoer)
+STORAGE_MODE = config.get("storage_mode", "prepend")
+if STORAGE_MODE not in STORAGE_MODES:
+    print(f"WAARSCHUWING: Onbekende storage_mode '{STORAGE_MODE}', gebruik 'prepend'")
+    STORAGE_MODE = "prepend"
 
 # Initialiseer TagRecommender met trainingsdata en werkbestand als aanvullende data
-tag_recommender = TagRecommender(TRAINING_FILE_PATH, allowed_tags=TAGS, additional_data_path=EXCEL_FILE_PATH)
-tag_recommender.load()
+# Het getrainde model wordt in MODEL_CACHE_DIRECTORY bewaard en alleen opnieuw getraind als de bronnen wijzigen.
+# Trainen gebeurt op de achtergrond; aanvragen gebruiken intussen het vorige model.
+MODEL_CACHE_DIRECTORY = config.get("model_cache_directory", os.path.join(SCRIPT_DIR, "model_cache"))
+# "batch": hertrain na elke wijziging van het werkbestand; "online": toegekende tags direct bijleren
+RECOMMENDER_MODE = config.get("recommender_mode", "batch")
+if RECOMMENDER_MODE not in RECOMMENDER_MODES:
+    print(f"WAARSCHUWING: Onbekende recommender_mode '{RECOMMENDER_MODE}', gebruik 'batch'")
+    RECOMMENDER_MODE = "batch"
+# "tfidf": vocabulaire (groeit met de data); "hashing": vaste featuredimensie, voorspelbaar geheugen
+RECOMMENDER_FEATURE_BACKEND = config.get("recommender_feature_backend", "tfidf")
+if RECOMMENDER_FEATURE_BACKEND not in FEATURE_BACKENDS:
+    print(f"WAARSCHUWING: Onbekende recommender_feature_backend '{RECOMMENDER_FEATURE_BACKEND}', gebruik 'tfidf'")
+    RECOMMENDER_FEATURE_BACKEND = "tfidf"
+tag_recommender = TagRecommender(TRAINING_FILE_PATH, allowed_tags=TAGS, additional_data_path=EXCEL_FILE_PATH,
+                                 cache_dir=MODEL_CACHE_DIRECTORY, mode=RECOMMENDER_MODE,
+                                 refit_after_updates=config.get("recommender_refit_after_updates", 500),
+                                 refit_interval_seconds=config.get("recommender_refit_interval_hours", 24) * 3600,
+                                 background_training=True,
+                                 prediction_cache_size=config.get("recommender_prediction_cache_size", 4096),
+                                 feature_backend=RECOMMENDER_FEATURE_BACKEND,
+                                 # Werkdata uit de gedeelde opslag; het werkbestand wordt hiervoor niet opnieuw gelezen
+                                 additional_rows=lambda: transaction_store.tagged_transactions(EXCEL_FILE_PATH),
+                                 # Getagde werkboeken van eerdere boekjaren (paden of glob-patronen)
+                                 history_paths=config.get("training_history", []),
+                                 history_workers=config.get("recommender_history_workers"),
+                                 max_samples_per_tag=config.get("recommender_max_samples_per_tag"),
+                                 recency_decay=config.get("recommender_recency_decay", 1.0))
+
+# Bulk AI suggesties worden per blok berekend (en bij streaming per blok verstuurd)
+BULK_RECOMMEND_CHUNK_SIZE = config.get("bulk_recommend_chunk_size", 500)
+# Ondersteunde streaming-formaten voor /bulk_recommend_tags en hun mimetype
+BULK_STREAM_FORMATS = {'ndjson': 'application/x-ndjson', 'sse': 'text/event-stream'}
+
+# Gedeelde in-memory opslag: het werkbestand wordt alleen opnieuw geparsed als het gewijzigd is
+transaction_store = TransactionStore(REQUIRED_SHEETS, storage_mode=STORAGE_MODE)
+
+# SQLite-index naast het werkbestand voor snelle (gefilterde) leesacties
+transaction_index = TransactionIndex(transaction_store, db_directory=config.get("index_directory"))
+
+# Werkprocessen van multiprocessing ("spawn", de enige methode op Windows) importeren dit script opnieuw
+# als '__mp_main__', bijv. bij het parallel inlezen van historische werkboeken. Daar geen schrijfthread,
+# jobs of training starten: elk werkproces zou anders de hele opstart (en een eigen procespool) herhalen.
+RUNNING_AS_WORKER = __name__ == '__mp_main__'
+
+tag_write_queue = None
+job_runner = None
+if not RUNNING_AS_WORKER:
+    # Write-behind wachtrij: tag-wijzigingen worden gebundeld weggeschreven (één load/save per batch)
+    tag_write_queue = TagWriteQueue(
+        transaction_store,
+        debounce_seconds=config.get("tag_write_debounce_seconds", 2.0),
+        max_batch=config.get("tag_write_batch_size", 50),
+    )
+    transaction_store.pending_tags = tag_write_queue.pending_for
+    # Zorg dat openstaande tags bij normaal afsluiten niet verloren gaan
+    atexit.register(tag_write_queue.close)
+
+    # Achtergrondjobs voor langlopende bulkacties (begrensde pool, zodat paginaverzoeken niet hoeven te wachten)
+    job_runner = JobRunner(max_workers=config.get("job_workers", 2), max_finished=config.get("job_history_size", 50))
+    atexit.register(job_runner.close)
+
+    # Eerste training op de achtergrond, nu de gedeelde opslag beschikbaar is
+    tag_recommender.refresh_async()
 
 # Fallback: bepaal tag op basis van meest gebruikte tag voor dezelfde tegenrekening
 def suggest_tag_by_tegenrekening(tegenrekening: str) -> str | None:
-    wb = None
     try:
         tegen = str(tegenrekening or "").strip().upper()
-        if not tegen or not os.path.exists(EXCEL_FILE_PATH):
+        if not tegen:
             return None
 
-        wb = load_workbook(EXCEL_FILE_PATH, read_only=True, data_only=True)
-        tag_counts: dict[str, int] = {}
-        for sheet_name in REQUIRED_SHEETS:
-            if sheet_name not in wb.sheetnames:
-                continue
-            sheet = wb[sheet_name]
-            for row in sheet.iter_rows(min_row=2, values_only=True):
-                row_tegen = str((row[3] if len(row) > 3 else "") or "").strip().upper()
-                tag_val = str((row[11] if len(row) > 11 else "") or "").strip()
-                if row_tegen and tag_val and row_tegen == tegen:
-                    tag_counts[tag_val] = tag_counts.get(tag_val, 0) + 1
-
-        if not tag_counts:
-            return None
-        # Kies de tag met de hoogste frequentie
-        return max(tag_counts.items(), key=lambda kv: kv[1])[0]
+        # Tag-frequenties per tegenrekening worden in de transactie-opslag bijgehouden
+        return transaction_store.most_common_tag(EXCEL_FILE_PATH, tegen)
     except Exception as e:  # noqa: BLE001
         logging.error(f"Fout bij fallback suggestie op basis van tegenrekening: {str(e)}")
         return None
-    finally:
-        if wb:
-            wb.close()
 
 # Valideer alle bestandspaden bij startup
 def validate_config():
@@ -316,166 +379,89 @@ def create_backup():
         logging.error(f"Fout bij maken backup: {str(e)}")
         return False
 
-def calculate_total_amount():
-    """Bereken het totale saldo in de kas"""
+def reverse_data_rows(file_path):
+    """Keer de volgorde van de datarijen (vanaf rij 2) om in alle vereiste tabs.
+    Gebruikt bij het omzetten tussen 'prepend' en 'append' opslag. Waarden en opmaak
+    verhuizen mee; formules met relatieve verwijzingen worden niet aangepast.
+    """
+    with tag_write_queue.exclusive():
+        wb = load_workbook(file_path)
+        row_counts = {}
+        try:
+            for sheet_name in REQUIRED_SHEETS:
+                if sheet_name not in wb.sheetnames:
+                    continue
+                sheet = wb[sheet_name]
+                rows = [[(cell.value, copy.copy(cell._style)) for cell in row]
+                        for row in sheet.iter_rows(min_row=2, max_row=sheet.max_row)]
+                # Lege rijen onderaan niet mee omkeren
+                while rows and all(value is None for value, _ in rows[-1]):
+                    rows.pop()
+                row_counts[sheet_name] = len(rows)
+                for offset, row in enumerate(reversed(rows)):
+                    for col, (value, style) in enumerate(row, start=1):
+                        cell = sheet.cell(row=2 + offset, column=col)
+                        cell.value = value
+                        cell._style = style
+            wb.save(file_path)
+        finally:
+            wb.close()
+        # Tags die tijdens het omkeren binnenkwamen naar hun nieuwe rij verplaatsen (rij r wordt n + 3 - r)
+        for sheet_name, count in row_counts.items():
+            tag_write_queue.remap_rows(file_path, sheet_name,
+                                       lambda row, count=count: count + 3 - row if 2 <= row <= count + 1 else row)
+
+def calculate_total_amount(sheet_name=None):
+    """Bereken het totale saldo in de kas (of van de opgegeven tab)"""
+    return calculate_totals().get(sheet_name or EXCEL_SHEET_NAME, 0)
+
+def calculate_totals():
+    """Geef het lopende saldo per vereiste tab terug; wordt bijgehouden in de transactie-opslag."""
     try:
-        if not os.path.exists(EXCEL_FILE_PATH):
-            return 0
-        
-        wb = load_workbook(EXCEL_FILE_PATH)
-        if EXCEL_SHEET_NAME in wb.sheetnames:
-            sheet = wb[EXCEL_SHEET_NAME]
-            total = 0
-            # Kolom F = Af/Bij (kolom 6), Kolom G = Bedrag (kolom 7)
-            for row in sheet.iter_rows(min_row=2, min_col=6, max_col=7, values_only=True):
-                af_bij, amount = row
-                if isinstance(amount, (int, float)):
-                    if af_bij == "Af":
-                        total -= amount
-                    elif af_bij == "Bij":
-                        total += amount
-            return round(total, 2)
-        return 0
+        snapshot = transaction_store.get(EXCEL_FILE_PATH)
+        if snapshot is None:
+            return {}
+        return {name: snapshot.totals[name] for name in REQUIRED_SHEETS if name in snapshot.totals}
     except Exception as e:
         logging.error(f"Fout bij berekenen totaal: {str(e)}")
-        return 0
+        return {}
 
 def get_recent_transactions(limit=10):
     """Haal de meest recente transacties op"""
     try:
-        if not os.path.exists(EXCEL_FILE_PATH):
+        if STORAGE_MODE == "prepend":
+            # Nieuwste staat bovenaan: alleen de eerste `limit` rijen lezen, ongeacht de lengte van de tab
+            rows = transaction_store.head(EXCEL_FILE_PATH, EXCEL_SHEET_NAME, limit)
+            if rows is None:
+                return []
+            return [decode_row(EXCEL_SHEET_NAME, row_index, row) for row_index, row in rows]
+        if not transaction_index.sync(EXCEL_FILE_PATH):
             return []
-        
-        wb = load_workbook(EXCEL_FILE_PATH)
-        if EXCEL_SHEET_NAME not in wb.sheetnames:
-            return []
-        
-        sheet = wb[EXCEL_SHEET_NAME]
-        transactions = []
-        
-        # Start bij rij 2 (rij 1 is header)
-        for row in sheet.iter_rows(min_row=2, max_row=min(limit+1, sheet.max_row), 
-                                   values_only=True):
-            if row[0]:  # Als datum bestaat
-                transactions.append({
-                    'datum': row[0].strftime('%Y-%m-%d') if isinstance(row[0], datetime) else str(row[0]),
-                    'mededelingen': (row[8] if len(row) > 8 else None) or row[1] or '',
-                    'af_bij': row[5] or '',
-                    'bedrag': f"{row[6]:.2f}" if isinstance(row[6], (int, float)) else '0.00',
-                    'tag': row[11] or '',
-                    'saldo': f"€ {row[9]:.2f}" if isinstance(row[9], (int, float)) else '€ 0.00'
-                })
-        
-        return transactions
+        return transaction_index.transactions(EXCEL_SHEET_NAME, limit=limit)
     except Exception as e:
         logging.error(f"Fout bij ophalen transacties: {str(e)}")
         return []
 
-def get_all_transactions():
-    """Haal alle transacties op uit het Excel bestand"""
-    try:
-        if not os.path.exists(EXCEL_FILE_PATH):
-            return []
-        
-        wb = load_workbook(EXCEL_FILE_PATH)
-        if EXCEL_SHEET_NAME not in wb.sheetnames:
-            return []
-        
-        sheet = wb[EXCEL_SHEET_NAME]
-        transactions = []
-        
-        # Start bij rij 2 (rij 1 is header)
-        for row in sheet.iter_rows(min_row=2, values_only=True):
-            if row[0]:  # Als datum bestaat
-                transactions.append({
-                    'datum': row[0].strftime('%Y-%m-%d') if isinstance(row[0], datetime) else str(row[0]),
-                    'mededelingen': (row[8] if len(row) > 8 else None) or row[1] or '',
-                    'af_bij': row[5] or '',
-                    'bedrag': f"{row[6]:.2f}" if isinstance(row[6], (int, float)) else '0.00',
-                    'rekening': row[2] or '',
-                    'tag': row[11] or ''
-                })
-        
-        return transactions
-    except Exception as e:
-        logging.error(f"Fout bij ophalen alle transacties: {str(e)}")
-        return []
-
 def get_untagged_transactions():
     """Haal alle transacties op zonder ingevulde Tag (leeg of whitespace) uit alle vereiste tabs."""
     try:
-        if not os.path.exists(EXCEL_FILE_PATH):
+        if not transaction_index.sync(EXCEL_FILE_PATH):
             return []
-
-        wb = load_workbook(EXCEL_FILE_PATH, read_only=True, data_only=True)
-        transactions = []
-
-        for sheet_name in REQUIRED_SHEETS:
-            if sheet_name not in wb.sheetnames:
-                # Als een vereiste sheet ontbreekt, sla over; validatie elders bewaakt structuur
-                continue
-            sheet = wb[sheet_name]
-            for row_idx, row in enumerate(sheet.iter_rows(min_row=2, values_only=True), start=2):
-                tag_value = (row[11] if len(row) > 11 else '') or ''
-                if str(tag_value).strip() == '':
-                    transactions.append({
-                        'sheet_name': sheet_name,
-                        'row_index': row_idx,
-                        'datum': row[0].strftime('%Y-%m-%d') if isinstance(row[0], datetime) else (row[0] or ''),
-                        'mededelingen': (row[8] if len(row) > 8 else None) or row[1] or '',
-                        'af_bij': row[5] or '',
-                        'bedrag': f"{row[6]:.2f}" if isinstance(row[6], (int, float)) else '0.00',
-                        'rekening': row[2] or ''
-                    })
-
-        return transactions
+        return transaction_index.untagged(REQUIRED_SHEETS)
     except Exception as e:
         logging.error(f"Fout bij ophalen ongetagde transacties: {str(e)}")
         return []
 
-def get_all_transactions_all_sheets():
-    """Haal alle transacties uit alle vereiste tabs, inclusief bestaande Tag."""
-    try:
-        if not os.path.exists(EXCEL_FILE_PATH):
-            return []
-        wb = load_workbook(EXCEL_FILE_PATH, read_only=True, data_only=True)
-        transactions = []
-
-        for sheet_name in REQUIRED_SHEETS:
-            if sheet_name not in wb.sheetnames:
-                continue
-            sheet = wb[sheet_name]
-            for row_idx, row in enumerate(sheet.iter_rows(min_row=2, values_only=True), start=2):
-                if row and row[0]:
-                    transactions.append({
-                        'sheet_name': sheet_name,
-                        'row_index': row_idx,
-                        'datum': row[0].strftime('%Y-%m-%d') if isinstance(row[0], datetime) else (row[0] or ''),
-                        'mededelingen': (row[8] if len(row) > 8 else None) or row[1] or '',
-                        'af_bij': row[5] or '',
-                        'bedrag': f"{row[6]:.2f}" if isinstance(row[6], (int, float)) else '0.00',
-                        'rekening': row[2] or '',
-                        'tag': (row[11] if len(row) > 11 else '') or ''
-                    })
-
-        return transactions
-    except Exception as e:
-        logging.error(f"Fout bij ophalen alle transacties (alle tabs): {str(e)}")
-        return []
-
-
 def get_transaction_from_sheet(sheet_name, row_index):
     """Lees een enkele rij uit de opgegeven sheet voor AI-suggesties."""
-    wb = None
     try:
-        if not os.path.exists(EXCEL_FILE_PATH):
+        snapshot = transaction_store.get(EXCEL_FILE_PATH)
+        if snapshot is None:
             return None, "Excel bestand niet gevonden"
-        wb = load_workbook(EXCEL_FILE_PATH, read_only=True, data_only=True)
-        if sheet_name not in wb.sheetnames:
+        if sheet_name not in snapshot.rows:
             return None, "Sheet niet gevonden in Excel bestand"
 
-        sheet = wb[sheet_name]
-        row = next(sheet.iter_rows(min_row=row_index, max_row=row_index, values_only=True), None)
+        row = snapshot.get_row(sheet_name, row_index)
         if not row:
             return None, "Rij niet gevonden in sheet"
 
@@ -494,33 +480,74 @@ def get_transaction_from_sheet(sheet_name, row_index):
     except Exception as e:  # noqa: BLE001
         logging.error(f"Fout bij lezen van transactie voor AI-suggestie: {str(e)}")
         return None, f"Fout bij lezen van transactie: {str(e)}"
-    finally:
-        if wb:
-            wb.close()
+
+def learn_applied_tags(updates):
+    """Laat de recommender (online modus) net toegekende tags direct bijleren. updates: [(tab, rij, tag)]"""
+    if not tag_recommender or tag_recommender.mode != "online":
+        return
+    try:
+        for sheet_name, row_index, tag in updates:
+            transaction, _ = get_transaction_from_sheet(sheet_name, row_index)
+            if transaction:
+                tag_recommender.learn(transaction, tag)
+    except Exception as e:  # noqa: BLE001
+        logging.error(f"Fout bij bijleren van tags: {str(e)}")
 
 def get_sheet_stats():
     """Geef per vereiste tab het aantal rijen en aantal ongetagde rijen terug."""
     stats = []
     try:
-        if not os.path.exists(EXCEL_FILE_PATH):
+        if not transaction_index.sync(EXCEL_FILE_PATH):
             return stats
-        wb = load_workbook(EXCEL_FILE_PATH, read_only=True, data_only=True)
-        for sheet_name in REQUIRED_SHEETS:
-            total_rows = 0
-            untagged_rows = 0
-            if sheet_name in wb.sheetnames:
-                sheet = wb[sheet_name]
-                for row in sheet.iter_rows(min_row=2, values_only=True):
-                    if row and any(cell is not None and str(cell).strip() != '' for cell in row):
-                        total_rows += 1
-                        tag_value = (row[11] if len(row) > 11 else '') or ''
-                        if str(tag_value).strip() == '':
-                            untagged_rows += 1
-            stats.append({'sheet_name': sheet_name, 'total': total_rows, 'untagged': untagged_rows})
+        totals = calculate_totals()
+        for sheet_name, sheet_stats in transaction_index.stats(REQUIRED_SHEETS).items():
+            stats.append({'sheet_name': sheet_name, **sheet_stats, 'saldo': totals.get(sheet_name, 0)})
         return stats
     except Exception as e:
         logging.error(f"Fout bij ophalen sheet statistieken: {str(e)}")
         return stats
+
+def get_index_view():
+    """Bouw het volledige overzicht voor de hoofdpagina uit de transactie-opslag en de SQLite-index."""
+    return {
+        'total_amount': calculate_total_amount(),
+        'untagged_transactions': get_untagged_transactions(),
+        'sheet_stats': get_sheet_stats(),
+    }
+
+# De dataversie telt per proces vanaf 1: zonder dit kenmerk zou een browser na een herstart
+# met een oude ETag (zelfde teller, andere data) een onterechte 304 krijgen
+ETAG_PROCESS_NONCE = uuid.uuid4().hex
+
+def current_data_etag():
+    """ETag voor leesendpoints: dataversie van de opslag plus de instellingen die de uitkomst bepalen.
+
+    Kost alleen een stat() van het werkbestand; None als er geen werkbestand is.
+    """
+    version = transaction_store.data_version(EXCEL_FILE_PATH)
+    if version is None:
+        return None
+    context = hashlib.blake2b(f"{ETAG_PROCESS_NONCE}|{EXCEL_FILE_PATH}|{EXCEL_SHEET_NAME}|{STORAGE_MODE}".encode('utf-8'),
+                              digest_size=6).hexdigest()
+    return f"{context}-{version}"
+
+def conditional_on_data_version(view):
+    """Beantwoord een overeenkomende If-None-Match met 304 zonder het werkbestand te lezen."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        # ETag vóór het lezen bepalen: wijzigt de data tijdens de aanvraag, dan is de tag hooguit te oud
+        etag = current_data_etag()
+        if etag and request.if_none_match.contains_weak(etag):
+            response = make_response('', 304)
+            response.set_etag(etag, weak=True)
+            return response
+        response = make_response(view(*args, **kwargs))
+        if etag and response.status_code == 200:
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = 'no-cache'
+        return response
+    return wrapper
+
 @app.route('/favicon.ico')
 def favicon():
     """Serve the favicon"""
@@ -529,20 +556,16 @@ def favicon():
 @app.route('/')
 def index():
     """Hoofdpagina met invoerformulier"""
-    total_amount = calculate_total_amount()
-    untagged_transactions = get_untagged_transactions()
-    all_transactions = get_all_transactions_all_sheets()
-    sheet_stats = get_sheet_stats()
+    view = get_index_view()
     today = datetime.now().strftime('%Y-%m-%d')
     current_date_display = datetime.now().strftime('%d-%m-%Y')
     current_user = getpass.getuser()
     
     return render_template('index.html', 
                          tags=TAGS,
-                         total_amount=total_amount,
-                         untagged_transactions=untagged_transactions,
-                         all_transactions=all_transactions,
-                         sheet_stats=sheet_stats,
+                         total_amount=view['total_amount'],
+                         untagged_transactions=view['untagged_transactions'],
+                         sheet_stats=view['sheet_stats'],
                          today=today,
                          current_date=current_date_display,
                          current_user=current_user)
@@ -583,78 +606,129 @@ def recommend_tag():
         return jsonify({'success': False, 'message': f'Fout: {str(e)}'}), 500
 
 
+def iter_bulk_candidates(snapshot):
+    """Geef (sheet_name, row_index, transaction) terug voor alle rijen zonder tag, behalve "Beginsaldo" transacties."""
+    for sheet_name in REQUIRED_SHEETS:
+        for row_idx, row in snapshot.iter_rows(sheet_name):
+            if not row or len(row) < 12:
+                continue
+            
+            # Controleer of tag leeg is (kolom 12, index 11)
+            tag_val = str(row[11] or "").strip()
+            if tag_val:
+                continue  # Skip rijen die al een tag hebben
+            
+            # Controleer of deze rij "Beginsaldo" bevat in ALLE tekstkolommen
+            # Kolom 1 (index 0) = Naam, Kolom 8 (index 7) = Mutatiesoort, Kolom 9 (index 8) = Mededelingen
+            naam = str(row[0] or "").strip().lower()
+            mutatiesoort = str(row[7] or "").strip().lower() if len(row) > 7 else ""
+            mededelingen = str(row[8] or "").strip().lower() if len(row) > 8 else ""
+            
+            if "beginsaldo" in naam or "beginsaldo" in mutatiesoort or "beginsaldo" in mededelingen:
+                continue  # Skip beginsaldo transacties
+            
+            # Bouw transaction object
+            transaction = {
+                'datum': str(row[0] or ""),
+                'naam': str(row[1] or ""),
+                'rekening': str(row[2] or ""),
+                'tegenrekening': str(row[3] or ""),
+                'code': str(row[4] or ""),
+                'af_bij': str(row[5] or ""),
+                'bedrag': str(row[6] or ""),
+                'mutatiesoort': str(row[7] or ""),
+                'mededelingen': mededelingen,
+                'omschrijving': str(row[1] or "")
+            }
+            
+            yield sheet_name, row_idx, transaction
+
+
+def iter_bulk_results(snapshot, chunk_size=None):
+    """Geef de resultaten van de bulk AI suggesties terug als lijsten van maximaal chunk_size regels.
+
+    Per blok wordt recommend_batch één keer aangeroepen; er staat nooit meer dan één blok in het geheugen.
+    """
+    chunk_size = max(1, chunk_size or BULK_RECOMMEND_CHUNK_SIZE)
+    candidates = iter_bulk_candidates(snapshot)
+    while True:
+        chunk = list(itertools.islice(candidates, chunk_size))
+        if not chunk:
+            return
+        
+        # Vraag AI suggesties op voor het hele blok tegelijk (één vectorisatie en predict_proba)
+        transactions = [transaction for _, _, transaction in chunk]
+        all_suggestions = tag_recommender.recommend_batch(transactions, top_k=1) if tag_recommender else [[] for _ in chunk]
+        
+        results = []
+        for (sheet_name, row_idx, transaction), suggestions in zip(chunk, all_suggestions):
+            if not suggestions:
+                # Fallback: probeer op basis van tegenrekening
+                fallback_tag = suggest_tag_by_tegenrekening(transaction.get('tegenrekening'))
+                if fallback_tag:
+                    suggestions = [{'tag': fallback_tag, 'score': 1.0}]
+            
+            if suggestions:
+                results.append({
+                    'success': True,
+                    'sheet_name': sheet_name,
+                    'row_index': row_idx,
+                    'tag': suggestions[0]['tag']
+                })
+            else:
+                results.append({
+                    'success': False,
+                    'sheet_name': sheet_name,
+                    'row_index': row_idx,
+                    'message': 'Geen suggestie beschikbaar'
+                })
+        yield results
+
+
+def stream_bulk_results(snapshot, stream_format):
+    """Stream de bulk AI suggesties per blok als NDJSON-regels of Server-Sent Events.
+
+    Het laatste bericht heeft 'done': True met het aantal suggesties, of de foutmelding als er iets misging.
+    """
+    def encode(item):
+        line = json.dumps(item)
+        return f"data: {line}\n\n" if stream_format == 'sse' else line + "\n"
+    
+    count = 0
+    try:
+        for results in iter_bulk_results(snapshot):
+            count += sum(1 for r in results if r['success'])
+            yield ''.join(encode(r) for r in results)
+        yield encode({'done': True, 'success': True, 'count': count})
+    except Exception as e:  # noqa: BLE001
+        logging.error(f"Fout bij streamen bulk AI suggesties: {str(e)}")
+        yield encode({'done': True, 'success': False, 'count': count, 'message': f'Fout: {str(e)}'})
+
+
 @app.route('/bulk_recommend_tags', methods=['POST'])
 def bulk_recommend_tags():
-    """Pas AI suggesties toe op alle transacties zonder tag, behalve "Beginsaldo" transacties."""
+    """Pas AI suggesties toe op alle transacties zonder tag, behalve "Beginsaldo" transacties.
+
+    Met ?stream=ndjson of ?stream=sse komen de resultaten per blok binnen zodra ze berekend zijn,
+    in plaats van als één JSON-antwoord aan het eind.
+    """
     try:
         if not EXCEL_FILE_PATH or not os.path.exists(EXCEL_FILE_PATH):
             return jsonify({'success': False, 'message': 'Excel bestand niet beschikbaar'}), 400
 
-        wb = load_workbook(EXCEL_FILE_PATH, read_only=True, data_only=True)
-        results = []
+        stream_format = request.args.get('stream', '').strip().lower()
+        if stream_format and stream_format not in BULK_STREAM_FORMATS:
+            return jsonify({'success': False, 'message': f'Ongeldig stream-formaat. Kies uit: {", ".join(BULK_STREAM_FORMATS)}'}), 400
+
+        snapshot = transaction_store.get(EXCEL_FILE_PATH)
+        if stream_format:
+            response = Response(stream_bulk_results(snapshot, stream_format), mimetype=BULK_STREAM_FORMATS[stream_format])
+            # Voorkom dat een proxy de blokken opspaart tot het einde
+            response.headers['Cache-Control'] = 'no-cache'
+            response.headers['X-Accel-Buffering'] = 'no'
+            return response
         
-        for sheet_name in REQUIRED_SHEETS:
-            if sheet_name not in wb.sheetnames:
-                continue
-                
-            sheet = wb[sheet_name]
-            for row_idx, row in enumerate(sheet.iter_rows(min_row=2, values_only=True), start=2):
-                if not row or len(row) < 12:
-                    continue
-                
-                # Controleer of tag leeg is (kolom 12, index 11)
-                tag_val = str(row[11] or "").strip()
-                if tag_val:
-                    continue  # Skip rijen die al een tag hebben
-                
-                # Controleer of deze rij "Beginsaldo" bevat in ALLE tekstkolommen
-                # Kolom 1 (index 0) = Naam, Kolom 8 (index 7) = Mutatiesoort, Kolom 9 (index 8) = Mededelingen
-                naam = str(row[0] or "").strip().lower()
-                mutatiesoort = str(row[7] or "").strip().lower() if len(row) > 7 else ""
-                mededelingen = str(row[8] or "").strip().lower() if len(row) > 8 else ""
-                
-                if "beginsaldo" in naam or "beginsaldo" in mutatiesoort or "beginsaldo" in mededelingen:
-                    continue  # Skip beginsaldo transacties
-                
-                # Bouw transaction object
-                transaction = {
-                    'datum': str(row[0] or ""),
-                    'naam': str(row[1] or ""),
-                    'rekening': str(row[2] or ""),
-                    'tegenrekening': str(row[3] or ""),
-                    'code': str(row[4] or ""),
-                    'af_bij': str(row[5] or ""),
-                    'bedrag': str(row[6] or ""),
-                    'mutatiesoort': str(row[7] or ""),
-                    'mededelingen': mededelingen,
-                    'omschrijving': str(row[1] or "")
-                }
-                
-                # Vraag AI suggestie op
-                suggestions = tag_recommender.recommend(transaction, top_k=1) if tag_recommender else []
-                
-                if not suggestions:
-                    # Fallback: probeer op basis van tegenrekening
-                    fallback_tag = suggest_tag_by_tegenrekening(transaction.get('tegenrekening'))
-                    if fallback_tag:
-                        suggestions = [{'tag': fallback_tag, 'score': 1.0}]
-                
-                if suggestions:
-                    results.append({
-                        'success': True,
-                        'sheet_name': sheet_name,
-                        'row_index': row_idx,
-                        'tag': suggestions[0]['tag']
-                    })
-                else:
-                    results.append({
-                        'success': False,
-                        'sheet_name': sheet_name,
-                        'row_index': row_idx,
-                        'message': 'Geen suggestie beschikbaar'
-                    })
-        
-        wb.close()
+        results = [result for chunk in iter_bulk_results(snapshot) for result in chunk]
         return jsonify({'success': True, 'results': results, 'count': len([r for r in results if r['success']])})
     
     except Exception as e:  # noqa: BLE001
@@ -662,6 +736,57 @@ def bulk_recommend_tags():
         return jsonify({'success': False, 'message': f'Fout: {str(e)}'}), 500
 
 
+def run_bulk_recommend_job(job, snapshot):
+    """Voer de bulk AI suggesties uit als achtergrondjob; resultaten komen per blok beschikbaar."""
+    total = sum(1 for _ in iter_bulk_candidates(snapshot))
+    job.report(0, total)
+    done = count = 0
+    for results in iter_bulk_results(snapshot):
+        done += len(results)
+        count += sum(1 for r in results if r['success'])
+        job.report(done, results=results)
+    return {'count': count}
+
+
+@app.route('/jobs/bulk_recommend', methods=['POST'])
+def start_bulk_recommend_job():
+    """Start de bulk AI suggesties als achtergrondjob en geef direct het job-id terug."""
+    try:
+        if not EXCEL_FILE_PATH or not os.path.exists(EXCEL_FILE_PATH):
+            return jsonify({'success': False, 'message': 'Excel bestand niet beschikbaar'}), 400
+
+        snapshot = transaction_store.get(EXCEL_FILE_PATH)
+        job = job_runner.submit('bulk_recommend', lambda job: run_bulk_recommend_job(job, snapshot))
+        logging.info(f"Job {job.id} gestart: bulk AI suggesties")
+        return jsonify({'success': True, 'job_id': job.id, 'status_url': url_for('get_job', job_id=job.id)}), 202
+    except Exception as e:  # noqa: BLE001
+        logging.error(f"Fout bij starten bulk AI job: {str(e)}")
+        return jsonify({'success': False, 'message': f'Fout: {str(e)}'}), 500
+
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    """Geef voortgang en resultaten van een job; met ?offset=n alleen de resultaten vanaf n."""
+    job = job_runner.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Onbekende job'}), 404
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Ongeldige offset'}), 400
+    return jsonify({'success': True, **job.to_dict(offset)})
+
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Annuleer een wachtende of lopende job; al verzamelde resultaten blijven opvraagbaar."""
+    job = job_runner.cancel(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Onbekende job'}), 404
+    logging.info(f"Job {job_id} annuleren aangevraagd (status: {job.state})")
+    return jsonify({'success': True, 'job_id': job.id, 'state': job.state})
+
+
 @app.route('/update_tag', methods=['POST'])
 def update_tag():
     """Werk de Tag bij voor een specifieke rij in een opgegeven sheet."""
@@ -687,14 +812,13 @@ def update_tag():
         if TAGS and new_tag not in TAGS:
             return jsonify({'success': False, 'message': 'Tag is niet toegestaan'}), 400
 
-        wb = load_workbook(EXCEL_FILE_PATH)
-        if sheet_name not in wb.sheetnames:
+        snapshot = transaction_store.get(EXCEL_FILE_PATH)
+        if snapshot is None or sheet_name not in snapshot.sheetnames:
             return jsonify({'success': False, 'message': 'Sheet niet gevonden in Excel bestand'}), 400
-        sheet = wb[sheet_name]
 
-        # Schrijf tag in kolom 12 (Tag)
-        sheet.cell(row=row_index, column=12, value=new_tag)
-        wb.save(EXCEL_FILE_PATH)
+        # Tag (kolom 12) wordt via de write-behind wachtrij gebundeld weggeschreven
+        tag_write_queue.submit(EXCEL_FILE_PATH, sheet_name, row_index, new_tag)
+        learn_applied_tags([(sheet_name, row_index, new_tag)])
 
         user = getpass.getuser()
         logging.info(f"TAG BIJGEWERKT | Gebruiker: {user} | Sheet: {sheet_name} | Rij: {row_index} | Tag: {new_tag}")
@@ -704,6 +828,75 @@ def update_tag():
         logging.error(f"Fout bij bijwerken tag: {str(e)}")
         return jsonify({'success': False, 'message': f'Fout: {str(e)}'}), 500
 
+@app.route('/update_tags', methods=['POST'])
+def update_tags():
+    """Werk de Tag bij voor meerdere rijen tegelijk (bijv. geaccepteerde AI suggesties) in één load/save."""
+    try:
+        if not EXCEL_FILE_PATH or not os.path.exists(EXCEL_FILE_PATH):
+            return jsonify({'success': False, 'message': 'Excel bestand niet beschikbaar'}), 400
+
+        data = request.get_json() or {}
+        items = data.get('items') if isinstance(data, dict) else data
+        if not isinstance(items, list) or not items:
+            return jsonify({'success': False, 'message': 'Geen tags opgegeven'}), 400
+
+        snapshot = transaction_store.get(EXCEL_FILE_PATH)
+        sheetnames = snapshot.sheetnames if snapshot is not None else []
+
+        results = []
+        valid_updates = []
+        for item in items:
+            item = item if isinstance(item, dict) else {}
+            sheet_name = str(item.get('sheet_name', '')).strip()
+            new_tag = str(item.get('tag', '')).strip()
+            try:
+                row_index = int(str(item.get('row_index', '0')).strip() or '0')
+            except ValueError:
+                row_index = 0
+
+            result = {'sheet_name': sheet_name, 'row_index': row_index, 'tag': new_tag}
+            if sheet_name == '' or sheet_name not in REQUIRED_SHEETS:
+                message = 'Ongeldige sheet-naam'
+            elif sheet_name not in sheetnames:
+                message = 'Sheet niet gevonden in Excel bestand'
+            elif row_index < 2:
+                message = 'Ongeldige rij-index'
+            elif not new_tag:
+                message = 'Tag is verplicht'
+            elif TAGS and new_tag not in TAGS:
+                message = 'Tag is niet toegestaan'
+            else:
+                message = None
+                valid_updates.append((sheet_name, row_index, new_tag))
+
+            result['success'] = message is None
+            if message:
+                result['message'] = message
+            results.append(result)
+
+        saved = True
+        if valid_updates:
+            # Alle geldige tags in één keer via de wachtrij wegschrijven (één load/save)
+            tag_write_queue.submit_many(EXCEL_FILE_PATH, valid_updates)
+            learn_applied_tags(valid_updates)
+            saved = tag_write_queue.flush()
+            if not saved:
+                for result in results:
+                    if result['success']:
+                        result['success'] = False
+                        result['message'] = 'Opslaan mislukt; wordt later opnieuw geprobeerd'
+
+        user = getpass.getuser()
+        logging.info(f"TAGS BIJGEWERKT (BULK) | Gebruiker: {user} | Aantal: {len(valid_updates)} van {len(items)}")
+
+        updated = len([r for r in results if r['success']])
+        if not saved:
+            return jsonify({'success': False, 'message': 'Fout bij opslaan van tags', 'results': results, 'count': updated}), 500
+        return jsonify({'success': True, 'results': results, 'count': updated})
+    except Exception as e:
+        logging.error(f"Fout bij bulk bijwerken tags: {str(e)}")
+        return jsonify({'success': False, 'message': f'Fout: {str(e)}'}), 500
+
 @app.route('/add_transaction', methods=['POST'])
 def add_transaction():
     """Voeg een nieuwe transactie toe"""
@@ -757,51 +950,68 @@ def add_transaction():
         except ValueError:
             return jsonify({'success': False, 'message': 'Ongeldige datum'}), 400
         
-        # Laad of maak Excel bestand
-        if os.path.exists(EXCEL_FILE_PATH):
-            wb = load_workbook(EXCEL_FILE_PATH)
-            if EXCEL_SHEET_NAME in wb.sheetnames:
-                sheet = wb[EXCEL_SHEET_NAME]
+        # Openstaande tags eerst wegschrijven: het invoegen van een rij verschuift de rijnummers.
+        # De schrijver blijft tegengehouden tot de nieuwe rij is opgeslagen, anders overschrijven de saves elkaar.
+        with tag_write_queue.exclusive():
+            if not tag_write_queue.flush():
+                return jsonify({'success': False, 'message': 'Openstaande tags konden niet worden opgeslagen; transactie niet toegevoegd'}), 500
+            signature_before = transaction_store.signature(EXCEL_FILE_PATH)
+
+            # Laad of maak Excel bestand
+            if os.path.exists(EXCEL_FILE_PATH):
+                wb = load_workbook(EXCEL_FILE_PATH)
+                if EXCEL_SHEET_NAME in wb.sheetnames:
+                    sheet = wb[EXCEL_SHEET_NAME]
+                else:
+                    sheet = wb.create_sheet(EXCEL_SHEET_NAME)
+                    # Voeg headers toe aan de nieuwe sheet
+                    sheet.append(REQUIRED_HEADERS)
             else:
-                sheet = wb.create_sheet(EXCEL_SHEET_NAME)
-                # Voeg headers toe aan de nieuwe sheet
-                sheet.append(REQUIRED_HEADERS)
-        else:
-            wb = Workbook()
-            # Maak alle vereiste sheets aan met headers
-            main_sheet = wb.active
-            main_sheet.title = "Bankrekening"
-            main_sheet.append(REQUIRED_HEADERS)
-            for name in ["Spaarrekening 1", "Spaarrekening 2"]:
-                s = wb.create_sheet(name)
-                s.append(REQUIRED_HEADERS)
-            # Selecteer de juiste sheet om te schrijven
-            sheet = wb[EXCEL_SHEET_NAME] if EXCEL_SHEET_NAME in wb.sheetnames else wb["Bankrekening"]
+                wb = Workbook()
+                # Maak alle vereiste sheets aan met headers
+                main_sheet = wb.active
+                main_sheet.title = "Bankrekening"
+                main_sheet.append(REQUIRED_HEADERS)
+                for name in ["Spaarrekening 1", "Spaarrekening 2"]:
+                    s = wb.create_sheet(name)
+                    s.append(REQUIRED_HEADERS)
+                # Selecteer de juiste sheet om te schrijven
+                sheet = wb[EXCEL_SHEET_NAME] if EXCEL_SHEET_NAME in wb.sheetnames else wb["Bankrekening"]
         
-        # Voeg lege rij in op positie 2
-        sheet.insert_rows(2)
+            if STORAGE_MODE == "append":
+                # Voeg onderaan toe: geen verschuiving van bestaande rijen; volgorde komt uit de leeskant
+                target_row = sheet.max_row + 1
+            else:
+                # Voeg lege rij in op positie 2
+                sheet.insert_rows(2)
+                target_row = 2
         
-        # Voeg data toe op rij 2
-        row_data = [
-            datum,
-            data['mededelingen'],
-            data['rekening'],
-            data['tegenrekening'],
-            data['code'],
-            data['af_bij'],
-            bedrag,
-            data['mutatiesoort'],
-            data['mededelingen'],
-            data['saldo'],
-            '',
-            data['tag']
-        ]
+            # Voeg data toe op de doelrij
+            row_data = [
+                datum,
+                data['mededelingen'],
+                data['rekening'],
+                data['tegenrekening'],
+                data['code'],
+                data['af_bij'],
+                bedrag,
+                data['mutatiesoort'],
+                data['mededelingen'],
+                data['saldo'],
+                '',
+                data['tag']
+            ]
         
-        for col, value in enumerate(row_data, start=1):
-            sheet.cell(row=2, column=col, value=value)
+            for col, value in enumerate(row_data, start=1):
+                sheet.cell(row=target_row, column=col, value=value)
         
-        # Sla op
-        wb.save(EXCEL_FILE_PATH)
+            # Sla op
+            wb.save(EXCEL_FILE_PATH)
+            # Saldo en rijen in de opslag bijwerken zonder het bestand opnieuw in te lezen
+            transaction_store.apply_insert(EXCEL_FILE_PATH, sheet.title, target_row, tuple(row_data), signature_before)
+            if STORAGE_MODE != "append":
+                # Tags die tijdens het invoegen binnenkwamen verwijzen nog naar de oude rijnummers
+                tag_write_queue.remap_rows(EXCEL_FILE_PATH, sheet.title, lambda row: row + 1 if row >= target_row else row)
         
         # Log de actie met meer details
         user = getpass.getuser()  # Krijg Windows username
@@ -809,13 +1019,14 @@ def add_transaction():
         logging.info(f"TRANSACTIE TOEGEVOEGD | Gebruiker: {user} | IP: {ip_addr} | Datum: {data['datum']} | "
                     f"Beschrijving: {data['mededelingen']} | Bedrag: €{bedrag} | Af/Bij: {data['af_bij']} | Tag: {data['tag']}")
         
-        # Bereken nieuw totaal
-        new_total = calculate_total_amount()
+        # Nieuw totaal uit het bijgewerkte lopende saldo
+        totals = calculate_totals()
         
         return jsonify({
             'success': True, 
             'message': 'Transactie succesvol opgeslagen!',
-            'new_total': new_total
+            'new_total': totals.get(EXCEL_SHEET_NAME, 0),
+            'totals': totals
         })
         
     except Exception as e:
@@ -823,22 +1034,97 @@ def add_transaction():
         return jsonify({'success': False, 'message': f'Fout: {str(e)}'}), 500
 
 @app.route('/get_total')
+@conditional_on_data_version
 def get_total():
     """Haal het huidige totaal op"""
-    total = calculate_total_amount()
-    return jsonify({'total': total})
+    totals = calculate_totals()
+    return jsonify({'total': totals.get(EXCEL_SHEET_NAME, 0), 'totals': totals})
 
 @app.route('/get_transactions')
+@conditional_on_data_version
 def get_transactions():
     """Haal recente transacties op (AJAX)"""
     transactions = get_recent_transactions()
     return jsonify({'transactions': transactions})
 
+@app.route('/recommender/status')
+def recommender_status():
+    """Toestand van het tag-model: leeftijd, versheid en duur van de laatste training"""
+    return jsonify({'success': True, **tag_recommender.status()})
+
+def parse_transaction_query(args):
+    """Zet de query-parameters van /api/all_transactions om naar argumenten voor TransactionIndex.query.
+
+    Geeft een ValueError met een leesbare melding bij ongeldige invoer.
+    """
+    sheets = args.getlist('sheet') or REQUIRED_SHEETS
+    unknown = [name for name in sheets if name not in REQUIRED_SHEETS]
+    if unknown:
+        raise ValueError(f"Ongeldige sheet-naam: {', '.join(unknown)}")
+
+    for key in ('date_from', 'date_to'):
+        if args.get(key):
+            try:
+                datetime.strptime(args[key], '%Y-%m-%d')
+            except ValueError:
+                raise ValueError(f"Ongeldige datum voor {key} (verwacht JJJJ-MM-DD)") from None
+
+    amounts = {}
+    for key in ('amount_min', 'amount_max'):
+        value = args.get(key, '').strip()
+        if value:
+            try:
+                amounts[key] = float(value.replace(',', '.'))
+            except ValueError:
+                raise ValueError(f"Ongeldig bedrag voor {key}") from None
+
+    af_bij = args.get('af_bij') or None
+    if af_bij not in (None, 'Af', 'Bij'):
+        raise ValueError("af_bij moet 'Af' of 'Bij' zijn")
+
+    sort = args.get('sort', 'datum')
+    if sort not in TRANSACTION_SORT_KEYS:
+        raise ValueError(f"Sorteren kan op: {', '.join(TRANSACTION_SORT_KEYS)}")
+    order = args.get('order', 'desc').lower()
+    if order not in ('asc', 'desc'):
+        raise ValueError("order moet 'asc' of 'desc' zijn")
+
+    try:
+        limit = int(args.get('limit', 50))
+    except ValueError:
+        raise ValueError("limit moet een getal zijn") from None
+    if not 1 <= limit <= 500:
+        raise ValueError("limit moet tussen 1 en 500 liggen")
+
+    return {
+        'sheet_names': sheets,
+        'date_from': args.get('date_from') or None,
+        'date_to': args.get('date_to') or None,
+        'tag': args.get('tag') or None,
+        'untagged_only': args.get('untagged', '').lower() in ('1', 'true', 'yes'),
+        'af_bij': af_bij,
+        'sort': sort,
+        'descending': order == 'desc',
+        'limit': limit,
+        'cursor': args.get('cursor') or None,
+        **amounts,
+    }
+
 @app.route('/api/all_transactions')
+@conditional_on_data_version
 def api_all_transactions():
-    """Haal alle transacties op (AJAX) voor de history"""
-    transactions = get_all_transactions()
-    return jsonify({'transactions': transactions})
+    """Haal een pagina transacties op (AJAX) voor de history, met filters, sortering en cursor"""
+    try:
+        query = parse_transaction_query(request.args)
+        if not transaction_index.sync(EXCEL_FILE_PATH):
+            return jsonify({'transactions': [], 'next_cursor': None})
+        transactions, next_cursor = transaction_index.query(**query)
+        return jsonify({'transactions': transactions, 'next_cursor': next_cursor})
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        logging.error(f"Fout bij ophalen transacties (API): {str(e)}")
+        return jsonify({'success': False, 'message': f'Fout: {str(e)}'}), 500
 
 @app.route('/backup')
 def backup():
@@ -867,6 +1153,8 @@ def quit_application():
         def shutdown_server():
             import time
             time.sleep(1)  # Wacht 1 seconde zodat response verzonden kan worden
+            # os._exit slaat atexit over: schrijf openstaande tags expliciet weg
+            tag_write_queue.close()
             logging.info("Flask server wordt beëindigd...")
             os._exit(0)
         
@@ -900,7 +1188,8 @@ def settings():
         'sheet_name': EXCEL_SHEET_NAME,
         'log_level': LOG_LEVEL,
         'tags': TAGS,
-        'sheets': REQUIRED_SHEETS
+        'sheets': REQUIRED_SHEETS,
+        'storage_mode': STORAGE_MODE
     }
     return render_template('settings.html', settings=settings_info, current_date=current_date_display, current_user=current_user)
 
@@ -1139,6 +1428,56 @@ def set_log_level():
         return jsonify({'success': False, 'message': f'Fout: {str(e)}'}), 500
 
 
+@app.route('/settings/storage-mode', methods=['POST'])
+def set_storage_mode():
+    """Stel de opslagvolgorde in (prepend/append), optioneel met eenmalige migratie van het werkbestand"""
+    try:
+        user = getpass.getuser()
+        ip_addr = request.remote_addr
+        data = request.get_json() or {}
+        new_mode = str(data.get('storage_mode', '')).strip().lower()
+        migrate = bool(data.get('migrate', False))
+
+        if new_mode not in STORAGE_MODES:
+            return jsonify({'success': False, 'message': f'Opslagvolgorde moet een van deze zijn: {", ".join(STORAGE_MODES)}'}), 400
+
+        global STORAGE_MODE, config
+        old_mode = STORAGE_MODE
+        migrated = False
+
+        if migrate and new_mode != old_mode:
+            if not EXCEL_FILE_PATH or not os.path.exists(EXCEL_FILE_PATH):
+                return jsonify({'success': False, 'message': 'Excel bestand niet gevonden'}), 400
+            # Rijnummers veranderen: eerst openstaande tags wegschrijven en een backup maken
+            with tag_write_queue.exclusive():
+                if not tag_write_queue.flush():
+                    return jsonify({'success': False, 'message': 'Openstaande tags konden niet worden opgeslagen'}), 500
+                if not create_backup():
+                    return jsonify({'success': False, 'message': 'Backup maken mislukt; migratie afgebroken'}), 500
+                reverse_data_rows(EXCEL_FILE_PATH)
+            migrated = True
+
+        STORAGE_MODE = new_mode
+        transaction_store.storage_mode = new_mode
+        transaction_store.invalidate()
+        config['storage_mode'] = STORAGE_MODE
+
+        if not save_config(config):
+            return jsonify({'success': False, 'message': 'Opslaan in config.json is mislukt'}), 500
+
+        logging.info(f"INSTELLING GEWIJZIGD | Gebruiker: {user} | IP: {ip_addr} | Setting: Opslagvolgorde | "
+                    f"Van: {old_mode} | Naar: {STORAGE_MODE} | Gemigreerd: {migrated}")
+
+        return jsonify({
+            'success': True,
+            'storage_mode': STORAGE_MODE,
+            'migrated': migrated
+        })
+    except Exception as e:
+        logging.error(f"Fout bij instellen opslagvolgorde: {str(e)}")
+        return jsonify({'success': False, 'message': f'Fout: {str(e)}'}), 500
+
+
 @app.route('/settings/excel-sheet-name', methods=['POST'])
 def set_excel_sheet_name():
     """Stel Excel sheet naam in met validatie"""
@@ -1245,6 +1584,9 @@ if __name__ == '__main__':
     
     # Maak backup bij starten
     create_backup()
+
+    # Bij SIGTERM (bijv. vanuit de launcher) via sys.exit afsluiten, zodat atexit de tag-wachtrij leegt
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     
     # Log startup met gebruikersinfo
     user = getpass.getuser()